@@ -3,18 +3,63 @@ Hex Map Generator for West Marches D&D Campaigns (CustomTkinter Edition)
 A modern desktop application for generating hex-based exploration maps
 """
 
-import customtkinter as ctk
-from tkinter import messagebox, filedialog
-import tkinter as tk
+import base64
+import bisect
+import contextlib
+import hashlib
+import heapq
+import itertools
 import json
 import math
+import operator
+import os
+import queue
 import random
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
 from datetime import datetime
 from typing import Dict, List, Tuple, Optional
 
-# Set CustomTkinter appearance
-ctk.set_appearance_mode("dark")
-ctk.set_default_color_theme("blue")
+# Optional faster JSON backend
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional imaging library for the pre-rendered tile atlas and PNG export
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+    Image = None
+
+# GUI toolkit, imported by load_gui() on first use so that command line modes
+# and generation worker processes start without it
+ctk = None
+tk = None
+messagebox = None
+filedialog = None
+
+
+def load_gui():
+    """Import customtkinter and tkinter and set the CustomTkinter appearance"""
+    global ctk, tk, messagebox, filedialog
+    if ctk is not None:
+        return
+    import customtkinter
+    import tkinter
+    from tkinter import messagebox as tk_messagebox, filedialog as tk_filedialog
+    
+    # Set CustomTkinter appearance
+    customtkinter.set_appearance_mode("dark")
+    customtkinter.set_default_color_theme("blue")
+    ctk, tk, messagebox, filedialog = customtkinter, tkinter, tk_messagebox, tk_filedialog
 
 # Terrain types with colors and symbols
 STANDARD_TERRAINS = {
@@ -37,7 +82,44 @@ GRIMDARK_TERRAINS = {
     'ABYSSAL': {'name': 'Abyssal Depths', 'color': '#0d1117', 'symbol': '⚉', 'grimdark': True},
 }
 
-ALL_TERRAINS = {**STANDARD_TERRAINS, **GRIMDARK_TERRAINS}
+# Underground biomes; the grimdark ones fill the deep reaches far from the start
+UNDERDARK_TERRAINS = {
+    'CAVERNS': {'name': 'Caverns', 'color': '#57534e', 'symbol': '◠', 'grimdark': False},
+    'TUNNELS': {'name': 'Tunnels', 'color': '#44403c', 'symbol': '≡', 'grimdark': False},
+    'FUNGAL': {'name': 'Fungal Forest', 'color': '#7e22ce', 'symbol': '♣', 'grimdark': False},
+    'CRYSTAL': {'name': 'Crystal Grottoes', 'color': '#0e7490', 'symbol': '◇', 'grimdark': False},
+    'DARK_LAKE': {'name': 'Dark Lake', 'color': '#1e3a8a', 'symbol': '≈', 'grimdark': False},
+    'CHASM': {'name': 'Bottomless Chasm', 'color': '#030712', 'symbol': '▼', 'grimdark': True},
+    'MAGMA': {'name': 'Magma Flows', 'color': '#b91c1c', 'symbol': '♨', 'grimdark': True},
+    'NECROPOLIS': {'name': 'Buried Necropolis', 'color': '#3f3f46', 'symbol': '⚱', 'grimdark': True},
+    'WEBS': {'name': 'Webbed Warrens', 'color': '#52525b', 'symbol': '※', 'grimdark': True},
+}
+
+ALL_TERRAINS = {**STANDARD_TERRAINS, **GRIMDARK_TERRAINS, **UNDERDARK_TERRAINS}
+
+# Terrain sets a map layer is generated from: the surface, and the layers stacked below it
+TERRAIN_SETS = {
+    'surface': {
+        'name': 'Surface',
+        'terrains': {**STANDARD_TERRAINS, **GRIMDARK_TERRAINS},
+        'start': 'PLAINS',
+        'capital': 'City',
+        'habitable': ['PLAINS', 'FOREST', 'HILLS', 'LAKE'],
+        'settlements': ['Village', 'Town', 'Outpost', 'Fort', 'Keep', 'Hamlet'],
+        'river_sources': ['MOUNTAINS', 'HILLS'],
+        'river_outlets': ['LAKE'],
+    },
+    'underdark': {
+        'name': 'Underdark',
+        'terrains': UNDERDARK_TERRAINS,
+        'start': 'CAVERNS',
+        'capital': None,
+        'habitable': ['CAVERNS', 'FUNGAL', 'CRYSTAL', 'DARK_LAKE'],
+        'settlements': ['Enclave', 'Delve', 'Outpost', 'Hold', 'Warren'],
+        'river_sources': [],
+        'river_outlets': ['DARK_LAKE'],
+    },
+}
 
 # Biome progression rules
 BIOME_TRANSITIONS = {
@@ -54,6 +136,15 @@ BIOME_TRANSITIONS = {
     'SHADOWLANDS': ['SHADOWLANDS', 'MOUNTAINS', 'BLIGHTED', 'CORRUPTED', 'DEADLANDS'],
     'DEADLANDS': ['DEADLANDS', 'HILLS', 'TUNDRA', 'BLIGHTED', 'SHADOWLANDS', 'CURSED'],
     'CURSED': ['CURSED', 'DESERT', 'SWAMP', 'BLIGHTED', 'CORRUPTED', 'DEADLANDS'],
+    'CAVERNS': ['CAVERNS', 'TUNNELS', 'FUNGAL', 'CRYSTAL', 'DARK_LAKE', 'CHASM', 'WEBS'],
+    'TUNNELS': ['TUNNELS', 'CAVERNS', 'CRYSTAL', 'MAGMA', 'NECROPOLIS', 'WEBS'],
+    'FUNGAL': ['FUNGAL', 'CAVERNS', 'DARK_LAKE', 'WEBS'],
+    'CRYSTAL': ['CRYSTAL', 'CAVERNS', 'TUNNELS', 'MAGMA'],
+    'DARK_LAKE': ['DARK_LAKE', 'CAVERNS', 'FUNGAL', 'CHASM'],
+    'CHASM': ['CHASM', 'CAVERNS', 'DARK_LAKE', 'MAGMA', 'NECROPOLIS'],
+    'MAGMA': ['MAGMA', 'TUNNELS', 'CRYSTAL', 'CHASM'],
+    'NECROPOLIS': ['NECROPOLIS', 'TUNNELS', 'CHASM', 'WEBS'],
+    'WEBS': ['WEBS', 'CAVERNS', 'TUNNELS', 'FUNGAL', 'NECROPOLIS'],
 }
 
 # POI Generation - Adjectives and Nouns by biome
@@ -71,6 +162,15 @@ POI_ADJECTIVES = {
     'SHADOWLANDS': ['Shadowy', 'Darkened', 'Umbral', 'Tenebrous', 'Gloomy', 'Shrouded', 'Pitch-Black', 'Nightmarish'],
     'DEADLANDS': ['Lifeless', 'Ashen', 'Barren', 'Skeletal', 'Deathly', 'Bone-Strewn', 'Macabre', 'Necrotic'],
     'CURSED': ['Hexed', 'Damned', 'Doomed', 'Forsaken', 'Accursed', 'Bewitched', 'Ill-Fated', 'Jinxed'],
+    'CAVERNS': ['Echoing', 'Dripping', 'Vaulted', 'Lightless', 'Forgotten', 'Hollow', 'Silent', 'Cavernous'],
+    'TUNNELS': ['Winding', 'Narrow', 'Collapsed', 'Dwarven', 'Endless', 'Crumbling', 'Branching', 'Sealed'],
+    'FUNGAL': ['Glowing', 'Spore-Choked', 'Luminous', 'Overgrown', 'Pallid', 'Bloated', 'Fungal', 'Humming'],
+    'CRYSTAL': ['Glittering', 'Prismatic', 'Shimmering', 'Resonant', 'Jagged', 'Gleaming', 'Singing'],
+    'DARK_LAKE': ['Still', 'Black', 'Sunless', 'Drowned', 'Icy', 'Whispering', 'Bottomless', 'Mirrored'],
+    'CHASM': ['Yawning', 'Endless', 'Howling', 'Sheer', 'Fathomless', 'Vertiginous', 'Gaping'],
+    'MAGMA': ['Molten', 'Smoldering', 'Sulfurous', 'Searing', 'Blazing', 'Ashen', 'Boiling'],
+    'NECROPOLIS': ['Entombed', 'Buried', 'Silent', 'Ancestral', 'Sealed', 'Restless', 'Forgotten'],
+    'WEBS': ['Silken', 'Tangled', 'Venomous', 'Skittering', 'Cocooned', 'Clinging', 'Dread'],
 }
 
 POI_NOUNS = {
@@ -87,8 +187,96 @@ POI_NOUNS = {
     'SHADOWLANDS': ['Portal', 'Gate', 'Rift', 'Void', 'Nexus', 'Well', 'Abyss', 'Chasm'],
     'DEADLANDS': ['Graveyard', 'Crypt', 'Ossuary', 'Barrow', 'Tomb', 'Grave', 'Boneyard', 'Mausoleum'],
     'CURSED': ['Circle', 'Ground', 'Altar', 'Stone', 'Monument', 'Site', 'Place', 'Nexus'],
+    'CAVERNS': ['Hall', 'Gallery', 'Dome', 'Camp', 'Shaft', 'Ledge', 'Stair', 'Cistern'],
+    'TUNNELS': ['Passage', 'Junction', 'Gate', 'Bridge', 'Checkpoint', 'Crossing', 'Stair', 'Door'],
+    'FUNGAL': ['Garden', 'Ring', 'Grove', 'Bloom', 'Thicket', 'Colony', 'Mound'],
+    'CRYSTAL': ['Geode', 'Spire', 'Cluster', 'Vein', 'Chamber', 'Grotto', 'Mirror'],
+    'DARK_LAKE': ['Shore', 'Island', 'Ferry', 'Pool', 'Falls', 'Sump', 'Harbor'],
+    'CHASM': ['Rift', 'Bridge', 'Ledge', 'Drop', 'Abyss', 'Descent', 'Edge'],
+    'MAGMA': ['Forge', 'Vent', 'Flow', 'Caldera', 'Pool', 'Foundry', 'Crucible'],
+    'NECROPOLIS': ['Crypt', 'Ossuary', 'Tomb', 'Catacomb', 'Sepulcher', 'Vault', 'Mausoleum'],
+    'WEBS': ['Nest', 'Lair', 'Hatchery', 'Larder', 'Hollow', 'Burrow', 'Den'],
+}
+
+# Cave and dungeon POIs: surface POIs named after one of these lead down to the layer below
+LAYER_LINK_NOUNS = {'Cave', 'Cavern', 'Grotto', 'Mine', 'Warren', 'Chasm', 'Abyss', 'Crypt', 'Vault'}
+
+
+# Defaults for hex fields that older map files may not contain
+HEX_DEFAULTS = {
+    'poi': None,
+    'settlement': None,
+    'explored': False,
+    'notes': '',
+    'link': None,
+    'river': 0,
+    'road': 0,
+}
+
+# Map view colors
+UNEXPLORED_COLOR = '#374151'
+CANVAS_BG_COLOR = '#1f2937'
+SELECTION_COLOR = '#fbbf24'
+SEARCH_HIGHLIGHT_COLOR = '#f472b6'
+
+# Hex edge lines: (color, width as a fraction of the hex size) for borders
+# between biomes, between explored and unexplored hexes, and for grid lines
+BORDER_LINES = {
+    'biome': ('#e5e7eb', 0.08),
+    'fog': ('#9ca3af', 0.1),
+    'grid': ('#111827', 0.04),
 }
 
+# Map view zoom: hex sizes the mouse wheel steps through, and level-of-detail
+# thresholds (at or below LOD_OVERVIEW_MAX_SIZE the whole map is one bitmap;
+# symbols and coordinates appear from LOD_DETAIL_MIN_SIZE up)
+ZOOM_LEVELS = [0.5, 1, 2, 3, 4, 6, 8, 10, 12, 15, 18, 21, 25, 30, 35, 42, 50]
+LOD_OVERVIEW_MAX_SIZE = 4
+LOD_DETAIL_MIN_SIZE = 12
+MAP_PADDING = 100
+
+# Map view navigation: pointer movement (pixels) that turns a press into a drag
+# pan, the shortest interval between pan moves (one frame at 60 fps), and the
+# get_neighbors side each arrow key steps the selection to
+DRAG_THRESHOLD = 5
+PAN_FRAME_MS = 16
+ARROW_KEY_SIDES = {'Up': 0, 'Left': 2, 'Right': 3, 'Down': 5}
+
+# Fonts tried in order when rasterizing terrain symbols into the tile atlas
+SYMBOL_FONTS = ['seguisym.ttf', 'DejaVuSans.ttf', 'Arial Unicode.ttf', 'arialuni.ttf', 'arial.ttf']
+
+# LAN map server defaults; the listen backlog is sized for a whole table of players
+# polling at once (the http.server default of 5 drops connections)
+MAP_SERVER_PORT = 8765
+MAP_SERVER_REGION_SIZE = 16
+MAP_SERVER_REQUEST_QUEUE_SIZE = 512
+
+# Best-of-N generation: how many of the top scoring candidates are kept to compare
+CANDIDATES_KEPT = 3
+
+# Undo history: memory cap and window for merging repeated edits of the same hexes
+HISTORY_MAX_BYTES = 4 * 1024 * 1024
+HISTORY_COALESCE_SECONDS = 3.0
+# Map-level lists that only grow at the end: undo steps and the journal hold the item appended, not the list
+APPENDED_MAP_FIELDS = ('sessions',)
+
+# Autosave journal settings
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_COMPACT_INTERVAL_MS = 5 * 60 * 1000
+
+# Generation cache: bump GENERATOR_VERSION whenever a seed would generate a different map
+GENERATOR_VERSION = 6
+GENERATION_CACHE_DIR = os.path.join(
+    os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'hexmapgenerator'
+)
+GENERATION_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# Workspace: memory budget for the maps open in inactive tabs, and the estimated
+# memory of one loaded hex with its search index and regions (measured on 100x100)
+WORKSPACE_MEMORY_BUDGET_MB = 256
+WORKSPACE_HEX_BYTES = 750
+
 
 class HexGrid:
     """Manages hex grid calculations and rendering"""
@@ -122,297 +310,1859 @@ class HexGrid:
             (q - 1, r), (q + 1, r),
             (q - 1, r + 1), (q, r + 1)
         ]
+    
+    @staticmethod
+    def touching_neighbors(q: int, r: int) -> List[Tuple[int, int]]:
+        """The six hexes sharing a side with a hex as drawn (odd columns sit half a hex lower)
+
+        Ordered north, north-east, north-west, south-east, south-west, south,
+        so side i of a hex is side 5 - i of the neighbor across it.
+        """
+        shift = q % 2
+        return [
+            (q, r - 1), (q + 1, r - 1 + shift),
+            (q - 1, r - 1 + shift), (q + 1, r + shift),
+            (q - 1, r + shift), (q, r + 1)
+        ]
+    
+    @staticmethod
+    def distance(q1: int, r1: int, q2: int, r2: int) -> int:
+        """Number of get_neighbors steps between two hexes"""
+        dq, dr = q2 - q1, r2 - r1
+        return (abs(dq) + abs(dr) + abs(dq + dr)) // 2
+    
+    @staticmethod
+    def line(q1: int, r1: int, q2: int, r2: int) -> List[Tuple[int, int]]:
+        """Hexes on a straight line between two hexes, both ends included"""
+        steps = HexGrid.distance(q1, r1, q2, r2)
+        if steps == 0:
+            return [(q1, r1)]
+        hexes = []
+        for i in range(steps + 1):
+            # Interpolate in cube coordinates (nudged off exact ties) and round
+            t = i / steps
+            x = q1 + (q2 - q1) * t + 1e-6
+            z = r1 + (r2 - r1) * t + 1e-6
+            y = -x - z
+            rx, ry, rz = round(x), round(y), round(z)
+            dx, dy, dz = abs(rx - x), abs(ry - y), abs(rz - z)
+            if dx > dy and dx > dz:
+                rx = -ry - rz
+            elif dy <= dz:
+                rz = -rx - ry
+            hexes.append((rx, rz))
+        return hexes
 
 
-class MapGenerator:
-    """Handles map generation logic with improved biome clustering"""
+class HexBitset:
+    """A set of hexes stored as the bits of a Python int (bit r * width + q)
+
+    Unions, intersections and differences of whole-map masks run in C over
+    machine words, which keeps bulk fog operations cheap on large maps.
+    """
+    
+    __slots__ = ('width', 'height', 'bits')
     
-    def __init__(self, width: int, height: int, start_dir: str, factions: List[str], custom_locations: List[str]):
+    def __init__(self, width: int, height: int, bits: int = 0):
         self.width = width
         self.height = height
-        self.start_dir = start_dir
-        self.factions = factions
-        self.custom_locations = custom_locations
-        self.grid = []
+        self.bits = bits
     
-    def generate_poi_name(self, terrain: str) -> str:
-        """Generate a POI name from adjectives and nouns based on terrain"""
-        adjectives = POI_ADJECTIVES.get(terrain, POI_ADJECTIVES['PLAINS'])
-        nouns = POI_NOUNS.get(terrain, POI_NOUNS['PLAINS'])
-        
-        adjective = random.choice(adjectives)
-        noun = random.choice(nouns)
-        
-        return f"{adjective} {noun}"
+    @classmethod
+    def from_hexes(cls, width: int, height: int, hexes) -> 'HexBitset':
+        """Build from (q, r) pairs, ignoring any outside the map"""
+        bits = 0
+        for q, r in hexes:
+            if 0 <= q < width and 0 <= r < height:
+                bits |= 1 << (r * width + q)
+        return cls(width, height, bits)
     
-    def get_opposite_direction(self) -> Tuple[int, int]:
-        """Get the opposite quadrant from starting direction"""
-        if self.start_dir == 'N':
-            return (self.width // 2, self.height - 1)
-        elif self.start_dir == 'S':
-            return (self.width // 2, 0)
-        elif self.start_dir == 'E':
-            return (0, self.height // 2)
-        else:  # W
-            return (self.width - 1, self.height // 2)
+    @classmethod
+    def from_field(cls, map_data: Dict, field: str = 'explored') -> 'HexBitset':
+        """Build from a boolean hex field such as 'explored'"""
+        # Highest bit first: last row, last column
+        digits = ''.join(
+            '1' if hex_data and hex_data.get(field) else '0'
+            for row in reversed(map_data['grid'])
+            for hex_data in reversed(row)
+        )
+        return cls(map_data['width'], map_data['height'], int(digits, 2) if digits else 0)
     
-    def distance_from_start(self, q: int, r: int, start_q: int, start_r: int) -> float:
-        """Calculate distance from starting position"""
-        return math.sqrt((q - start_q) ** 2 + (r - start_r) ** 2)
+    def __contains__(self, hex_coords: Tuple[int, int]) -> bool:
+        q, r = hex_coords
+        return bool(self.bits >> (r * self.width + q) & 1)
     
-    def is_valid_transition(self, from_terrain: str, to_terrain: str) -> bool:
-        """Check if a terrain transition is allowed"""
-        return to_terrain in BIOME_TRANSITIONS.get(from_terrain, [])
+    def __len__(self) -> int:
+        return bin(self.bits).count('1')
     
-    def generate_biome_cluster(self, start_q: int, start_r: int, terrain: str, min_size: int = 5) -> set:
-        """Generate a cluster of at least min_size hexes of the same terrain"""
-        cluster = set()
-        cluster.add((start_q, start_r))
-        
-        # Different generation patterns based on terrain
-        if terrain == 'MOUNTAINS':
-            # Mountains form in linear ranges
-            return self._generate_mountain_range(start_q, start_r, min_size)
-        elif terrain in ['FOREST', 'SWAMP', 'LAKE']:
-            # Forests, swamps, and lakes form in blobs (more clustered)
-            return self._generate_blob(start_q, start_r, terrain, min_size)
-        else:
-            # Standard cluster generation for other terrains
-            return self._generate_standard_cluster(start_q, start_r, min_size)
+    def __iter__(self):
+        """Yield (q, r) for every set bit in index order"""
+        digits = bin(self.bits)[:1:-1]
+        width = self.width
+        index = digits.find('1')
+        while index != -1:
+            yield index % width, index // width
+            index = digits.find('1', index + 1)
     
-    def _generate_mountain_range(self, start_q: int, start_r: int, min_size: int) -> set:
-        """Generate mountains in a linear range pattern"""
-        cluster = set()
-        cluster.add((start_q, start_r))
-        
-        # Pick a primary direction (vertical, horizontal, or diagonal)
-        direction_type = random.choice(['horizontal', 'vertical', 'diagonal'])
-        
-        current_q, current_r = start_q, start_r
-        length = random.randint(min_size, min_size + 5)
-        
-        for _ in range(length):
-            # Move in the chosen direction with some variation
-            if direction_type == 'horizontal':
-                current_q += random.choice([-1, 0, 1])
-                current_r += random.choice([0, 1]) if random.random() < 0.3 else 0
-            elif direction_type == 'vertical':
-                current_r += random.choice([-1, 0, 1])
-                current_q += random.choice([0, 1]) if random.random() < 0.3 else 0
-            else:  # diagonal
-                current_q += random.choice([-1, 0, 1])
-                current_r += random.choice([-1, 0, 1])
-            
-            # Keep within bounds
-            current_q = max(0, min(self.width - 1, current_q))
-            current_r = max(0, min(self.height - 1, current_r))
-            
-            cluster.add((current_q, current_r))
-            
-            # Add some width to the range occasionally
-            if random.random() < 0.4:
-                for nq, nr in HexGrid.get_neighbors(current_q, current_r):
-                    if 0 <= nq < self.width and 0 <= nr < self.height:
-                        if random.random() < 0.5:
-                            cluster.add((nq, nr))
-        
-        return cluster
+    def __or__(self, other: 'HexBitset') -> 'HexBitset':
+        return HexBitset(self.width, self.height, self.bits | other.bits)
     
-    def _generate_blob(self, start_q: int, start_r: int, terrain: str, min_size: int) -> set:
-        """Generate terrain in a blob pattern (more circular/organic)"""
-        cluster = set()
-        cluster.add((start_q, start_r))
-        
-        # Blobs are rounder and more cohesive
-        target_size = random.randint(min_size, min_size + 8)
-        expansion_chance = 0.8  # Higher expansion chance for blobs
-        
-        while len(cluster) < target_size:
-            candidates = []
-            for q, r in cluster:
-                for nq, nr in HexGrid.get_neighbors(q, r):
-                    if 0 <= nq < self.width and 0 <= nr < self.height:
-                        if (nq, nr) not in cluster:
-                            # Prefer hexes closer to the center for rounder blobs
-                            distance = abs(nq - start_q) + abs(nr - start_r)
-                            weight = max(1, 10 - distance)
-                            candidates.extend([(nq, nr)] * weight)
-            
-            if not candidates:
-                break
-            
-            new_hex = random.choice(candidates)
-            cluster.add(new_hex)
-        
-        # Extra expansion for very organic blobs
-        while random.random() < expansion_chance and len(cluster) < target_size + 5:
-            candidates = set()
-            for q, r in cluster:
-                for nq, nr in HexGrid.get_neighbors(q, r):
-                    if 0 <= nq < self.width and 0 <= nr < self.height:
-                        if (nq, nr) not in cluster:
-                            candidates.add((nq, nr))
-            
-            if not candidates:
-                break
-            
-            new_hex = random.choice(list(candidates))
-            cluster.add(new_hex)
-            expansion_chance *= 0.75
-        
-        return cluster
+    def __and__(self, other: 'HexBitset') -> 'HexBitset':
+        return HexBitset(self.width, self.height, self.bits & other.bits)
     
-    def _generate_standard_cluster(self, start_q: int, start_r: int, min_size: int) -> set:
-        """Standard cluster generation for most terrains"""
-        cluster = set()
-        cluster.add((start_q, start_r))
-        
-        # Grow cluster to minimum size
-        while len(cluster) < min_size:
-            candidates = set()
-            for q, r in cluster:
-                for nq, nr in HexGrid.get_neighbors(q, r):
-                    if 0 <= nq < self.width and 0 <= nr < self.height:
-                        if (nq, nr) not in cluster:
-                            candidates.add((nq, nr))
-            
-            if not candidates:
-                break
-            
-            new_hex = random.choice(list(candidates))
-            cluster.add(new_hex)
-        
-        # Possibly expand beyond minimum size
-        expansion_chance = 0.6
-        while random.random() < expansion_chance:
-            candidates = set()
-            for q, r in cluster:
-                for nq, nr in HexGrid.get_neighbors(q, r):
-                    if 0 <= nq < self.width and 0 <= nr < self.height:
-                        if (nq, nr) not in cluster:
-                            candidates.add((nq, nr))
-            
-            if not candidates:
-                break
-            
-            new_hex = random.choice(list(candidates))
-            cluster.add(new_hex)
-            expansion_chance *= 0.7
-        
-        return cluster
+    def __sub__(self, other: 'HexBitset') -> 'HexBitset':
+        return HexBitset(self.width, self.height, self.bits & ~other.bits)
     
-    def generate(self) -> List[List[Dict]]:
-        """Generate the complete map using cluster-based terrain generation"""
-        self.grid = [[None for _ in range(self.width)] for _ in range(self.height)]
-        
-        # Determine starting position
-        if self.start_dir == 'N':
-            start_q, start_r = self.width // 2, 0
-        elif self.start_dir == 'S':
-            start_q, start_r = self.width // 2, self.height - 1
-        elif self.start_dir == 'E':
-            start_q, start_r = self.width - 1, self.height // 2
-        else:  # W
-            start_q, start_r = 0, self.height // 2
-        
-        # Calculate max distance for grimdark threshold
-        max_distance = self.distance_from_start(*self.get_opposite_direction(), start_q, start_r)
-        grimdark_threshold = max_distance * 0.6
-        
-        # Track which hexes have been assigned
-        assigned = set()
-        
-        # Start with plains cluster at starting location
-        plains_cluster = self.generate_biome_cluster(start_q, start_r, 'PLAINS', min_size=7)
-        for q, r in plains_cluster:
-            self.grid[r][q] = {
-                'terrain': 'PLAINS',
-                'poi': None,
-                'settlement': None,
-                'explored': True if (q, r) == (start_q, start_r) else False,
-                'notes': ''
-            }
-            assigned.add((q, r))
-        
-        # Place large settlement at starting location
-        faction = self.factions[0] if self.factions else 'Imperial'
-        self.grid[start_r][start_q]['settlement'] = {
-            'type': 'City',
-            'name': f"{faction} City",
-            'faction': faction
+    def __xor__(self, other: 'HexBitset') -> 'HexBitset':
+        return HexBitset(self.width, self.height, self.bits ^ other.bits)
+
+
+class SessionTimeline:
+    """The explored state at the end of each play session, kept in the map file
+
+    map_data['sessions'] lists {'name', 'date', 'explored', 'hexes'} entries in
+    play order. 'explored' is the session's explored bitset XORed with the
+    previous session's (the first one with an empty map), as little-endian
+    bytes, zlib-compressed and base64 encoded. A session reveals a small part
+    of the map, so the delta is long runs of zero bytes that zlib stores in a
+    few hundred bytes.
+    """
+    
+    @staticmethod
+    def encode(bits: int, size: int) -> str:
+        return base64.b64encode(zlib.compress(bits.to_bytes((size + 7) // 8, 'little'), 9)).decode('ascii')
+    
+    @staticmethod
+    def decode(data: str) -> int:
+        return int.from_bytes(zlib.decompress(base64.b64decode(data)), 'little')
+    
+    @classmethod
+    def states(cls, map_data: Dict) -> List[HexBitset]:
+        """Explored hexes after each session, rebuilt by applying the deltas in order"""
+        width, height = map_data['width'], map_data['height']
+        bits = 0
+        states = []
+        for session in map_data.get('sessions', []):
+            bits ^= cls.decode(session['explored'])
+            states.append(HexBitset(width, height, bits))
+        return states
+    
+    @classmethod
+    def snapshot(cls, map_data: Dict, name: str) -> Dict:
+        """A session entry for the map's current explored state"""
+        states = cls.states(map_data)
+        previous = states[-1].bits if states else 0
+        explored = HexBitset.from_field(map_data, 'explored')
+        return {
+            'name': name,
+            'date': datetime.now().strftime('%Y-%m-%d'),
+            'explored': cls.encode(explored.bits ^ previous, map_data['width'] * map_data['height']),
+            'hexes': len(explored)
         }
-        
-        # Generate terrain clusters
-        attempts = 0
-        max_attempts = self.width * self.height * 3
-        
-        while len(assigned) < self.width * self.height and attempts < max_attempts:
-            attempts += 1
-            
-            # Find an unassigned hex adjacent to assigned terrain
-            border_hexes = []
-            for q, r in assigned:
+
+
+class BiomeRegions:
+    """Contiguous single-terrain regions of a grid, labelled with union-find
+
+    A region is identified by the flat index (r * width + q) of its root hex.
+    Ids are only stable until the next terrain edit touching the region.
+    Terrain edits are applied with update(q, r) after the grid changed; the
+    cost is proportional to the size of the regions involved, not the map.
+    """
+    
+    def __init__(self, grid: List[List[Optional[Dict]]]):
+        self.grid = grid
+        self.height = len(grid)
+        self.width = len(grid[0]) if grid else 0
+        self.parent = list(range(self.width * self.height))
+        self.size = {}
+        self.bbox = {}
+        self.terrain = {}
+        
+        # Union each hex with its already visited neighbors of the same terrain
+        sizes = [1] * len(self.parent)
+        for r in range(self.height):
+            for q in range(self.width):
+                terrain = self.terrain_at(q, r)
+                index = r * self.width + q
                 for nq, nr in HexGrid.get_neighbors(q, r):
-                    if 0 <= nq < self.width and 0 <= nr < self.height:
-                        if (nq, nr) not in assigned:
-                            border_hexes.append((nq, nr, self.grid[r][q]['terrain']))
-            
-            if not border_hexes:
-                # No border hexes, pick a random unassigned hex
-                unassigned = [(q, r) for q in range(self.width) for r in range(self.height) 
-                             if (q, r) not in assigned]
-                if not unassigned:
-                    break
-                seed_q, seed_r = random.choice(unassigned)
-                
-                # Determine if grimdark zone
-                distance = self.distance_from_start(seed_q, seed_r, start_q, start_r)
-                is_grimdark = distance > grimdark_threshold
-                
-                if is_grimdark:
-                    new_terrain = random.choice(list(GRIMDARK_TERRAINS.keys()))
-                else:
-                    new_terrain = random.choice(list(STANDARD_TERRAINS.keys()))
-            else:
-                seed_q, seed_r, adjacent_terrain = random.choice(border_hexes)
-                
-                # Determine if grimdark zone
-                distance = self.distance_from_start(seed_q, seed_r, start_q, start_r)
-                is_grimdark = distance > grimdark_threshold
-                
-                # Choose terrain based on transitions and zone
-                valid_transitions = BIOME_TRANSITIONS.get(adjacent_terrain, [])
-                
-                if is_grimdark:
-                    # Filter for grimdark terrains
-                    grimdark_options = [t for t in valid_transitions if t in GRIMDARK_TERRAINS]
-                    if grimdark_options:
-                        new_terrain = random.choice(grimdark_options)
-                    else:
-                        new_terrain = random.choice(list(GRIMDARK_TERRAINS.keys()))
+                    neighbor = nr * self.width + nq
+                    if 0 <= nq < self.width and 0 <= nr < self.height and neighbor < index \
+                            and self.terrain_at(nq, nr) == terrain:
+                        self._union(index, neighbor, sizes)
+        
+        for r in range(self.height):
+            for q in range(self.width):
+                root = self.find(r * self.width + q)
+                if root in self.size:
+                    self.size[root] += 1
+                    q0, r0, q1, r1 = self.bbox[root]
+                    self.bbox[root] = (min(q0, q), min(r0, r), max(q1, q), max(r1, r))
                 else:
-                    # Filter for standard terrains
-                    standard_options = [t for t in valid_transitions if t in STANDARD_TERRAINS]
-                    if standard_options:
-                        new_terrain = random.choice(standard_options)
-                    else:
-                        new_terrain = random.choice(list(STANDARD_TERRAINS.keys()))
-            
-            # Generate cluster
-            cluster_size = random.randint(5, 12)
-            cluster = self.generate_biome_cluster(seed_q, seed_r, new_terrain, min_size=cluster_size)
-            
-            # Assign terrain to cluster
-            for q, r in cluster:
-                if (q, r) not in assigned:
-                    self.grid[r][q] = {
-                        'terrain': new_terrain,
+                    self.size[root] = 1
+                    self.bbox[root] = (q, r, q, r)
+                    self.terrain[root] = self.terrain_at(q, r)
+    
+    def terrain_at(self, q: int, r: int) -> Optional[str]:
+        hex_data = self.grid[r][q]
+        return hex_data['terrain'] if hex_data else None
+    
+    def find(self, index: int) -> int:
+        parent = self.parent
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]  # path halving
+            index = parent[index]
+        return index
+    
+    def _union(self, a: int, b: int, sizes: List[int]) -> int:
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if sizes[a] < sizes[b]:
+            a, b = b, a
+        self.parent[b] = a
+        sizes[a] += sizes[b]
+        return a
+    
+    def region(self, q: int, r: int) -> int:
+        """Id of the region containing (q, r)"""
+        return self.find(r * self.width + q)
+    
+    def __len__(self) -> int:
+        return len(self.size)
+    
+    def regions(self) -> List[Tuple[int, Optional[str], int, Tuple[int, int, int, int]]]:
+        """(id, terrain, size, (q0, r0, q1, r1)) for every region"""
+        return [(root, self.terrain[root], size, self.bbox[root]) for root, size in self.size.items()]
+    
+    def hexes(self, region: int) -> List[Tuple[int, int]]:
+        """All hexes of a region (scans only its bounding box)"""
+        q0, r0, q1, r1 = self.bbox[region]
+        return [(q, r) for r in range(r0, r1 + 1) for q in range(q0, q1 + 1)
+                if self.find(r * self.width + q) == region]
+    
+    def undersized(self, min_size: int) -> List[int]:
+        """Ids of regions smaller than min_size, smallest first"""
+        return sorted((root for root, size in self.size.items() if size < min_size),
+                      key=lambda root: (self.size[root], root))
+    
+    def update(self, q: int, r: int):
+        """Relabel after the terrain of (q, r) changed in the grid"""
+        index = r * self.width + q
+        old = self.find(index)
+        old_terrain, new_terrain = self.terrain[old], self.terrain_at(q, r)
+        if old_terrain == new_terrain:
+            return
+        
+        # The old region may fall apart: relabel its remaining hexes by flood fill
+        members = [(mq, mr) for mq, mr in self.hexes(old) if (mq, mr) != (q, r)]
+        for region_q, region_r in members:
+            self.parent[region_r * self.width + region_q] = -1
+        del self.size[old], self.bbox[old], self.terrain[old]
+        for start_q, start_r in members:
+            start = start_r * self.width + start_q
+            if self.parent[start] != -1:
+                continue
+            self.parent[start] = start
+            self.size[start] = 0
+            self.bbox[start] = (start_q, start_r, start_q, start_r)
+            self.terrain[start] = old_terrain
+            stack = [(start_q, start_r)]
+            while stack:
+                cq, cr = stack.pop()
+                self._add(start, cq, cr)
+                for nq, nr in HexGrid.get_neighbors(cq, cr):
+                    neighbor = nr * self.width + nq
+                    if 0 <= nq < self.width and 0 <= nr < self.height and self.parent[neighbor] == -1:
+                        self.parent[neighbor] = start
+                        stack.append((nq, nr))
+        
+        # The edited hex starts a region of its own and merges with its new neighbors
+        self.parent[index] = index
+        self.size[index] = 0
+        self.bbox[index] = (q, r, q, r)
+        self.terrain[index] = new_terrain
+        self._add(index, q, r)
+        for nq, nr in HexGrid.get_neighbors(q, r):
+            if 0 <= nq < self.width and 0 <= nr < self.height and self.terrain_at(nq, nr) == new_terrain:
+                self._merge(self.find(index), self.find(nr * self.width + nq))
+    
+    def _add(self, root: int, q: int, r: int):
+        self.size[root] += 1
+        q0, r0, q1, r1 = self.bbox[root]
+        self.bbox[root] = (min(q0, q), min(r0, r), max(q1, q), max(r1, r))
+    
+    def _merge(self, a: int, b: int):
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size.pop(b)
+        q0, r0, q1, r1 = self.bbox.pop(b)
+        aq0, ar0, aq1, ar1 = self.bbox[a]
+        self.bbox[a] = (min(aq0, q0), min(ar0, r0), max(aq1, q1), max(ar1, r1))
+        del self.terrain[b]
+
+
+# Terrains that stop line of sight (the blocking hex itself is still seen)
+SIGHT_BLOCKING_TERRAINS = {'MOUNTAINS', 'FOREST', 'CORRUPTED', 'SHADOWLANDS'}
+
+# Map view click tools: plain selection plus the bulk reveal operations
+FOG_TOOLS = ['Select', 'Reveal Radius', 'Reveal Path', 'Reveal Polygon', 'Reveal Region', 'Line of Sight',
+             'Regenerate Radius', 'Regenerate Rectangle']
+
+
+class FogTools:
+    """Builders for the hex masks used by bulk reveal operations
+
+    Distances and adjacency follow HexGrid.get_neighbors.
+    """
+    
+    @staticmethod
+    def radius(map_data: Dict, q: int, r: int, radius: int) -> HexBitset:
+        """All hexes within radius steps of (q, r)"""
+        hexes = ((q + dq, r + dr)
+                 for dq in range(-radius, radius + 1)
+                 for dr in range(max(-radius, -dq - radius), min(radius, -dq + radius) + 1))
+        return HexBitset.from_hexes(map_data['width'], map_data['height'], hexes)
+    
+    @staticmethod
+    def path(map_data: Dict, waypoints: List[Tuple[int, int]], radius: int = 0) -> HexBitset:
+        """Hexes along straight lines through the waypoints, widened by radius"""
+        mask = HexBitset(map_data['width'], map_data['height'])
+        hexes = waypoints[:1]
+        for (q1, r1), (q2, r2) in zip(waypoints, waypoints[1:]):
+            hexes.extend(HexGrid.line(q1, r1, q2, r2)[1:])
+        if radius == 0:
+            return HexBitset.from_hexes(map_data['width'], map_data['height'], hexes)
+        for q, r in hexes:
+            mask = mask | FogTools.radius(map_data, q, r, radius)
+        return mask
+    
+    @staticmethod
+    def polygon(map_data: Dict, vertices: List[Tuple[float, float]]) -> HexBitset:
+        """Hexes whose centers lie inside a polygon given in hex_size=1 pixel units"""
+        width, height = map_data['width'], map_data['height']
+        if len(vertices) < 3:
+            return HexBitset(width, height)
+        xs = [x for x, _ in vertices]
+        ys = [y for _, y in vertices]
+        edges = list(zip(vertices, vertices[1:] + vertices[:1]))
+        
+        hexes = []
+        column_width = math.sqrt(3)
+        for q in range(max(0, int(min(xs) / column_width)), min(width, int(max(xs) / column_width) + 2)):
+            for r in range(max(0, int(min(ys) / 2) - 1), min(height, int(max(ys) / 2) + 2)):
+                x, y = HexGrid.axial_to_pixel(q, r, 1)
+                # Even-odd rule
+                inside = False
+                for (x1, y1), (x2, y2) in edges:
+                    if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                        inside = not inside
+                if inside:
+                    hexes.append((q, r))
+        return HexBitset.from_hexes(width, height, hexes)
+    
+    @staticmethod
+    def flood_fill(map_data: Dict, q: int, r: int, limit: Optional[int] = None) -> HexBitset:
+        """The contiguous region of the same terrain as (q, r)"""
+        width, height, grid = map_data['width'], map_data['height'], map_data['grid']
+        terrain = grid[r][q]['terrain']
+        seen = {(q, r)}
+        frontier = [(q, r)]
+        while frontier and (limit is None or len(seen) < limit):
+            cq, cr = frontier.pop()
+            for nq, nr in HexGrid.get_neighbors(cq, cr):
+                if (nq, nr) not in seen and 0 <= nq < width and 0 <= nr < height \
+                        and grid[nr][nq] and grid[nr][nq]['terrain'] == terrain:
+                    seen.add((nq, nr))
+                    frontier.append((nq, nr))
+        return HexBitset.from_hexes(width, height, seen)
+    
+    @staticmethod
+    def line_of_sight(map_data: Dict, q: int, r: int, radius: int) -> HexBitset:
+        """Hexes visible from (q, r) within radius; SIGHT_BLOCKING_TERRAINS stop a ray"""
+        width, height, grid = map_data['width'], map_data['height'], map_data['grid']
+        seen = {(q, r)}
+        # Cast a ray to every hex on the outer ring
+        ring = [(q + dq, r + dr)
+                for dq in range(-radius, radius + 1)
+                for dr in range(-radius, radius + 1)
+                if HexGrid.distance(0, 0, dq, dr) == radius]
+        for tq, tr in ring:
+            for hq, hr in HexGrid.line(q, r, tq, tr)[1:]:
+                if not (0 <= hq < width and 0 <= hr < height) or not grid[hr][hq]:
+                    break
+                seen.add((hq, hr))
+                if grid[hr][hq]['terrain'] in SIGHT_BLOCKING_TERRAINS:
+                    break
+        return HexBitset.from_hexes(width, height, seen)
+
+
+# Climate fields: the largest noise features span 1/CLIMATE_FEATURES of the map; each terrain
+# prefers some elevation, temperature and moisture (0 to 1) within CLIMATE_TOLERANCE
+CLIMATE_FEATURES = 3
+CLIMATE_OCTAVES = 4
+CLIMATE_TOLERANCE = 0.2
+TERRAIN_CLIMATE = {
+    'PLAINS': {'elevation': 0.35, 'moisture': 0.45},
+    'FOREST': {'elevation': 0.45, 'moisture': 0.7},
+    'HILLS': {'elevation': 0.65},
+    'MOUNTAINS': {'elevation': 0.85},
+    'SWAMP': {'elevation': 0.2, 'moisture': 0.85},
+    'DESERT': {'temperature': 0.85, 'moisture': 0.15},
+    'TUNDRA': {'temperature': 0.15},
+    'LAKE': {'elevation': 0.15, 'moisture': 0.75},
+}
+
+
+class ClimateFields:
+    """Elevation, temperature and moisture of every hex, computed in bulk for a whole map
+
+    Each field is a flat list of values from 0 to 1 (index r * width + q).
+    Elevation and moisture are fractal value noise; temperature follows the
+    latitude (cold north, warm south) and drops with elevation. The fields
+    only depend on the map size and seed; they are saved with the map
+    (pack) so later stages read them instead of computing them again.
+    """
+    
+    FIELDS = ('elevation', 'temperature', 'moisture')
+    
+    def __init__(self, width: int, height: int, fields: Dict[str, List[float]]):
+        self.width = width
+        self.height = height
+        self.fields = fields
+    
+    @classmethod
+    def generate(cls, width: int, height: int, seed) -> 'ClimateFields':
+        rng = random.Random(f"{seed}:climate")
+        scale = max(width, height) / CLIMATE_FEATURES
+        elevation = cls.fractal_noise(width, height, rng, scale)
+        moisture_noise = cls.fractal_noise(width, height, rng, scale)
+        temperature_noise = cls.fractal_noise(width, height, rng, scale)
+        latitude = [r / max(1, height - 1) for r in range(height) for _ in range(width)]
+        return cls(width, height, {
+            'elevation': elevation,
+            'temperature': [0.6 * lat + 0.2 * noise + 0.2 * (1 - elev)
+                            for lat, noise, elev in zip(latitude, temperature_noise, elevation)],
+            'moisture': [0.7 * noise + 0.3 * (1 - elev) for noise, elev in zip(moisture_noise, elevation)],
+        })
+    
+    @staticmethod
+    def fractal_noise(width: int, height: int, rng: random.Random, scale: float,
+                      octaves: int = CLIMATE_OCTAVES) -> List[float]:
+        """Value noise summed over octaves, each twice as fine and half as strong, scaled to 0..1
+
+        Every octave interpolates a coarse lattice of random values; the
+        lattice cell and smoothstep weight of each column and row are worked
+        out once, so a hex costs two lookups and three interpolations.
+        """
+        total = [0.0] * (width * height)
+        amplitude = 1.0
+        for octave in range(octaves):
+            cell = max(1.0, scale / 2 ** octave)
+            lattice = [[rng.random() for _ in range(int(width * 0.866 / cell) + 2)]
+                       for _ in range(int(height / cell) + 2)]
+            # Hex columns are sqrt(3)/2 row heights apart
+            columns = ClimateFields.lattice_steps(width, 0.866 / cell)
+            rows = ClimateFields.lattice_steps(height, 1.0 / cell)
+            index = 0
+            for j, v in rows:
+                top, bottom = lattice[j], lattice[j + 1]
+                for i, u in columns:
+                    a = top[i] + (top[i + 1] - top[i]) * u
+                    b = bottom[i] + (bottom[i + 1] - bottom[i]) * u
+                    total[index] += amplitude * (a + (b - a) * v)
+                    index += 1
+            amplitude /= 2
+        low, high = min(total), max(total)
+        return [(value - low) / (high - low) for value in total] if high > low else [0.5] * len(total)
+    
+    @staticmethod
+    def lattice_steps(count: int, spacing: float) -> List[Tuple[int, float]]:
+        """Lattice cell and smoothstep weight of each of count evenly spaced columns or rows"""
+        steps = []
+        for step in range(count):
+            position = step * spacing
+            i = int(position)
+            t = position - i
+            steps.append((i, t * t * (3 - 2 * t)))
+        return steps
+    
+    def suitability(self, terrain: str, q: int, r: int) -> float:
+        """How well a terrain fits a hex's climate: 1 at its preferred values, towards 0 away from them"""
+        preferred = TERRAIN_CLIMATE.get(terrain)
+        if not preferred:
+            return 1.0
+        index = r * self.width + q
+        distance = sum((self.fields[field][index] - value) ** 2 for field, value in preferred.items())
+        # Unsuited terrains stay possible, just unlikely
+        return math.exp(-distance / (2 * CLIMATE_TOLERANCE ** 2)) + 0.02
+    
+    def pack(self) -> Dict[str, str]:
+        """The fields as saved: one byte per hex, zlib-compressed and base64 encoded"""
+        return {
+            field: base64.b64encode(zlib.compress(bytes(round(value * 255) for value in values), 6)).decode('ascii')
+            for field, values in self.fields.items()
+        }
+    
+    @classmethod
+    def unpack(cls, width: int, height: int, packed: Dict[str, str]) -> 'ClimateFields':
+        return cls(width, height, {
+            field: [byte / 255 for byte in zlib.decompress(base64.b64decode(data))]
+            for field, data in packed.items()
+        })
+    
+    @classmethod
+    def for_map(cls, map_data: Dict) -> Optional['ClimateFields']:
+        """The fields saved with a map, or computed from its seed for maps saved without them"""
+        if map_data.get('climate'):
+            return cls.unpack(map_data['width'], map_data['height'], map_data['climate'])
+        if map_data.get('seed') is not None:
+            return cls.generate(map_data['width'], map_data['height'], map_data['seed'])
+        return None
+
+
+# Rivers and roads: derived elevation of each terrain (others count as RIVER_DEFAULT_ELEVATION),
+# hexes per river source, and the cost of entering a hex on a road (missing terrains are impassable)
+TERRAIN_ELEVATION = {
+    'MOUNTAINS': 1.0, 'SHADOWLANDS': 0.8, 'HILLS': 0.6, 'TUNDRA': 0.5, 'DEADLANDS': 0.5, 'FOREST': 0.4,
+    'CORRUPTED': 0.4, 'SWAMP': 0.1, 'CURSED': 0.2, 'LAKE': 0.0, 'ABYSSAL': 0.0, 'DARK_LAKE': 0.0, 'CHASM': 0.0,
+}
+RIVER_DEFAULT_ELEVATION = 0.3
+RIVER_HEXES_PER_SOURCE = 150
+RIVER_MIN_LENGTH = 3
+TERRAIN_TRAVEL_COST = {
+    'PLAINS': 1, 'DESERT': 2, 'FOREST': 2, 'TUNDRA': 3, 'HILLS': 3, 'SWAMP': 4, 'MOUNTAINS': 6,
+    'BLIGHTED': 3, 'CORRUPTED': 4, 'DEADLANDS': 4, 'CURSED': 5, 'SHADOWLANDS': 6,
+    'CAVERNS': 1, 'TUNNELS': 1, 'FUNGAL': 2, 'CRYSTAL': 2, 'NECROPOLIS': 4, 'WEBS': 5,
+}
+RIVER_COLOR = '#38bdf8'
+ROAD_COLOR = '#d6b98c'
+# How rivers and roads are drawn: hex field, color and line width relative to the hex size
+NETWORK_LINES = (('river', RIVER_COLOR, 0.2), ('road', ROAD_COLOR, 0.12))
+
+
+class HexNetwork:
+    """Rivers and roads, stored per hex as bitmasks of the sides they cross
+
+    Bit i of a hex's 'river' or 'road' field is set when it runs through the
+    side shared with HexGrid.touching_neighbors(q, r)[i]; that side is side
+    5 - i of the neighbor, which carries the bit too, so every hex can draw
+    its own part. Rivers follow the drainage of a priority-flood from the lakes and
+    the map edge over the terrain's elevation and the climate's. Roads
+    follow a minimum spanning tree of the cheapest terrain-weighted routes
+    between settlements, found with a single multi-source Dijkstra search.
+    """
+    
+    FIELDS = ('river', 'road')
+    # Downstream "side" of a lake hex: the river ends in it
+    OUTLET = 6
+    
+    @staticmethod
+    def connect(grid: List[List[Dict]], q: int, r: int, side: int, field: str):
+        """Run a river or road through one side of a hex (and the matching side of its neighbor)"""
+        grid[r][q][field] = grid[r][q].get(field, 0) | 1 << side
+        nq, nr = HexGrid.touching_neighbors(q, r)[side]
+        if 0 <= nr < len(grid) and 0 <= nq < len(grid[nr]) and grid[nr][nq]:
+            grid[nr][nq][field] = grid[nr][nq].get(field, 0) | 1 << (5 - side)
+    
+    @staticmethod
+    def elevation(grid: List[List[Dict]], field: List[float]) -> List[float]:
+        """Elevation of every hex (index r * width + q): its terrain's, shaped by the climate elevation field"""
+        return [
+            TERRAIN_ELEVATION.get(hex_data['terrain'], RIVER_DEFAULT_ELEVATION) + 0.5 * field_value
+            if hex_data else 0.0
+            for hex_data, field_value in zip((hex_data for row in grid for hex_data in row), field)
+        ]
+    
+    @classmethod
+    def drainage(cls, grid: List[List[Dict]], elevation: List[float], outlets) -> List[int]:
+        """Downstream side of every hex, by priority-flood from the outlet terrains and the map edge
+
+        Hexes are reached lowest first, so water in a depression spills over
+        its lowest rim instead of getting stuck. Outlet hexes get OUTLET, edge
+        hexes a side leading off the map, unreachable hexes -1.
+        """
+        height, width = len(grid), len(grid[0])
+        downstream = [-1] * (width * height)
+        heap = []
+        for r, row in enumerate(grid):
+            for q, hex_data in enumerate(row):
+                if not hex_data:
+                    continue
+                if hex_data['terrain'] in outlets:
+                    side = cls.OUTLET
+                else:
+                    side = next((side for side, (nq, nr) in enumerate(HexGrid.touching_neighbors(q, r))
+                                 if not (0 <= nq < width and 0 <= nr < height)), -1)
+                if side >= 0:
+                    downstream[r * width + q] = side
+                    heap.append((elevation[r * width + q], r * width + q))
+        heapq.heapify(heap)
+        
+        while heap:
+            level, index = heapq.heappop(heap)
+            q, r = index % width, index // width
+            for side, (nq, nr) in enumerate(HexGrid.touching_neighbors(q, r)):
+                if 0 <= nq < width and 0 <= nr < height and grid[nr][nq]:
+                    neighbor = nr * width + nq
+                    if downstream[neighbor] == -1:
+                        downstream[neighbor] = 5 - side
+                        heapq.heappush(heap, (max(level, elevation[neighbor]), neighbor))
+        return downstream
+    
+    @classmethod
+    def add_rivers(cls, grid: List[List[Dict]], rng: random.Random, elevation: List[float], sources,
+                   outlets) -> int:
+        """Run rivers from some of the source terrain hexes down to an outlet or the map edge
+
+        A river stops where it joins an earlier one. Returns the number of rivers.
+        """
+        height, width = len(grid), len(grid[0])
+        candidates = [(q, r) for r, row in enumerate(grid) for q, hex_data in enumerate(row)
+                      if hex_data and hex_data['terrain'] in sources]
+        if not candidates:
+            return 0
+        downstream = cls.drainage(grid, elevation, outlets)
+        rivers = 0
+        for q, r in rng.sample(candidates, min(len(candidates), max(1, width * height // RIVER_HEXES_PER_SOURCE))):
+            path = []
+            while 0 <= q < width and 0 <= r < height:
+                side = downstream[r * width + q]
+                if side in (-1, cls.OUTLET) or (path and grid[r][q].get('river')):
+                    break
+                path.append((q, r, side))
+                q, r = HexGrid.touching_neighbors(q, r)[side]
+            if len(path) < RIVER_MIN_LENGTH or grid[path[0][1]][path[0][0]].get('river'):
+                continue
+            for q, r, side in path:
+                cls.connect(grid, q, r, side, 'river')
+            rivers += 1
+        return rivers
+    
+    @classmethod
+    def add_roads(cls, grid: List[List[Dict]]) -> int:
+        """Connect the settlements by roads along a minimum spanning tree of their cheapest routes
+
+        One Dijkstra search from all settlements at once splits the map into
+        the areas closest to each; every pair of neighboring areas gives a
+        candidate route (the MST of those is the MST of all shortest routes),
+        and Kruskal's algorithm keeps the cheapest that join separate groups.
+        Returns the number of routes.
+        """
+        height, width = len(grid), len(grid[0])
+        size = width * height
+        # Settlements can always be entered, even on a lake
+        cost = [TERRAIN_TRAVEL_COST.get(hex_data['terrain'], 1 if hex_data['settlement'] else None) if hex_data
+                else None for row in grid for hex_data in row]
+        distance = [math.inf] * size
+        owner = [-1] * size
+        back = [-1] * size  # side leading one step closer to the owning settlement
+        heap = []
+        for r, row in enumerate(grid):
+            for q, hex_data in enumerate(row):
+                if hex_data and hex_data['settlement']:
+                    distance[r * width + q] = 0
+                    owner[r * width + q] = r * width + q
+                    heap.append((0, r * width + q))
+        
+        while heap:
+            d, index = heapq.heappop(heap)
+            if d > distance[index]:
+                continue
+            q, r = index % width, index // width
+            for side, (nq, nr) in enumerate(HexGrid.touching_neighbors(q, r)):
+                if 0 <= nq < width and 0 <= nr < height:
+                    neighbor = nr * width + nq
+                    step = cost[neighbor]
+                    if step is not None and d + step < distance[neighbor]:
+                        distance[neighbor] = d + step
+                        owner[neighbor] = owner[index]
+                        back[neighbor] = 5 - side
+                        heapq.heappush(heap, (d + step, neighbor))
+        
+        # Cheapest crossing between each pair of neighboring areas
+        crossings = {}
+        for index in range(size):
+            if owner[index] < 0:
+                continue
+            q, r = index % width, index // width
+            for side, (nq, nr) in enumerate(HexGrid.touching_neighbors(q, r)):
+                if 0 <= nq < width and 0 <= nr < height:
+                    neighbor = nr * width + nq
+                    if owner[neighbor] >= 0 and owner[neighbor] != owner[index]:
+                        key = (min(owner[index], owner[neighbor]), max(owner[index], owner[neighbor]))
+                        total = distance[index] + cost[neighbor] + distance[neighbor]
+                        if key not in crossings or total < crossings[key][0]:
+                            crossings[key] = (total, index, side)
+        
+        groups = {}
+        
+        def find(index):
+            while groups.get(index, index) != index:
+                groups[index] = groups.get(groups[index], groups[index])
+                index = groups[index]
+            return index
+        
+        routes = 0
+        for (a, b), (total, index, side) in sorted(crossings.items(), key=lambda item: item[1][0]):
+            root_a, root_b = find(a), find(b)
+            if root_a == root_b:
+                continue
+            groups[root_b] = root_a
+            q, r = index % width, index // width
+            cls.connect(grid, q, r, side, 'road')
+            nq, nr = HexGrid.touching_neighbors(q, r)[side]
+            for start in (index, nr * width + nq):
+                # Walk back to the settlement each end belongs to
+                while back[start] >= 0:
+                    q, r = start % width, start // width
+                    cls.connect(grid, q, r, back[start], 'road')
+                    nq, nr = HexGrid.touching_neighbors(q, r)[back[start]]
+                    start = nr * width + nq
+            routes += 1
+        return routes
+    
+    @staticmethod
+    def polyline(q: int, r: int, mask: int, to_pixel) -> List[float]:
+        """Coordinates of one hex's part of a river or road: from the center to each crossed side
+
+        to_pixel(q, r) gives hex centers; the line runs out to each side's
+        midpoint and back through the center, so a single line covers forks.
+        """
+        x, y = to_pixel(q, r)
+        coords = []
+        for side, (nq, nr) in enumerate(HexGrid.touching_neighbors(q, r)):
+            if mask >> side & 1:
+                nx, ny = to_pixel(nq, nr)
+                coords.extend(((x + nx) / 2, (y + ny) / 2, x, y))
+        return coords[:-2] if len(coords) > 4 else coords
+
+
+class HexBorders:
+    """Edges between hexes as a few long polylines instead of one outline per hex
+
+    Points are on the integer vertex lattice of the drawn tiling: x in steps
+    of size / sqrt(3) and y in steps of size, with hex (q, r) centered on
+    (3q, 2r + q % 2). Lines pass through the gaps between the hex polygons,
+    and neighboring edges share exact end points so they chain together.
+    """
+    
+    # The three sides of a hex facing down and right, as (dq, dr on even
+    # columns, end points relative to the center): south, south east, north east.
+    # These are the visually touching hexes, not the get_neighbors layout.
+    FORWARD_SIDES = (
+        (0, 1, ((-1, 1), (1, 1))),
+        (1, 0, ((2, 0), (1, 1))),
+        (1, -1, ((1, -1), (2, 0))),
+    )
+    
+    @staticmethod
+    def center(q: int, r: int) -> Tuple[int, int]:
+        """Lattice point of a hex center"""
+        return 3 * q, 2 * r + q % 2
+    
+    @classmethod
+    def edges(cls, grid: List[List[Optional[Dict]]], hex_range: Tuple[int, int, int, int], fog_enabled: bool,
+              explored: Optional[HexBitset] = None) -> Dict[str, List[Tuple[Tuple[int, int], Tuple[int, int]]]]:
+        """Biome and fog border segments of the hexes in range, from one pass over touching pairs
+
+        explored, if given, replaces the hexes' own explored flags.
+        """
+        q0, q1, r0, r1 = hex_range
+        height, width = len(grid), len(grid[0]) if grid else 0
+        segments = {'biome': [], 'fog': []}
+        for r in range(r0, r1):
+            row = grid[r]
+            for q in range(q0, q1):
+                hex_data = row[q]
+                if not hex_data:
+                    continue
+                x, y = cls.center(q, r)
+                hex_explored = hex_data['explored'] if explored is None else (q, r) in explored
+                for dq, dr, ((ax, ay), (bx, by)) in cls.FORWARD_SIDES:
+                    nq, nr = q + dq, r + dr + (q % 2 if dq else 0)
+                    if not (0 <= nq < width and 0 <= nr < height):
+                        continue
+                    other = grid[nr][nq]
+                    if not other:
+                        continue
+                    other_explored = other['explored'] if explored is None else (nq, nr) in explored
+                    if fog_enabled and hex_explored != other_explored:
+                        kind = 'fog'
+                    elif hex_data['terrain'] != other['terrain'] and (hex_explored or not fog_enabled):
+                        # Only borders the player can see: both hexes explored
+                        kind = 'biome'
+                    else:
+                        continue
+                    segments[kind].append(((x + ax, y + ay), (x + bx, y + by)))
+        return segments
+    
+    @staticmethod
+    def chain(segments: List[Tuple[Tuple[int, int], Tuple[int, int]]]) -> List[List[Tuple[int, int]]]:
+        """Join segments that share end points into as few polylines as possible
+
+        Hex sides never continue in a straight line, so joining end to end is
+        the whole merge. Walks start from the odd end points (where an open
+        border stops or forks), which leaves only closed loops at the end.
+        """
+        joined = {}
+        for a, b in segments:
+            joined.setdefault(a, []).append(b)
+            joined.setdefault(b, []).append(a)
+        starts = [point for point, others in joined.items() if len(others) % 2]
+        lines = []
+        for start in starts + list(joined):
+            while joined[start]:
+                point, line = start, [start]
+                while joined[point]:
+                    following = joined[point].pop()
+                    joined[following].remove(point)
+                    line.append(following)
+                    point = following
+                lines.append(line)
+        return lines
+    
+    @classmethod
+    def grid_lines(cls, hex_range: Tuple[int, int, int, int]) -> List[List[Tuple[int, int]]]:
+        """Every hex side in range as one zigzag per column
+
+        Each column's line runs down its right side and steps back and forth
+        along each bottom side; drawing an edge twice looks the same as once.
+        """
+        q0, q1, r0, r1 = hex_range
+        lines = []
+        if r0 >= r1:
+            return lines
+        # The left side of the first column has no column to its left drawing it
+        left = []
+        for r in range(r0, r1):
+            x, y = cls.center(q0, r)
+            left.extend(((x - 1, y - 1), (x - 2, y), (x - 1, y + 1)))
+        lines.append(left)
+        for q in range(q0, q1):
+            x, y = cls.center(q, r0)
+            line = [(x - 1, y - 1)]
+            for r in range(r0, r1):
+                x, y = cls.center(q, r)
+                line.extend(((x + 1, y - 1), (x + 2, y), (x + 1, y + 1), (x - 1, y + 1), (x + 1, y + 1)))
+            lines.append(line)
+        return lines
+    
+    @staticmethod
+    def coords(line: List[Tuple[int, int]], hex_size: float, offset: float) -> List[float]:
+        """Flat canvas coordinates of a lattice polyline"""
+        step_x = hex_size / math.sqrt(3)
+        coords = []
+        for x, y in line:
+            coords.extend((x * step_x + offset, y * hex_size + offset))
+        return coords
+
+
+class TileAtlas:
+    """Cache of pre-rendered hex images, one per (terrain, visible, symbol, hex_size)
+
+    Requires Pillow. Each hex on the canvas then becomes a single image item
+    instead of a polygon plus a text item.
+    """
+    
+    def __init__(self):
+        self.hex_size = None
+        self._images = {}
+        self._photos = {}
+        self._fonts = {}
+    
+    @staticmethod
+    def tile_key(hex_data: Dict, visible: bool, hex_size: int, show_symbol: bool = True) -> Tuple:
+        """Atlas key for a hex as it should currently appear"""
+        if not visible:
+            # All unexplored hexes share one tile
+            return (None, False, '', hex_size)
+        symbol = HexMapApp.hex_symbol(hex_data) if show_symbol else ''
+        return (hex_data['terrain'], True, symbol, hex_size)
+    
+    def photo(self, key: Tuple):
+        """Get the Tk image for an atlas key, rendering it on first use"""
+        self._check_size(key[3])
+        photo = self._photos.get(key)
+        if photo is None:
+            from PIL import ImageTk
+            photo = ImageTk.PhotoImage(self.image(key))
+            self._photos[key] = photo
+        return photo
+    
+    def image(self, key: Tuple):
+        """Get the Pillow image for an atlas key, rendering it on first use"""
+        self._check_size(key[3])
+        image = self._images.get(key)
+        if image is None:
+            image = self._render(*key)
+            self._images[key] = image
+        return image
+    
+    def _check_size(self, hex_size: int):
+        """Drop all cached tiles when the hex size changes"""
+        if hex_size != self.hex_size:
+            self._images.clear()
+            self._photos.clear()
+            self.hex_size = hex_size
+    
+    def _font(self, pixels: int):
+        """Load the first available symbol font at the given pixel size"""
+        font = self._fonts.get(pixels)
+        if font is None:
+            for name in SYMBOL_FONTS:
+                try:
+                    font = ImageFont.truetype(name, pixels)
+                    break
+                except OSError:
+                    continue
+            else:
+                font = ImageFont.load_default()
+            self._fonts[pixels] = font
+        return font
+    
+    def _render(self, terrain: Optional[str], visible: bool, symbol: str, hex_size: int):
+        """Rasterize one hex tile centered in a transparent image"""
+        width = 2 * hex_size + 2
+        height = int(math.ceil(math.sqrt(3) * hex_size)) + 2
+        image = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(image)
+        
+        color = ALL_TERRAINS[terrain]['color'] if visible else UNEXPLORED_COLOR
+        corners = HexGrid.get_hex_corners(width / 2, height / 2, hex_size)
+        draw.polygon(corners, fill=color)
+        
+        if symbol:
+            # Match the canvas text sizes (Tk font sizes are points, ~4/3 px)
+            scale = 0.6 if symbol == '⌂' else 0.5
+            font = self._font(max(1, int(hex_size * scale * 4 / 3)))
+            left, top, right, bottom = draw.textbbox((0, 0), symbol, font=font)
+            text_x = (width - (right - left)) / 2 - left
+            text_y = (height - (bottom - top)) / 2 - top
+            draw.text((text_x, text_y), symbol, font=font, fill='white')
+        return image
+
+
+class Minimap:
+    """Sidebar overview of the whole map drawn from a cached bitmap
+
+    The bitmap is built once with a few pixels per hex; single hexes are
+    patched in place and the viewport is one rectangle item that moves.
+    Maps larger than the minimap are subsampled: one pixel shows every
+    step-th hex of every step-th row, so the whole map always fits.
+    """
+    
+    def __init__(self, parent, map_data: Dict, on_jump, max_width: int = 330, max_height: int = 180):
+        self.map_data = map_data
+        self.on_jump = on_jump
+        width, height = map_data['width'], map_data['height']
+        # Pixels per shown hex, and hexes per pixel when the map is too large for one each
+        self.zoom = max(1, min(max_width // width, max_height // height))
+        self.step = max(1, math.ceil(width / max_width), math.ceil(height / max_height))
+        self.scale = self.zoom / self.step
+        # Explored state to show instead of the hexes' own (a session on the timeline)
+        self.explored: Optional[HexBitset] = None
+        image_width = math.ceil(width / self.step) * self.zoom
+        image_height = math.ceil(height / self.step) * self.zoom
+        
+        self.canvas = tk.Canvas(
+            parent,
+            width=image_width,
+            height=image_height,
+            bg=CANVAS_BG_COLOR,
+            highlightthickness=0
+        )
+        self.image = tk.PhotoImage(width=image_width, height=image_height)
+        self.canvas.create_image(0, 0, image=self.image, anchor='nw')
+        self.viewport = self.canvas.create_rectangle(0, 0, 0, 0, outline=SELECTION_COLOR, width=1)
+        self.canvas.bind('<Button-1>', self.on_click)
+        self.canvas.bind('<B1-Motion>', self.on_click)
+        self.rebuild()
+    
+    def rebuild(self):
+        """Repaint the whole bitmap (map loaded or fog of war toggled)"""
+        fog_enabled = self.map_data.get('fog_of_war_enabled', True)
+        step, zoom, explored = self.step, self.zoom, self.explored
+        rows = []
+        for r, row in enumerate(self.map_data['grid'][::step]):
+            colors = []
+            for q, hex_data in enumerate(row[::step]):
+                shown = None if explored is None else (q * step, r * step) in explored
+                colors.extend([HexMapApp.hex_color(hex_data, fog_enabled, shown)] * zoom)
+            rows.extend(['{' + ' '.join(colors) + '}'] * zoom)
+        self.image.put(' '.join(rows))
+    
+    def update_hex(self, q: int, r: int):
+        """Patch the pixels of a single hex (if it is one of the hexes shown)"""
+        if q % self.step or r % self.step:
+            return
+        fog_enabled = self.map_data.get('fog_of_war_enabled', True)
+        shown = None if self.explored is None else (q, r) in self.explored
+        color = HexMapApp.hex_color(self.map_data['grid'][r][q], fog_enabled, shown)
+        x, y = q // self.step * self.zoom, r // self.step * self.zoom
+        self.image.put(color, to=(x, y, x + self.zoom, y + self.zoom))
+    
+    def set_explored(self, explored: Optional[HexBitset], changed: HexBitset):
+        """Show another explored state (None for the live map), given the hexes that differ"""
+        self.explored = explored
+        shown = [(q, r) for q, r in changed if not (q % self.step or r % self.step)]
+        # One image call per hex; past a quarter of the bitmap a full repaint is cheaper
+        total = math.ceil(self.map_data['width'] / self.step) * math.ceil(self.map_data['height'] / self.step)
+        if len(shown) * 4 > total:
+            self.rebuild()
+            return
+        for q, r in shown:
+            self.update_hex(q, r)
+    
+    def set_viewport(self, q0: float, r0: float, q1: float, r1: float):
+        """Move the viewport rectangle to the given (fractional) hex range"""
+        self.canvas.coords(
+            self.viewport,
+            q0 * self.scale, r0 * self.scale, q1 * self.scale, r1 * self.scale
+        )
+    
+    def on_click(self, event):
+        """Center the main view on the clicked hex"""
+        self.on_jump(event.x / self.scale, event.y / self.scale)
+
+
+class PNGStreamWriter:
+    """Writes an 8-bit RGB PNG one band of rows at a time"""
+    
+    def __init__(self, f, width: int, height: int):
+        self.f = f
+        self.stride = width * 3
+        self._compressor = zlib.compressobj(6)
+        f.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+    
+    def _chunk(self, kind: bytes, data: bytes):
+        """Write one length-prefixed, CRC-checked PNG chunk"""
+        self.f.write(struct.pack('>I', len(data)))
+        self.f.write(kind)
+        self.f.write(data)
+        self.f.write(struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+    
+    def write_rows(self, pixels: bytes):
+        """Append raw RGB rows (any whole number of them)"""
+        stride = self.stride
+        # Each scanline starts with filter type 0 (none)
+        raw = b''.join(b'\x00' + pixels[i:i + stride] for i in range(0, len(pixels), stride))
+        compressed = self._compressor.compress(raw)
+        if compressed:
+            self._chunk(b'IDAT', compressed)
+    
+    def close(self):
+        """Flush the compressor and finish the file"""
+        self._chunk(b'IDAT', self._compressor.flush())
+        self._chunk(b'IEND', b'')
+
+
+class MapImageExporter:
+    """Headless PNG/SVG renderer for handouts, independent of the Tk canvas
+
+    Uses the same geometry as the map view (HexGrid.axial_to_pixel and
+    get_hex_corners). Output is produced in horizontal bands of hex rows, so
+    memory use depends on the map width, not on the whole image.
+    """
+    
+    BAND_HEX_ROWS = 8
+    
+    def __init__(self, map_data: Dict, hex_size: int, player_view: bool = False):
+        self.map_data = map_data
+        self.hex_size = hex_size
+        # The player version hides unexplored hexes regardless of the fog toggle
+        self.player_view = player_view
+        self.margin = hex_size
+        self.half_height = hex_size * math.sqrt(3) / 2
+        width, height = map_data['width'], map_data['height']
+        self.width = int(math.ceil((width - 1) * hex_size * math.sqrt(3) + 2 * hex_size + 2 * self.margin))
+        self.height = int(math.ceil((2 * height - 1) * hex_size + 2 * self.half_height + 2 * self.margin))
+    
+    def hex_center(self, q: int, r: int) -> Tuple[float, float]:
+        """Image position of a hex center"""
+        x, y = HexGrid.axial_to_pixel(q, r, self.hex_size)
+        return x + self.margin + self.hex_size, y + self.margin + self.half_height
+    
+    def is_visible(self, hex_data: Dict) -> bool:
+        """Whether a hex's terrain and symbol appear in the output"""
+        if self.player_view:
+            return hex_data['explored']
+        return True
+    
+    def export(self, path: str, progress=None):
+        """Export to PNG or SVG depending on the file extension"""
+        if path.lower().endswith('.svg'):
+            self.export_svg(path, progress)
+        else:
+            self.export_png(path, progress)
+    
+    def hexes_in_region(self, left: int, top: int, right: int, bottom: int):
+        """Yield (q, r, hex_data) for hexes that can overlap a pixel region"""
+        hex_size = self.hex_size
+        column_width = hex_size * math.sqrt(3)
+        first_row = max(0, int((top - self.margin) // (2 * hex_size)) - 1)
+        last_row = min(self.map_data['height'], int((bottom - self.margin) // (2 * hex_size)) + 2)
+        first_col = max(0, int((left - self.margin) // column_width) - 1)
+        last_col = min(self.map_data['width'], int((right - self.margin) // column_width) + 2)
+        for r in range(first_row, last_row):
+            row = self.map_data['grid'][r]
+            for q in range(first_col, last_col):
+                if row[q]:
+                    yield q, r, row[q]
+    
+    def tile_key(self, hex_data: Dict) -> Tuple:
+        """Atlas key describing exactly how a hex looks in the output"""
+        return TileAtlas.tile_key(hex_data, self.is_visible(hex_data), self.hex_size)
+    
+    def render_region(self, atlas: 'TileAtlas', left: int, top: int, width: int, height: int):
+        """Render a pixel region of the full image to a Pillow RGB image"""
+        region = Image.new('RGB', (width, height), CANVAS_BG_COLOR)
+        hexes = list(self.hexes_in_region(left, top, left + width, top + height))
+        for q, r, hex_data in hexes:
+            tile = atlas.image(self.tile_key(hex_data))
+            x, y = self.hex_center(q, r)
+            region.paste(tile, (int(x - tile.width / 2) - left, int(y - tile.height / 2) - top), tile)
+        
+        # Rivers and roads over the tiles
+        draw = ImageDraw.Draw(region)
+        for q, r, hex_data in hexes:
+            if not self.is_visible(hex_data):
+                continue
+            for field, color, line_width in NETWORK_LINES:
+                if hex_data.get(field):
+                    coords = HexNetwork.polyline(q, r, hex_data[field], self.hex_center)
+                    draw.line([(coords[i] - left, coords[i + 1] - top) for i in range(0, len(coords), 2)],
+                              fill=color, width=max(1, round(self.hex_size * line_width)), joint='curve')
+        return region
+    
+    def export_png(self, path: str, progress=None):
+        """Render the map to a PNG file band by band (requires Pillow)"""
+        if Image is None:
+            raise RuntimeError("PNG export requires Pillow (pip install Pillow)")
+        
+        atlas = TileAtlas()
+        band_height = 2 * self.hex_size * self.BAND_HEX_ROWS
+        
+        with open(path, 'wb') as f:
+            writer = PNGStreamWriter(f, self.width, self.height)
+            for top in range(0, self.height, band_height):
+                bottom = min(self.height, top + band_height)
+                band = self.render_region(atlas, 0, top, self.width, bottom - top)
+                writer.write_rows(band.tobytes())
+                if progress:
+                    progress(bottom / self.height)
+            writer.close()
+    
+    def export_svg(self, path: str, progress=None):
+        """Write the map as SVG, streaming one hex row at a time"""
+        from xml.sax.saxutils import escape
+        
+        hex_size = self.hex_size
+        map_height = self.map_data['height']
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.width}" height="{self.height}" '
+                    f'viewBox="0 0 {self.width} {self.height}">\n')
+            f.write(f'<rect width="100%" height="100%" fill="{CANVAS_BG_COLOR}"/>\n')
+            f.write(f'<g font-family="Arial, sans-serif" fill="white" text-anchor="middle" '
+                    f'dominant-baseline="central" font-size="{hex_size * 0.66:.1f}">\n')
+            for r, row in enumerate(self.map_data['grid']):
+                parts = []
+                for q, hex_data in enumerate(row):
+                    if not hex_data:
+                        continue
+                    visible = self.is_visible(hex_data)
+                    color = ALL_TERRAINS[hex_data['terrain']]['color'] if visible else UNEXPLORED_COLOR
+                    x, y = self.hex_center(q, r)
+                    points = ' '.join(f'{cx:.1f},{cy:.1f}' for cx, cy in HexGrid.get_hex_corners(x, y, hex_size))
+                    parts.append(f'<polygon points="{points}" fill="{color}"/>')
+                    for field, line_color, line_width in NETWORK_LINES:
+                        if visible and hex_data.get(field):
+                            coords = HexNetwork.polyline(q, r, hex_data[field], self.hex_center)
+                            line = ' '.join(f'{coords[i]:.1f},{coords[i + 1]:.1f}' for i in range(0, len(coords), 2))
+                            parts.append(f'<polyline points="{line}" fill="none" stroke="{line_color}" '
+                                         f'stroke-width="{hex_size * line_width:.1f}" stroke-linecap="round" '
+                                         f'stroke-linejoin="round"/>')
+                    if visible:
+                        symbol = escape(HexMapApp.hex_symbol(hex_data))
+                        parts.append(f'<text x="{x:.1f}" y="{y:.1f}">{symbol}</text>')
+                f.write('\n'.join(parts))
+                f.write('\n')
+                if progress:
+                    progress((r + 1) / map_height)
+            f.write('</g>\n</svg>\n')
+
+
+class TilePyramidExporter:
+    """Writes a zoomable z/x/y PNG tile pyramid for browser viewing
+
+    The deepest zoom level is rendered from the map; every other level is
+    built by downsampling the four tiles below it. A manifest stores a hash
+    per tile (of the hexes it shows, or of its four children), so a
+    re-export only rewrites tiles whose hexes changed since the last run.
+    """
+    
+    TILE_SIZE = 256
+    MANIFEST = 'tiles.json'
+    
+    def __init__(self, map_data: Dict, hex_size: int, player_view: bool = True):
+        self.image_exporter = MapImageExporter(map_data, hex_size, player_view)
+        self.hex_size = hex_size
+        self.player_view = player_view
+        largest = max(self.image_exporter.width, self.image_exporter.height)
+        self.max_zoom = max(0, math.ceil(math.log2(largest / self.TILE_SIZE)))
+    
+    def tile_path(self, directory: str, z: int, x: int, y: int) -> str:
+        return os.path.join(directory, str(z), str(x), f'{y}.png')
+    
+    def base_tile_hashes(self) -> Dict[Tuple[int, int], str]:
+        """Hash of the appearance of every hex overlapping each deepest-level tile"""
+        size = self.TILE_SIZE
+        exporter = self.image_exporter
+        columns = math.ceil(exporter.width / size)
+        rows = math.ceil(exporter.height / size)
+        
+        hashes = {}
+        for y in range(rows):
+            for x in range(columns):
+                digest = hashlib.sha1()
+                for q, r, hex_data in exporter.hexes_in_region(x * size, y * size, (x + 1) * size, (y + 1) * size):
+                    # Rivers and roads are drawn over visible hexes only
+                    network = tuple(hex_data.get(field, 0) for field, _, _ in NETWORK_LINES) \
+                        if exporter.is_visible(hex_data) else ()
+                    digest.update(repr((q, r, exporter.tile_key(hex_data), network)).encode('utf-8'))
+                hashes[(x, y)] = digest.hexdigest()
+        return hashes
+    
+    def export(self, directory: str, progress=None) -> int:
+        """Write (or update) the pyramid under directory, return the number of tiles written"""
+        if Image is None:
+            raise RuntimeError("Tile export requires Pillow (pip install Pillow)")
+        
+        manifest_path = os.path.join(directory, self.MANIFEST)
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        # Different rendering parameters invalidate every tile
+        if (manifest.get('hex_size'), manifest.get('player_view'), manifest.get('max_zoom')) != \
+                (self.hex_size, self.player_view, self.max_zoom):
+            manifest = {}
+        old_hashes = manifest.get('tiles', {})
+        new_hashes = {}
+        
+        size = self.TILE_SIZE
+        atlas = TileAtlas()
+        written = 0
+        
+        # Deepest level: render tiles directly from the map
+        level = self.base_tile_hashes()
+        total = len(level)
+        for done, ((x, y), digest) in enumerate(level.items(), 1):
+            name = f'{self.max_zoom}/{x}/{y}'
+            new_hashes[name] = digest
+            path = self.tile_path(directory, self.max_zoom, x, y)
+            if old_hashes.get(name) != digest or not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self.image_exporter.render_region(atlas, x * size, y * size, size, size).save(path)
+                written += 1
+            if progress:
+                progress(0.9 * done / total)
+        
+        # Each coarser level is built from the four tiles below it
+        for z in range(self.max_zoom - 1, -1, -1):
+            parents = {}
+            for (x, y), digest in level.items():
+                parents.setdefault((x // 2, y // 2), {})[(x % 2, y % 2)] = digest
+            
+            level = {}
+            for (x, y), children in parents.items():
+                digest = hashlib.sha1(repr(sorted(children.items())).encode('utf-8')).hexdigest()
+                level[(x, y)] = digest
+                name = f'{z}/{x}/{y}'
+                new_hashes[name] = digest
+                path = self.tile_path(directory, z, x, y)
+                if old_hashes.get(name) == digest and os.path.exists(path):
+                    continue
+                
+                merged = Image.new('RGB', (2 * size, 2 * size), CANVAS_BG_COLOR)
+                for (dx, dy) in children:
+                    with Image.open(self.tile_path(directory, z + 1, 2 * x + dx, 2 * y + dy)) as child:
+                        merged.paste(child, (dx * size, dy * size))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                merged.reduce(2).save(path)
+                written += 1
+            if progress:
+                progress(0.9 + 0.1 * (self.max_zoom - z) / self.max_zoom)
+        
+        manifest = {
+            'hex_size': self.hex_size,
+            'player_view': self.player_view,
+            'max_zoom': self.max_zoom,
+            'width': self.image_exporter.width,
+            'height': self.image_exporter.height,
+            'tiles': new_hashes,
+        }
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, separators=(',', ':'))
+        self.write_viewer(directory)
+        return written
+    
+    def write_viewer(self, directory: str):
+        """Write a minimal Leaflet page that browses the pyramid"""
+        width, height = self.image_exporter.width, self.image_exporter.height
+        scale = 2 ** self.max_zoom
+        html = f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>West Marches Map</title>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>html, body, #map {{ height: 100%; margin: 0; background: {CANVAS_BG_COLOR}; }}</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+var map = L.map('map', {{crs: L.CRS.Simple, minZoom: 0, maxZoom: {self.max_zoom}}});
+var bounds = [[-{height / scale}, 0], [0, {width / scale}]];
+L.tileLayer('{{z}}/{{x}}/{{y}}.png', {{bounds: bounds, noWrap: true, maxNativeZoom: {self.max_zoom}}}).addTo(map);
+map.fitBounds(bounds);
+</script>
+</body>
+</html>
+"""
+        with open(os.path.join(directory, 'index.html'), 'w', encoding='utf-8') as f:
+            f.write(html)
+
+
+class MapServer:
+    """Read-only HTTP server that shares the player view of a map on the LAN
+
+    Endpoints (all JSON unless noted):
+        /api/map               map size, region size and fog state
+        /api/hex/<q>/<r>       one hex
+        /api/region/<x>/<y>    all hexes of one MAP_SERVER_REGION_SIZE square block
+        /api/revealed          every hex players can see
+        /tiles/<z>/<x>/<y>.png tiles from the last tile export (PNG)
+        /                      the tile viewer page, if tiles were exported
+
+    Unexplored hexes only ever expose their coordinates while fog of war is
+    enabled, and GM notes are never served. Each region has a version
+    counter bumped on change; responses carry ETags built from it, and
+    serialized regions are cached until their version moves.
+    """
+    
+    def __init__(self, map_data: Dict, port: int = MAP_SERVER_PORT, tiles_dir: Optional[str] = None,
+                 host: str = '0.0.0.0'):
+        self.map_data = map_data
+        self.tiles_dir = tiles_dir
+        # Distinguishes ETags across server restarts and maps
+        self.epoch = f'{random.getrandbits(32):08x}'
+        columns = math.ceil(map_data['width'] / MAP_SERVER_REGION_SIZE)
+        rows = math.ceil(map_data['height'] / MAP_SERVER_REGION_SIZE)
+        self.region_versions = [[0] * columns for _ in range(rows)]
+        self.version = 0
+        self._cache = {}
+        self._lock = threading.Lock()
+        
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        handler = type('MapRequestHandler', (MapRequestHandler, BaseHTTPRequestHandler), {})
+        # The backlog is read when the socket starts listening, so it has to be a class attribute
+        server_class = type('MapHTTPServer', (ThreadingHTTPServer,), {
+            'request_queue_size': MAP_SERVER_REQUEST_QUEUE_SIZE,
+            'daemon_threads': True
+        })
+        self.httpd = server_class((host, port), handler)
+        self.httpd.map_server = self
+        self.port = self.httpd.server_address[1]
+        self._thread = None
+    
+    def start(self):
+        """Serve requests in a background thread"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Stop serving and release the port"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+    
+    def hex_changed(self, q: int, r: int):
+        """Invalidate the region containing a hex"""
+        with self._lock:
+            self.region_versions[r // MAP_SERVER_REGION_SIZE][q // MAP_SERVER_REGION_SIZE] += 1
+            self.version += 1
+    
+    def map_changed(self):
+        """Invalidate every region (e.g. fog of war toggled)"""
+        with self._lock:
+            for row in self.region_versions:
+                for x in range(len(row)):
+                    row[x] += 1
+            self.version += 1
+    
+    def player_hex(self, q: int, r: int) -> Dict:
+        """What players may know about a hex"""
+        hex_data = self.map_data['grid'][r][q]
+        fog_enabled = self.map_data.get('fog_of_war_enabled', True)
+        if not hex_data or (fog_enabled and not hex_data['explored']):
+            return {'q': q, 'r': r, 'explored': False}
+        return {
+            'q': q, 'r': r,
+            'explored': hex_data['explored'],
+            'terrain': hex_data['terrain'],
+            'settlement': hex_data['settlement'],
+            'poi': hex_data['poi'],
+            'river': hex_data.get('river', 0),
+            'road': hex_data.get('road', 0),
+        }
+    
+    def cached(self, key: str, version: int, build) -> bytes:
+        """Serialized body for key, rebuilt only when its version changed"""
+        entry = self._cache.get(key)
+        if entry and entry[0] == version:
+            return entry[1]
+        body = json.dumps(build(), separators=(',', ':')).encode('utf-8')
+        self._cache[key] = (version, body)
+        return body
+    
+    def resolve(self, path: str) -> Tuple[int, Optional[str], str, bytes]:
+        """Map a request path to (status, etag, content type, body)"""
+        width, height = self.map_data['width'], self.map_data['height']
+        path = path.split('?', 1)[0]
+        
+        match = re.fullmatch(r'/api/hex/(\d+)/(\d+)', path)
+        if match:
+            q, r = int(match.group(1)), int(match.group(2))
+            if q >= width or r >= height:
+                return 404, None, 'application/json', b'{"error":"no such hex"}'
+            version = self.region_versions[r // MAP_SERVER_REGION_SIZE][q // MAP_SERVER_REGION_SIZE]
+            body = json.dumps(self.player_hex(q, r), separators=(',', ':')).encode('utf-8')
+            return 200, f'"{self.epoch}-h{q}.{r}-{version}"', 'application/json', body
+        
+        match = re.fullmatch(r'/api/region/(\d+)/(\d+)', path)
+        if match:
+            x, y = int(match.group(1)), int(match.group(2))
+            if y >= len(self.region_versions) or x >= len(self.region_versions[0]):
+                return 404, None, 'application/json', b'{"error":"no such region"}'
+            version = self.region_versions[y][x]
+            
+            def build():
+                q0, r0 = x * MAP_SERVER_REGION_SIZE, y * MAP_SERVER_REGION_SIZE
+                return {
+                    'x': x, 'y': y,
+                    'hexes': [self.player_hex(q, r)
+                              for r in range(r0, min(height, r0 + MAP_SERVER_REGION_SIZE))
+                              for q in range(q0, min(width, q0 + MAP_SERVER_REGION_SIZE))],
+                }
+            body = self.cached(f'region/{x}/{y}', version, build)
+            return 200, f'"{self.epoch}-r{x}.{y}-{version}"', 'application/json', body
+        
+        if path == '/api/revealed':
+            version = self.version
+            
+            def build():
+                hexes = (self.player_hex(q, r) for r in range(height) for q in range(width))
+                return [hex_info for hex_info in hexes if 'terrain' in hex_info]
+            body = self.cached('revealed', version, build)
+            return 200, f'"{self.epoch}-rev-{version}"', 'application/json', body
+        
+        if path == '/api/map':
+            version = self.version
+            body = self.cached('map', version, lambda: {
+                'width': width,
+                'height': height,
+                'region_size': MAP_SERVER_REGION_SIZE,
+                'fog_of_war_enabled': self.map_data.get('fog_of_war_enabled', True),
+                'version': version,
+            })
+            return 200, f'"{self.epoch}-map-{version}"', 'application/json', body
+        
+        # Static files from the last tile export (player view only)
+        if self.tiles_dir:
+            match = re.fullmatch(r'/(?:tiles/)?(\d+)/(\d+)/(\d+)\.png', path)
+            if match:
+                file_path = os.path.join(self.tiles_dir, *match.groups()[:2], f'{match.group(3)}.png')
+                return self.static_file(file_path, 'image/png')
+            if path in ('/', '/index.html'):
+                return self.static_file(os.path.join(self.tiles_dir, 'index.html'), 'text/html; charset=utf-8')
+        
+        return 404, None, 'application/json', b'{"error":"not found"}'
+    
+    def static_file(self, file_path: str, content_type: str) -> Tuple[int, Optional[str], str, bytes]:
+        """Serve a file with an ETag from its size and modification time"""
+        try:
+            stat = os.stat(file_path)
+            with open(file_path, 'rb') as f:
+                body = f.read()
+        except OSError:
+            return 404, None, 'application/json', b'{"error":"not found"}'
+        return 200, f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"', content_type, body
+
+
+class MapRequestHandler:
+    """Answers GET requests for a MapServer, with If-None-Match support
+
+    Combined with http.server.BaseHTTPRequestHandler when a server is created,
+    so http.server is only imported once the map is actually shared.
+    """
+    
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; don't let Nagle delay keep-alive replies
+    disable_nagle_algorithm = True
+    
+    def do_GET(self):
+        try:
+            self.reply()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up (closed tab, poll timeout); nothing left to answer
+            self.close_connection = True
+    
+    def reply(self):
+        """Resolve the request path and send the response"""
+        status, etag, content_type, body = self.server.map_server.resolve(self.path)
+        if etag and etag == self.headers.get('If-None-Match'):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        """Keep the console quiet"""
+        pass
+
+
+class MapGenerator:
+    """Handles map generation logic with improved biome clustering"""
+    
+    MIN_REGION_SIZE = 3  # smaller regions left by the fill pass are merged into a neighbor
+    
+    def __init__(self, width: int, height: int, start_dir: str, factions: List[str], custom_locations: List[str],
+                 seed: Optional[int] = None, terrain_set: str = 'surface'):
+        self.width = width
+        self.height = height
+        self.start_dir = start_dir
+        self.factions = factions
+        self.custom_locations = custom_locations
+        self.grid = []
+        self.terrain_set = terrain_set
+        self.layer = TERRAIN_SETS[terrain_set]
+        self.terrains = self.layer['terrains']
+        self.zones = {
+            grimdark: [t for t, terrain in self.terrains.items() if terrain['grimdark'] == grimdark]
+            for grimdark in (False, True)
+        }
+        # Every map has a seed so the same parameters and seed regenerate it exactly;
+        # the layers below the surface draw from their own stream of the same seed
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.rng = random.Random(self.seed if terrain_set == 'surface' else f"{self.seed}:{terrain_set}")
+        self.settlement_target = 0
+        self.regions = None
+        self.climate = None
+    
+    def generate_poi_name(self, terrain: str) -> str:
+        """Generate a POI name from adjectives and nouns based on terrain"""
+        adjectives = POI_ADJECTIVES.get(terrain, POI_ADJECTIVES['PLAINS'])
+        nouns = POI_NOUNS.get(terrain, POI_NOUNS['PLAINS'])
+        
+        adjective = self.rng.choice(adjectives)
+        noun = self.rng.choice(nouns)
+        
+        return f"{adjective} {noun}"
+    
+    def get_opposite_direction(self) -> Tuple[int, int]:
+        """Get the opposite quadrant from starting direction"""
+        if self.start_dir == 'N':
+            return (self.width // 2, self.height - 1)
+        elif self.start_dir == 'S':
+            return (self.width // 2, 0)
+        elif self.start_dir == 'E':
+            return (0, self.height // 2)
+        else:  # W
+            return (self.width - 1, self.height // 2)
+    
+    def start_position(self) -> Tuple[int, int]:
+        """The starting hex on the chosen edge"""
+        if self.start_dir == 'N':
+            return self.width // 2, 0
+        elif self.start_dir == 'S':
+            return self.width // 2, self.height - 1
+        elif self.start_dir == 'E':
+            return self.width - 1, self.height // 2
+        else:  # W
+            return 0, self.height // 2
+    
+    def grimdark_threshold(self, start_q: int, start_r: int) -> float:
+        """Distance from the start beyond which terrain turns grimdark"""
+        max_distance = self.distance_from_start(*self.get_opposite_direction(), start_q, start_r)
+        return max_distance * 0.6
+    
+    def distance_from_start(self, q: int, r: int, start_q: int, start_r: int) -> float:
+        """Calculate distance from starting position"""
+        return math.sqrt((q - start_q) ** 2 + (r - start_r) ** 2)
+    
+    def is_valid_transition(self, from_terrain: str, to_terrain: str) -> bool:
+        """Check if a terrain transition is allowed"""
+        return to_terrain in BIOME_TRANSITIONS.get(from_terrain, [])
+    
+    def generate_biome_cluster(self, start_q: int, start_r: int, terrain: str, min_size: int = 5) -> set:
+        """Generate a cluster of at least min_size hexes of the same terrain"""
+        cluster = set()
+        cluster.add((start_q, start_r))
+        
+        # Different generation patterns based on terrain
+        if terrain in ['MOUNTAINS', 'CHASM', 'MAGMA']:
+            # Mountains (and chasms and magma flows below them) form in linear ranges
+            return self._generate_mountain_range(start_q, start_r, min_size)
+        elif terrain in ['FOREST', 'SWAMP', 'LAKE', 'FUNGAL', 'DARK_LAKE']:
+            # Forests, swamps, and lakes form in blobs (more clustered)
+            return self._generate_blob(start_q, start_r, terrain, min_size)
+        else:
+            # Standard cluster generation for other terrains
+            return self._generate_standard_cluster(start_q, start_r, min_size)
+    
+    def _generate_mountain_range(self, start_q: int, start_r: int, min_size: int) -> set:
+        """Generate mountains in a linear range pattern"""
+        cluster = set()
+        cluster.add((start_q, start_r))
+        
+        # Pick a primary direction (vertical, horizontal, or diagonal)
+        direction_type = self.rng.choice(['horizontal', 'vertical', 'diagonal'])
+        
+        current_q, current_r = start_q, start_r
+        length = self.rng.randint(min_size, min_size + 5)
+        
+        for _ in range(length):
+            # Move in the chosen direction with some variation
+            if direction_type == 'horizontal':
+                current_q += self.rng.choice([-1, 0, 1])
+                current_r += self.rng.choice([0, 1]) if self.rng.random() < 0.3 else 0
+            elif direction_type == 'vertical':
+                current_r += self.rng.choice([-1, 0, 1])
+                current_q += self.rng.choice([0, 1]) if self.rng.random() < 0.3 else 0
+            else:  # diagonal
+                current_q += self.rng.choice([-1, 0, 1])
+                current_r += self.rng.choice([-1, 0, 1])
+            
+            # Keep within bounds
+            current_q = max(0, min(self.width - 1, current_q))
+            current_r = max(0, min(self.height - 1, current_r))
+            
+            cluster.add((current_q, current_r))
+            
+            # Add some width to the range occasionally
+            if self.rng.random() < 0.4:
+                for nq, nr in HexGrid.get_neighbors(current_q, current_r):
+                    if 0 <= nq < self.width and 0 <= nr < self.height:
+                        if self.rng.random() < 0.5:
+                            cluster.add((nq, nr))
+        
+        return cluster
+    
+    def _generate_blob(self, start_q: int, start_r: int, terrain: str, min_size: int) -> set:
+        """Generate terrain in a blob pattern (more circular/organic)"""
+        cluster = set()
+        cluster.add((start_q, start_r))
+        
+        # Blobs are rounder and more cohesive
+        target_size = self.rng.randint(min_size, min_size + 8)
+        expansion_chance = 0.8  # Higher expansion chance for blobs
+        
+        while len(cluster) < target_size:
+            candidates = []
+            for q, r in cluster:
+                for nq, nr in HexGrid.get_neighbors(q, r):
+                    if 0 <= nq < self.width and 0 <= nr < self.height:
+                        if (nq, nr) not in cluster:
+                            # Prefer hexes closer to the center for rounder blobs
+                            distance = abs(nq - start_q) + abs(nr - start_r)
+                            weight = max(1, 10 - distance)
+                            candidates.extend([(nq, nr)] * weight)
+            
+            if not candidates:
+                break
+            
+            new_hex = self.rng.choice(candidates)
+            cluster.add(new_hex)
+        
+        # Extra expansion for very organic blobs
+        while self.rng.random() < expansion_chance and len(cluster) < target_size + 5:
+            candidates = set()
+            for q, r in cluster:
+                for nq, nr in HexGrid.get_neighbors(q, r):
+                    if 0 <= nq < self.width and 0 <= nr < self.height:
+                        if (nq, nr) not in cluster:
+                            candidates.add((nq, nr))
+            
+            if not candidates:
+                break
+            
+            new_hex = self.rng.choice(list(candidates))
+            cluster.add(new_hex)
+            expansion_chance *= 0.75
+        
+        return cluster
+    
+    def _generate_standard_cluster(self, start_q: int, start_r: int, min_size: int) -> set:
+        """Standard cluster generation for most terrains"""
+        cluster = set()
+        cluster.add((start_q, start_r))
+        
+        # Grow cluster to minimum size
+        while len(cluster) < min_size:
+            candidates = set()
+            for q, r in cluster:
+                for nq, nr in HexGrid.get_neighbors(q, r):
+                    if 0 <= nq < self.width and 0 <= nr < self.height:
+                        if (nq, nr) not in cluster:
+                            candidates.add((nq, nr))
+            
+            if not candidates:
+                break
+            
+            new_hex = self.rng.choice(list(candidates))
+            cluster.add(new_hex)
+        
+        # Possibly expand beyond minimum size
+        expansion_chance = 0.6
+        while self.rng.random() < expansion_chance:
+            candidates = set()
+            for q, r in cluster:
+                for nq, nr in HexGrid.get_neighbors(q, r):
+                    if 0 <= nq < self.width and 0 <= nr < self.height:
+                        if (nq, nr) not in cluster:
+                            candidates.add((nq, nr))
+            
+            if not candidates:
+                break
+            
+            new_hex = self.rng.choice(list(candidates))
+            cluster.add(new_hex)
+            expansion_chance *= 0.7
+        
+        return cluster
+    
+    def choose_terrain(self, adjacent_terrain: Optional[str], is_grimdark: bool, q: Optional[int] = None,
+                       r: Optional[int] = None) -> str:
+        """Pick a cluster terrain for the zone, following BIOME_TRANSITIONS from the adjacent terrain
+
+        With the climate fields and the cluster's seed hex (q, r), terrains
+        suited to its elevation, temperature and moisture are likelier.
+        """
+        zone = self.zones[is_grimdark]
+        options = [t for t in BIOME_TRANSITIONS.get(adjacent_terrain, []) if t in zone] if adjacent_terrain else []
+        options = options or zone
+        if self.climate is None or q is None:
+            return self.rng.choice(options)
+        return self.rng.choices(options, weights=[self.climate.suitability(t, q, r) for t in options])[0]
+    
+    def generate(self, checkpoint=None) -> Optional[List[List[Dict]]]:
+        """Generate the complete map using cluster-based terrain generation
+
+        checkpoint(stage, generator) is called when half the terrain is placed
+        ('partial'), when all terrain is placed ('terrain') and at the end
+        ('final'); if it returns False generation stops and None is returned.
+        """
+        self.grid = [[None for _ in range(self.width)] for _ in range(self.height)]
+        self.climate = ClimateFields.generate(self.width, self.height, self.seed)
+        
+        start_q, start_r = self.start_position()
+        grimdark_threshold = self.grimdark_threshold(start_q, start_r)
+        
+        # Track which hexes have been assigned
+        assigned = set()
+        
+        # Start with plains cluster at starting location (caverns below the surface)
+        start_terrain = self.layer['start']
+        capital = self.layer['capital']
+        plains_cluster = self.generate_biome_cluster(start_q, start_r, start_terrain, min_size=7)
+        for q, r in plains_cluster:
+            self.grid[r][q] = {
+                'terrain': start_terrain,
+                'poi': None,
+                'settlement': None,
+                'explored': True if (q, r) == (start_q, start_r) and capital else False,
+                'notes': ''
+            }
+            assigned.add((q, r))
+        
+        # Place large settlement at starting location; underground layers are
+        # reached through their links instead
+        if capital:
+            faction = self.factions[0] if self.factions else 'Imperial'
+            self.grid[start_r][start_q]['settlement'] = {
+                'type': capital,
+                'name': f"{faction} {capital}",
+                'faction': faction
+            }
+        
+        # Generate terrain clusters
+        attempts = 0
+        half_checked = False
+        max_attempts = self.width * self.height * 3
+        
+        while len(assigned) < self.width * self.height and attempts < max_attempts:
+            attempts += 1
+            
+            # Find an unassigned hex adjacent to assigned terrain
+            border_hexes = []
+            for q, r in assigned:
+                for nq, nr in HexGrid.get_neighbors(q, r):
+                    if 0 <= nq < self.width and 0 <= nr < self.height:
+                        if (nq, nr) not in assigned:
+                            border_hexes.append((nq, nr, self.grid[r][q]['terrain']))
+            
+            if not border_hexes:
+                # No border hexes, pick a random unassigned hex
+                unassigned = [(q, r) for q in range(self.width) for r in range(self.height) 
+                             if (q, r) not in assigned]
+                if not unassigned:
+                    break
+                seed_q, seed_r = self.rng.choice(unassigned)
+                adjacent_terrain = None
+            else:
+                seed_q, seed_r, adjacent_terrain = self.rng.choice(border_hexes)
+            
+            is_grimdark = self.distance_from_start(seed_q, seed_r, start_q, start_r) > grimdark_threshold
+            new_terrain = self.choose_terrain(adjacent_terrain, is_grimdark, seed_q, seed_r)
+            
+            # Generate cluster
+            cluster_size = self.rng.randint(5, 12)
+            cluster = self.generate_biome_cluster(seed_q, seed_r, new_terrain, min_size=cluster_size)
+            
+            # Assign terrain to cluster
+            for q, r in cluster:
+                if (q, r) not in assigned:
+                    self.grid[r][q] = {
+                        'terrain': new_terrain,
                         'poi': None,
                         'settlement': None,
                         'explored': False,
                         'notes': ''
                     }
                     assigned.add((q, r))
+            
+            if checkpoint and not half_checked and len(assigned) * 2 >= self.width * self.height:
+                half_checked = True
+                if checkpoint('partial', self) is False:
+                    return None
         
         # Fill any remaining hexes
         for r in range(self.height):
@@ -431,15 +2181,48 @@ class MapGenerator:
                                 }
                                 break
         
+        self._merge_slivers()
+        
+        if checkpoint and checkpoint('terrain', self) is False:
+            return None
+        
         self._place_settlements()
         self._place_pois()
+        self._build_network()
         
+        if checkpoint and checkpoint('final', self) is False:
+            return None
         return self.grid
     
+    def _merge_slivers(self):
+        """Absorb undersized biome regions into their most common neighboring terrain"""
+        regions = BiomeRegions(self.grid)
+        for region in regions.undersized(self.MIN_REGION_SIZE):
+            # Earlier merges may have absorbed or relabelled this region
+            if region not in regions.size or regions.size[region] >= self.MIN_REGION_SIZE:
+                continue
+            hexes = regions.hexes(region)
+            neighbors = Counter(
+                regions.terrain_at(nq, nr)
+                for q, r in hexes
+                for nq, nr in HexGrid.get_neighbors(q, r)
+                if 0 <= nq < self.width and 0 <= nr < self.height and (nq, nr) not in hexes
+            )
+            neighbors.pop(None, None)
+            if not neighbors:
+                continue
+            terrain = neighbors.most_common(1)[0][0]
+            for q, r in hexes:
+                if self.grid[r][q]:
+                    self.grid[r][q]['terrain'] = terrain
+                    regions.update(q, r)
+        self.regions = regions
+    
     def _place_settlements(self):
         """Place settlements on the map"""
-        num_settlements = max(3, (self.width * self.height) // 50 + random.randint(0, 3))
-        settlement_types = ['Village', 'Town', 'Outpost', 'Fort', 'Keep', 'Hamlet']
+        num_settlements = max(3, (self.width * self.height) // 50 + self.rng.randint(0, 3))
+        self.settlement_target = num_settlements
+        settlement_types = self.layer['settlements']
         
         placed = 0
         attempts = 0
@@ -447,15 +2230,15 @@ class MapGenerator:
         
         while placed < num_settlements and attempts < max_attempts:
             attempts += 1
-            q = random.randint(0, self.width - 1)
-            r = random.randint(0, self.height - 1)
+            q = self.rng.randint(0, self.width - 1)
+            r = self.rng.randint(0, self.height - 1)
             
             if self.grid[r][q] and not self.grid[r][q]['settlement'] and not self.grid[r][q]['poi']:
                 terrain = self.grid[r][q]['terrain']
                 # Settlements prefer non-grimdark, habitable areas
-                if terrain in ['PLAINS', 'FOREST', 'HILLS', 'LAKE'] and not ALL_TERRAINS[terrain]['grimdark']:
-                    settlement_type = random.choice(settlement_types)
-                    faction = random.choice(self.factions) if self.factions else None
+                if terrain in self.layer['habitable'] and not ALL_TERRAINS[terrain]['grimdark']:
+                    settlement_type = self.rng.choice(settlement_types)
+                    faction = self.rng.choice(self.factions) if self.factions else None
                     
                     self.grid[r][q]['settlement'] = {
                         'type': settlement_type,
@@ -464,49 +2247,1668 @@ class MapGenerator:
                     }
                     placed += 1
     
-    def _place_pois(self):
-        """Place points of interest on the map - 50% chance per hex"""
-        for r in range(self.height):
-            for q in range(self.width):
-                if not self.grid[r][q] or self.grid[r][q]['settlement']:
+    def _build_network(self):
+        """Lay rivers from the highlands down to lakes or the map edge, then roads between settlements"""
+        elevation = HexNetwork.elevation(self.grid, self.climate.fields['elevation'])
+        HexNetwork.add_rivers(self.grid, self.rng, elevation, self.layer['river_sources'], self.layer['river_outlets'])
+        HexNetwork.add_roads(self.grid)
+    
+    def _place_pois(self):
+        """Place points of interest on the map - 50% chance per hex"""
+        for r in range(self.height):
+            for q in range(self.width):
+                if not self.grid[r][q] or self.grid[r][q]['settlement']:
+                    continue
+                
+                poi = self.roll_poi(self.grid[r][q]['terrain'])
+                if poi:
+                    self.grid[r][q]['poi'] = poi
+    
+    def roll_poi(self, terrain: str) -> Optional[Dict]:
+        """POI(s) for one hex of the given terrain, or None (50% chance)"""
+        if self.rng.random() >= 0.5:
+            return None
+        
+        # Determine number of POIs (1-3, weighted towards 1)
+        num_pois = self.rng.choices([1, 2, 3], weights=[70, 25, 5])[0]
+        
+        pois = []
+        for _ in range(num_pois):
+            # 30% chance to use custom location if available
+            if self.custom_locations and self.rng.random() < 0.3:
+                poi_name = self.rng.choice(self.custom_locations)
+            else:
+                # Generate procedural POI name
+                poi_name = self.generate_poi_name(terrain)
+            
+            pois.append(poi_name)
+        
+        # Store as single POI or list
+        if len(pois) == 1:
+            return {
+                'name': pois[0],
+                'type': 'poi'
+            }
+        return {
+            'name': ', '.join(pois),
+            'type': 'multiple',
+            'count': len(pois)
+        }
+    
+    @classmethod
+    def for_map(cls, map_data: Dict, seed: Optional[int] = None) -> 'MapGenerator':
+        """A generator working on an existing map, e.g. to regenerate part of it"""
+        generator = cls(
+            map_data['width'],
+            map_data['height'],
+            map_data.get('start_direction', 'W'),
+            map_data.get('factions', []),
+            map_data.get('custom_locations', []),
+            seed=seed,
+            terrain_set=map_data.get('terrain_set', 'surface')
+        )
+        generator.grid = map_data['grid']
+        generator.climate = ClimateFields.for_map(map_data)
+        return generator
+    
+    @staticmethod
+    def rectangle(q0: int, r0: int, q1: int, r1: int) -> List[Tuple[int, int]]:
+        """Hexes of the axis-aligned rectangle spanned by two corner hexes"""
+        q0, q1 = sorted((q0, q1))
+        r0, r1 = sorted((r0, r1))
+        return [(q, r) for r in range(r0, r1 + 1) for q in range(q0, q1 + 1)]
+    
+    def regenerate_region(self, hexes) -> List[Tuple[int, int, str, object]]:
+        """Re-run cluster generation on some hexes of the existing grid
+
+        Clusters grow inward from the surrounding terrain, and hexes on the
+        region's edge are then fitted to BIOME_TRANSITIONS with their
+        neighbors. Settlement hexes are left alone; explored state and notes
+        are never changed, and POIs are re-rolled only where the terrain
+        changed. Rivers and roads through the region are laid again over the
+        new terrain (see _region_network). The grid itself is not modified: the (q, r, field, value)
+        changes are returned so they can be applied as one undoable edit.
+        The work done is proportional to the number of hexes regenerated.
+        """
+        region = {
+            (q, r) for q, r in hexes
+            if 0 <= q < self.width and 0 <= r < self.height and not self.grid[r][q].get('settlement')
+        }
+        if not region:
+            return []
+        order = sorted(region, key=lambda h: (h[1], h[0]))
+        start_q, start_r = self.start_position()
+        grimdark_threshold = self.grimdark_threshold(start_q, start_r)
+        terrain = {}  # new terrain of the region hexes assigned so far
+        
+        def terrain_at(q, r):
+            return terrain.get((q, r)) if (q, r) in region else self.grid[r][q]['terrain']
+        
+        def neighbors(q, r):
+            return [(nq, nr) for nq, nr in HexGrid.get_neighbors(q, r)
+                    if 0 <= nq < self.width and 0 <= nr < self.height]
+        
+        attempts = 0
+        while len(terrain) < len(region) and attempts < len(region) * 3:
+            attempts += 1
+            border_hexes = [
+                (q, r, terrain_at(nq, nr))
+                for q, r in order if (q, r) not in terrain
+                for nq, nr in neighbors(q, r) if terrain_at(nq, nr)
+            ]
+            if border_hexes:
+                seed_q, seed_r, adjacent_terrain = self.rng.choice(border_hexes)
+            else:
+                # The region is the whole map
+                seed_q, seed_r = self.rng.choice([h for h in order if h not in terrain])
+                adjacent_terrain = None
+            
+            is_grimdark = self.distance_from_start(seed_q, seed_r, start_q, start_r) > grimdark_threshold
+            new_terrain = self.choose_terrain(adjacent_terrain, is_grimdark, seed_q, seed_r)
+            cluster = self.generate_biome_cluster(seed_q, seed_r, new_terrain, min_size=self.rng.randint(5, 12))
+            for q, r in cluster:
+                if (q, r) in region and (q, r) not in terrain:
+                    terrain[(q, r)] = new_terrain
+        
+        for q, r in order:
+            terrain.setdefault((q, r), self.grid[r][q]['terrain'])
+        
+        # Fit edge hexes whose terrain cannot border a neighbor: fewest clashes with the
+        # untouched surroundings first, then with the region, then stay in the zone
+        for q, r in order:
+            outside = [self.grid[nr][nq]['terrain'] for nq, nr in neighbors(q, r) if (nq, nr) not in region]
+            inside = [terrain[(nq, nr)] for nq, nr in neighbors(q, r) if (nq, nr) in region]
+            if not outside or all(self._compatible(terrain[(q, r)], t) for t in outside + inside):
+                continue
+            is_grimdark = self.distance_from_start(q, r, start_q, start_r) > grimdark_threshold
+            terrain[(q, r)] = min(self.terrains, key=lambda t: (
+                sum(not self._compatible(t, n) for n in outside),
+                sum(not self._compatible(t, n) for n in inside),
+                ALL_TERRAINS[t]['grimdark'] != is_grimdark,
+                -(outside + inside).count(t)
+            ))
+        
+        changes = []
+        for q, r in order:
+            new_terrain = terrain[(q, r)]
+            if new_terrain != self.grid[r][q]['terrain']:
+                changes.append((q, r, 'terrain', new_terrain))
+                changes.append((q, r, 'poi', self.roll_poi(new_terrain)))
+        if changes:
+            changes.extend(self._region_network(region, terrain))
+        return changes
+    
+    def _region_network(self, region, terrain: Dict[Tuple[int, int], str]) -> List[Tuple[int, int, str, object]]:
+        """River and road changes for a region getting new terrain
+
+        Segments inside the region and the sides facing it are dropped. Roads
+        cut at the region's edge are joined again by the cheapest routes over
+        the new terrain. Rivers that drained into the region follow the new
+        drainage until they leave it or reach an outlet. Works on copies of
+        the hexes involved and returns the differences.
+        """
+        width, height = self.width, self.height
+        grid = [list(row) for row in self.grid]
+        copies = {}
+        
+        def copy(q, r):
+            if (q, r) not in copies:
+                copies[(q, r)] = grid[r][q] = dict(self.grid[r][q])
+            return copies[(q, r)]
+        
+        # Hexes just outside whose river or road crossed into the region
+        entries = {field: [] for field in HexNetwork.FIELDS}
+        for q, r in region:
+            hex_data = copy(q, r)
+            hex_data['terrain'] = terrain[(q, r)]
+            hex_data['river'] = hex_data['road'] = 0
+            for side, (nq, nr) in enumerate(HexGrid.touching_neighbors(q, r)):
+                if not (0 <= nq < width and 0 <= nr < height) or (nq, nr) in region or not grid[nr][nq]:
+                    continue
+                for field in HexNetwork.FIELDS:
+                    if self.grid[nr][nq].get(field, 0) >> (5 - side) & 1:
+                        copy(nq, nr)[field] &= ~(1 << (5 - side))
+                        entries[field].append((nq, nr))
+        
+        # Roads: route between the cut ends (and settlements on the edge) through the region only
+        if entries['road']:
+            ends = set(entries['road'])
+            routes = [[None] * width for _ in range(height)]
+            for q, r in region | ends:
+                routes[r][q] = {'terrain': grid[r][q]['terrain'], 'settlement': (q, r) in ends, 'road': 0}
+            HexNetwork.add_roads(routes)
+            for q, r in region | ends:
+                for side, (nq, nr) in enumerate(HexGrid.touching_neighbors(q, r)):
+                    if routes[r][q]['road'] >> side & 1 and ((q, r) in region or (nq, nr) in region):
+                        copy(q, r)['road'] |= 1 << side
+        
+        # Rivers: continue the ones now draining into the region down the new drainage
+        if entries['river']:
+            field = self.climate.fields['elevation'] if self.climate else [0.0] * (width * height)
+            downstream = HexNetwork.drainage(grid, HexNetwork.elevation(grid, field), self.layer['river_outlets'])
+            for q, r in set(entries['river']):
+                while True:
+                    side = downstream[r * width + q]
+                    if side in (-1, HexNetwork.OUTLET):
+                        break
+                    nq, nr = HexGrid.touching_neighbors(q, r)[side]
+                    if (q, r) not in region and (nq, nr) not in region:
+                        break
+                    joined = 0 <= nq < width and 0 <= nr < height and (
+                        (nq, nr) not in region or grid[nr][nq]['river'])
+                    if 0 <= nq < width and 0 <= nr < height:
+                        copy(nq, nr)
+                    HexNetwork.connect(grid, q, r, side, 'river')
+                    if joined or not (0 <= nq < width and 0 <= nr < height):
+                        break
+                    q, r = nq, nr
+        
+        changes = []
+        for (q, r), hex_data in sorted(copies.items(), key=lambda item: (item[0][1], item[0][0])):
+            for field in HexNetwork.FIELDS:
+                if hex_data.get(field, 0) != self.grid[r][q].get(field, 0):
+                    changes.append((q, r, field, hex_data.get(field, 0)))
+        return changes
+    
+    def _compatible(self, terrain: str, other: str) -> bool:
+        """Whether two terrains may border each other (in either direction)"""
+        return terrain == other or self.is_valid_transition(terrain, other) or self.is_valid_transition(other, terrain)
+
+
+class MapMetric:
+    """A named, weighted score of a generated map between 0 (bad) and 1 (good)
+
+    stage is the generation stage whose output the metric needs ('terrain' or
+    'final'); partial metrics can also judge a half-filled grid (None hexes),
+    which lets the scorer reject a candidate before its generation finishes.
+    """
+    
+    __slots__ = ('name', 'func', 'weight', 'stage', 'partial')
+    
+    def __init__(self, name: str, func, weight: float = 1.0, stage: str = 'terrain', partial: bool = False):
+        self.name = name
+        self.func = func
+        self.weight = weight
+        self.stage = stage
+        self.partial = partial
+
+
+class MapScorer:
+    """Scores generated maps as the weighted mean of pluggable metrics
+
+    Metric functions take (grid, generator) and must be module- or class-level
+    functions so the scorer can be sent to worker processes.
+    """
+    
+    REGION_TARGET_SIZE = 20  # mean biome region size that scores full marks
+    GRIMDARK_TARGET = 0.4  # preferred share of grimdark hexes
+    HABITABLE_TARGET = 0.4  # share of settleable hexes that scores full marks
+    
+    def __init__(self, metrics: Optional[List[MapMetric]] = None, reject_below: float = 0.6):
+        if metrics is None:
+            metrics = [
+                MapMetric('biome regions', MapScorer.biome_regions),
+                MapMetric('transitions', MapScorer.transition_violations, weight=2.0, partial=True),
+                MapMetric('grimdark ratio', MapScorer.grimdark_ratio),
+                MapMetric('habitable land', MapScorer.habitable_land),
+                MapMetric('settlements', MapScorer.settlement_count, stage='final'),
+            ]
+        self.metrics = metrics
+        self.reject_below = reject_below
+    
+    @staticmethod
+    def _neighbors(grid: List[List[Optional[Dict]]], q: int, r: int):
+        height, width = len(grid), len(grid[0])
+        for nq, nr in HexGrid.get_neighbors(q, r):
+            if 0 <= nq < width and 0 <= nr < height and grid[nr][nq]:
+                yield nq, nr
+    
+    @staticmethod
+    def biome_regions(grid, generator) -> float:
+        """Fewer, larger connected regions per biome score higher than many slivers"""
+        regions = generator.regions or BiomeRegions(grid)
+        hexes = generator.width * generator.height
+        return min(1.0, hexes / len(regions) / MapScorer.REGION_TARGET_SIZE) if len(regions) else 0.0
+    
+    @staticmethod
+    def transition_violations(grid, generator) -> float:
+        """Share of terrain borders that follow BIOME_TRANSITIONS"""
+        borders = violations = 0
+        for r, row in enumerate(grid):
+            for q, hex_data in enumerate(row):
+                if not hex_data:
+                    continue
+                terrain = hex_data['terrain']
+                for nq, nr in MapScorer._neighbors(grid, q, r):
+                    other = grid[nr][nq]['terrain']
+                    if other != terrain:
+                        borders += 1
+                        if other not in BIOME_TRANSITIONS.get(terrain, []) and \
+                                terrain not in BIOME_TRANSITIONS.get(other, []):
+                            violations += 1
+        return 1.0 - violations / borders if borders else 1.0
+    
+    @staticmethod
+    def grimdark_ratio(grid, generator) -> float:
+        """Closeness of the grimdark share of the map to GRIMDARK_TARGET"""
+        total = generator.width * generator.height
+        grimdark = sum(1 for row in grid for hex_data in row if ALL_TERRAINS[hex_data['terrain']]['grimdark'])
+        target = MapScorer.GRIMDARK_TARGET
+        return max(0.0, 1.0 - abs(grimdark / total - target) / target)
+    
+    @staticmethod
+    def habitable_land(grid, generator) -> float:
+        """Enough land that settlements can be placed on"""
+        total = generator.width * generator.height
+        habitable = sum(
+            1 for row in grid for hex_data in row
+            if hex_data['terrain'] in generator.layer['habitable']
+        )
+        return min(1.0, habitable / total / MapScorer.HABITABLE_TARGET)
+    
+    @staticmethod
+    def settlement_count(grid, generator) -> float:
+        """Settlements placed compared with the number the generator aimed for"""
+        placed = sum(1 for row in grid for hex_data in row if hex_data['settlement']) - 1  # minus the start city
+        return min(1.0, placed / generator.settlement_target) if generator.settlement_target else 1.0
+    
+    def score(self, scores: Dict[str, float]) -> float:
+        """Weighted mean of the metric scores computed so far"""
+        weights = {metric.name: metric.weight for metric in self.metrics}
+        total = sum(weights[name] for name in scores)
+        return sum(weights[name] * value for name, value in scores.items()) / total if total else 1.0
+    
+    def checkpoint(self, scores: Dict[str, float]):
+        """Build a MapGenerator checkpoint that fills scores and rejects poor candidates"""
+        def check(stage, generator):
+            if stage == 'partial':
+                partial = {
+                    metric.name: metric.func(generator.grid, generator)
+                    for metric in self.metrics if metric.partial
+                }
+                return not partial or self.score(partial) >= self.reject_below
+            for metric in self.metrics:
+                if metric.stage == stage:
+                    scores[metric.name] = metric.func(generator.grid, generator)
+            return self.score(scores) >= self.reject_below
+        return check
+
+
+def score_candidate(width: int, height: int, start_dir: str, factions: List[str], custom_locations: List[str],
+                    seed: int, scorer: MapScorer
+                    ) -> Tuple[Optional[float], int, Dict[str, float], Optional[List], Optional[Dict[str, str]]]:
+    """Generate and score one map candidate (runs in a worker process)
+
+    Returns (score, seed, metric scores, grid, packed climate); score, grid
+    and climate are None when the candidate was rejected early.
+    """
+    generator = MapGenerator(width, height, start_dir, factions, custom_locations, seed=seed)
+    scores = {}
+    grid = generator.generate(scorer.checkpoint(scores))
+    if grid is None:
+        return None, seed, scores, None, None
+    return scorer.score(scores), seed, scores, grid, generator.climate.pack()
+
+
+def generate_best_of(width: int, height: int, start_dir: str, factions: List[str], custom_locations: List[str],
+                     candidates: int = 8, keep: int = 1, scorer: Optional[MapScorer] = None,
+                     workers: Optional[int] = None, seed: Optional[int] = None,
+                     progress=None) -> List[Tuple[float, int, Dict[str, float], List, Dict[str, str]]]:
+    """Generate several map candidates in parallel and return the best `keep` of them
+
+    Results are (score, seed, metric scores, grid, packed climate) tuples,
+    best first. The candidate seeds derive from seed, so a run can be
+    repeated exactly.
+    """
+    scorer = scorer or MapScorer()
+    rng = random.Random(seed)
+    seeds = [rng.randrange(2 ** 32) for _ in range(candidates)]
+    args = (width, height, start_dir, factions, custom_locations)
+    best = []  # min-heap of the kept candidates
+    
+    def keep_result(result):
+        if result[0] is None:
+            return
+        heapq.heappush(best, result)
+        if len(best) > keep:
+            heapq.heappop(best)
+    
+    workers = min(workers or os.cpu_count() or 1, candidates)
+    if workers <= 1:
+        for done, candidate_seed in enumerate(seeds, 1):
+            keep_result(score_candidate(*args, candidate_seed, scorer))
+            if progress:
+                progress(done / candidates)
+    else:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        
+        # spawn rather than fork: the GUI calls this from a worker thread
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = [pool.submit(score_candidate, *args, candidate_seed, scorer) for candidate_seed in seeds]
+            for done, future in enumerate(as_completed(futures), 1):
+                keep_result(future.result())
+                if progress:
+                    progress(done / candidates)
+    
+    return sorted(best, key=lambda candidate: candidate[0], reverse=True)
+
+
+class MapSerializer:
+    """Reads and writes map files as compact JSON, using orjson when it is installed
+
+    Every method takes an optional backend ('json' or 'orjson') to force one
+    for that call; the benchmark uses it to compare them.
+    """
+    
+    backend = 'orjson' if orjson else 'json'
+    
+    @classmethod
+    def dumps(cls, map_data: Dict, backend: Optional[str] = None) -> bytes:
+        """Serialize map data to compact UTF-8 JSON"""
+        if (backend or cls.backend) == 'orjson':
+            return orjson.dumps(map_data)
+        return json.dumps(map_data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    
+    @classmethod
+    def loads(cls, data: bytes, backend: Optional[str] = None) -> Dict:
+        """Parse map data from JSON bytes"""
+        if (backend or cls.backend) == 'orjson':
+            return orjson.loads(data)
+        return json.loads(data)
+    
+    @classmethod
+    def save(cls, map_data: Dict, path: str, backend: Optional[str] = None):
+        """Write map data to path"""
+        data = cls.dumps(map_data, backend)
+        with open(path, 'wb') as f:
+            f.write(data)
+    
+    @classmethod
+    def load(cls, path: str, backend: Optional[str] = None) -> Dict:
+        """Read map data from path
+
+        Missing hex fields are not backfilled here; readers fall back to
+        HEX_DEFAULTS and the field is written the first time it changes.
+        """
+        with open(path, 'rb') as f:
+            map_data = cls.loads(f.read(), backend)
+        map_data.setdefault('fog_of_war_enabled', True)
+        return map_data
+
+
+class MapLayers:
+    """The named layers of a map: the surface plus the layers stacked below it
+
+    map_data['grid'] is always the surface. Each other layer is an entry of
+    map_data['layers'] with its name, terrain set, fog flag and its grid
+    'packed' as base64 zlib-compressed JSON. A layer's grid is unpacked the
+    first time it is viewed; the entry then serves as that layer's map data,
+    sharing the size and setup fields of the surface. document() packs the
+    layers back for saving.
+    """
+    
+    SURFACE = 'Surface'
+    SAVED_FIELDS = ('name', 'terrain_set', 'fog_of_war_enabled', 'sessions')
+    SHARED_FIELDS = ('width', 'height', 'start_direction', 'factions', 'custom_locations', 'seed', 'climate')
+    
+    def __init__(self, map_data: Dict):
+        self.map_data = map_data
+    
+    def names(self) -> List[str]:
+        return [self.SURFACE] + [layer['name'] for layer in self.map_data.get('layers', [])]
+    
+    def entry(self, name: str) -> Dict:
+        for layer in self.map_data.get('layers', []):
+            if layer['name'] == name:
+                return layer
+        raise KeyError(name)
+    
+    def layer_map(self, name: str) -> Dict:
+        """Map data of a layer, unpacking its grid on first use"""
+        if name == self.SURFACE:
+            return self.map_data
+        layer = self.entry(name)
+        if 'grid' not in layer:
+            layer['grid'] = self.unpack(layer['packed'])
+        for field in self.SHARED_FIELDS:
+            if field in self.map_data:
+                layer[field] = self.map_data[field]
+        return layer
+    
+    def document(self) -> Dict:
+        """The map as it is saved, with every layer packed"""
+        if not self.map_data.get('layers'):
+            return self.map_data
+        document = dict(self.map_data)
+        document['layers'] = []
+        for layer in self.map_data['layers']:
+            saved = {field: layer[field] for field in self.SAVED_FIELDS if field in layer}
+            saved['packed'] = self.pack(layer['grid']) if 'grid' in layer else layer['packed']
+            document['layers'].append(saved)
+        return document
+    
+    @classmethod
+    def add(cls, map_data: Dict, grid: List[List[Dict]], terrain_set: str, name: Optional[str] = None) -> Dict:
+        """Stack a freshly generated grid below the map's other layers"""
+        layer = {
+            'name': name or TERRAIN_SETS[terrain_set]['name'],
+            'terrain_set': terrain_set,
+            'fog_of_war_enabled': True,
+            'grid': grid
+        }
+        map_data.setdefault('layers', []).append(layer)
+        return layer
+    
+    @staticmethod
+    def link(upper: List[List[Dict]], lower: List[List[Dict]], upper_name: str, lower_name: str) -> int:
+        """Link the cave and dungeon POIs of a layer to the same hexes of the layer below
+
+        Both hexes get a 'link' field naming the other layer. Returns the
+        number of links made.
+        """
+        links = 0
+        for r, row in enumerate(upper):
+            for q, hex_data in enumerate(row):
+                poi = hex_data.get('poi') if hex_data else None
+                if poi and lower[r][q] and LAYER_LINK_NOUNS.intersection(re.findall(r"[\w-]+", poi['name'])):
+                    hex_data['link'] = lower_name
+                    lower[r][q]['link'] = upper_name
+                    links += 1
+        return links
+    
+    @staticmethod
+    def pack(grid: List[List[Dict]]) -> str:
+        return base64.b64encode(zlib.compress(MapSerializer.dumps(grid), 6)).decode('ascii')
+    
+    @staticmethod
+    def unpack(packed: str) -> List[List[Dict]]:
+        return MapSerializer.loads(zlib.decompress(base64.b64decode(packed)))
+
+
+class GenerationCache:
+    """On-disk cache of generated grids, keyed by generator parameters, version and seed
+
+    Entries hold the grid and its packed climate as zlib-compressed compact
+    JSON named after the SHA-256 of the key, so the same setup and seed hit the cache on any machine sharing the
+    directory. Reads refresh an entry's mtime; once the directory grows past
+    max_bytes the least recently used entries are deleted.
+    """
+    
+    SUFFIX = '.json.z'
+    
+    def __init__(self, directory: str = GENERATION_CACHE_DIR, max_bytes: int = GENERATION_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+    
+    @staticmethod
+    def key(width: int, height: int, start_dir: str, factions: List[str], custom_locations: List[str],
+            seed: int, terrain_set: str = 'surface') -> str:
+        params = [GENERATOR_VERSION, width, height, start_dir, list(factions), list(custom_locations), seed,
+                  terrain_set]
+        return hashlib.sha256(json.dumps(params, ensure_ascii=False).encode('utf-8')).hexdigest()
+    
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.SUFFIX)
+    
+    def get(self, key: str) -> Optional[Tuple[List[List[Dict]], Dict[str, str]]]:
+        """The cached (grid, packed climate) for key, or None"""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = MapSerializer.loads(zlib.decompress(f.read()))
+            os.utime(path)
+        except (OSError, ValueError, zlib.error):
+            return None
+        if not isinstance(entry, dict):
+            return None  # a bare grid cached before climates were kept; generate it again
+        return entry['grid'], entry['climate']
+    
+    def put(self, key: str, grid: List[List[Dict]], climate: Dict[str, str]):
+        """Store a grid and its climate, then evict the least recently used entries over the size limit"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self.path(key) + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(zlib.compress(MapSerializer.dumps({'grid': grid, 'climate': climate}), 6))
+            os.replace(tmp_path, self.path(key))
+            self.evict()
+        except OSError:
+            pass  # caching is best effort
+    
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.SUFFIX):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+
+def generate_grid(width: int, height: int, start_dir: str, factions: List[str], custom_locations: List[str],
+                  seed: Optional[int] = None, cache: Optional[GenerationCache] = None,
+                  terrain_set: str = 'surface') -> Tuple[List[List[Dict]], int, Dict[str, str]]:
+    """Generate a map grid, or load it from the cache; returns (grid, seed, packed climate)"""
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    key = cache.key(width, height, start_dir, factions, custom_locations, seed, terrain_set) if cache else None
+    entry = cache.get(key) if cache else None
+    if entry is None:
+        generator = MapGenerator(width, height, start_dir, factions, custom_locations, seed=seed,
+                                 terrain_set=terrain_set)
+        entry = generator.generate(), generator.climate.pack()
+        if cache:
+            cache.put(key, *entry)
+    grid, climate = entry
+    return grid, seed, climate
+
+
+def generate_layers(width: int, height: int, start_dir: str, factions: List[str], custom_locations: List[str],
+                    terrain_sets: List[str], seeds: List[int], cache: Optional[GenerationCache] = None,
+                    workers: Optional[int] = None, progress=None
+                    ) -> Dict[Tuple[int, str], Tuple[List[List[Dict]], Dict[str, str]]]:
+    """Generate the layer grids of one or more seeds in parallel, keyed by (seed, terrain set)
+
+    Each value is (grid, packed climate). Each layer not found in the cache
+    is generated in its own worker process; with a single layer to generate
+    it runs inline. progress(fraction) is called as layers finish.
+    """
+    args = (width, height, start_dir, factions, custom_locations)
+    grids = {}
+    jobs = []
+    for seed in seeds:
+        for terrain_set in terrain_sets:
+            entry = cache.get(cache.key(*args, seed, terrain_set)) if cache else None
+            if entry is None:
+                jobs.append((seed, terrain_set))
+            else:
+                grids[(seed, terrain_set)] = entry
+    
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        for done, (seed, terrain_set) in enumerate(jobs, 1):
+            grid, _, climate = generate_grid(*args, seed=seed, cache=cache, terrain_set=terrain_set)
+            grids[(seed, terrain_set)] = grid, climate
+            if progress:
+                progress(done / len(jobs))
+    else:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        
+        # spawn rather than fork: the GUI calls this from a worker thread
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = {
+                job: pool.submit(generate_grid, *args, seed=job[0], cache=cache, terrain_set=job[1])
+                for job in jobs
+            }
+            for done, (job, future) in enumerate(futures.items(), 1):
+                grid, _, climate = future.result()
+                grids[job] = grid, climate
+                if progress:
+                    progress(done / len(jobs))
+    return grids
+
+
+class SharedGridPlanes:
+    """Terrain, explored and feature planes of a map in one shared memory block
+
+    Worker processes attach by name through the small picklable descriptor()
+    instead of receiving a pickled copy of the grid. Each plane holds one
+    byte per hex (index r * width + q): a TERRAIN_CODES index, 0/1 for
+    explored, FEATURE_* bits for settlements, POIs and layer links, and the
+    river and road side masks.
+
+    Writes follow a sequence lock: the version in the header is odd while a
+    write is in progress, and every completed write (or batch of writes
+    inside `with planes:`) makes it even again. snapshot() retries until it
+    copies the planes between two reads of the same even version, so readers
+    never see half of a bulk reveal.
+    """
+    
+    MAGIC = b'HXGP'
+    HEADER = struct.Struct('<4sxxxxQII')  # magic, version, width, height
+    PLANES = ('terrain', 'explored', 'features', 'river', 'road')
+    TERRAIN_CODES = list(ALL_TERRAINS)
+    TERRAIN_INDEX = {terrain: code for code, terrain in enumerate(ALL_TERRAINS)}
+    FEATURE_SETTLEMENT = 1
+    FEATURE_POI = 2
+    FEATURE_MULTIPLE_POIS = 4
+    FEATURE_LINK = 8
+    
+    def __init__(self, shm, width: int, height: int, owner: bool):
+        self.shm = shm
+        self.width = width
+        self.height = height
+        self.owner = owner
+        self.version = self.HEADER.unpack_from(shm.buf)[1]
+        self._depth = 0
+    
+    @classmethod
+    def create(cls, map_data: Dict) -> 'SharedGridPlanes':
+        """Allocate a block for map_data and fill it"""
+        from multiprocessing import shared_memory
+        width, height = map_data['width'], map_data['height']
+        shm = shared_memory.SharedMemory(create=True, size=cls.HEADER.size + len(cls.PLANES) * width * height)
+        cls.HEADER.pack_into(shm.buf, 0, cls.MAGIC, 0, width, height)
+        planes = cls(shm, width, height, owner=True)
+        with planes:
+            for r, row in enumerate(map_data['grid']):
+                for q, hex_data in enumerate(row):
+                    planes.update_hex(q, r, hex_data)
+        return planes
+    
+    def descriptor(self) -> Dict:
+        """What a worker needs to attach to the block"""
+        return {'name': self.shm.name, 'width': self.width, 'height': self.height,
+                'terrain_codes': self.TERRAIN_CODES, 'creator': os.getpid()}
+    
+    @classmethod
+    def attach(cls, descriptor: Dict) -> 'SharedGridPlanes':
+        """Map an existing block into this process without copying it"""
+        from multiprocessing import parent_process, resource_tracker, shared_memory
+        try:
+            shm = shared_memory.SharedMemory(name=descriptor['name'], track=False)
+        except TypeError:
+            # Before Python 3.13 attaching registers the block with the resource
+            # tracker, which unlinks it once the processes using the tracker exit.
+            # A worker started by the creator shares its tracker, where the block
+            # is already registered (and unlink() unregisters it); any other
+            # process drops its registration again.
+            shm = shared_memory.SharedMemory(name=descriptor['name'])
+            parent = parent_process()
+            if parent is None or parent.pid != descriptor.get('creator'):
+                resource_tracker.unregister(shm._name, 'shared_memory')
+        magic, _, width, height = cls.HEADER.unpack_from(shm.buf)
+        if magic != cls.MAGIC or descriptor['terrain_codes'] != cls.TERRAIN_CODES:
+            shm.close()
+            raise ValueError("Shared memory block is not a compatible grid")
+        return cls(shm, width, height, owner=False)
+    
+    def close(self):
+        """Detach; the creating process also frees the block"""
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+    
+    def plane(self, name: str) -> memoryview:
+        """Zero-copy view of one plane (may change under a reader; see snapshot)"""
+        size = self.width * self.height
+        start = self.HEADER.size + self.PLANES.index(name) * size
+        return self.shm.buf[start:start + size]
+    
+    def __enter__(self):
+        if self._depth == 0:
+            self.version += 1  # odd: write in progress
+            struct.pack_into('<Q', self.shm.buf, 8, self.version)
+        self._depth += 1
+        return self
+    
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            self.version += 1
+            struct.pack_into('<Q', self.shm.buf, 8, self.version)
+    
+    def update_hex(self, q: int, r: int, hex_data: Dict):
+        """Write the planes of one hex from its map data"""
+        size = self.width * self.height
+        index = self.HEADER.size + r * self.width + q
+        features = 0
+        if hex_data.get('settlement'):
+            features |= self.FEATURE_SETTLEMENT
+        poi = hex_data.get('poi')
+        if poi:
+            features |= self.FEATURE_MULTIPLE_POIS if poi.get('type') == 'multiple' else self.FEATURE_POI
+        if hex_data.get('link'):
+            features |= self.FEATURE_LINK
+        with self:
+            buf = self.shm.buf
+            buf[index] = self.TERRAIN_INDEX[hex_data['terrain']]
+            buf[index + size] = 1 if hex_data.get('explored') else 0
+            buf[index + 2 * size] = features
+            buf[index + 3 * size] = hex_data.get('river', 0)
+            buf[index + 4 * size] = hex_data.get('road', 0)
+    
+    def snapshot(self) -> Tuple[int, bytes, bytes, bytes, bytes, bytes]:
+        """(version, terrain, explored, features, river, road) copied from one consistent state"""
+        size = self.width * self.height
+        buf = self.shm.buf
+        while True:
+            before = struct.unpack_from('<Q', buf, 8)[0]
+            if before % 2 == 0:
+                data = bytes(buf[self.HEADER.size:self.HEADER.size + len(self.PLANES) * size])
+                if struct.unpack_from('<Q', buf, 8)[0] == before:
+                    return (before, *(data[i * size:(i + 1) * size] for i in range(len(self.PLANES))))
+            time.sleep(0)
+    
+    def snapshot_map_data(self) -> Dict:
+        """A consistent copy as map data with the fields renderers need (no names or notes)"""
+        version, terrain, explored, features, river, road = self.snapshot()
+        codes = self.TERRAIN_CODES
+        grid = []
+        for r in range(self.height):
+            row = []
+            for q in range(self.width):
+                i = r * self.width + q
+                flags = features[i]
+                row.append({
+                    'terrain': codes[terrain[i]],
+                    'explored': bool(explored[i]),
+                    'settlement': {'type': 'settlement'} if flags & self.FEATURE_SETTLEMENT else None,
+                    'poi': {'type': 'multiple' if flags & self.FEATURE_MULTIPLE_POIS else 'poi'}
+                    if flags & (self.FEATURE_POI | self.FEATURE_MULTIPLE_POIS) else None,
+                    'link': 'link' if flags & self.FEATURE_LINK else None,
+                    'river': river[i],
+                    'road': road[i],
+                    'notes': ''
+                })
+            grid.append(row)
+        return {'grid': grid, 'width': self.width, 'height': self.height, 'fog_of_war_enabled': True,
+                'version': version}
+
+
+def export_tiles_worker(descriptor: Dict, directory: str, hex_size: int, messages):
+    """Worker process entry: export tiles from an attached SharedGridPlanes snapshot
+
+    Posts ('progress', fraction), then ('done', tiles written) or ('error', message).
+    """
+    planes = SharedGridPlanes.attach(descriptor)
+    try:
+        map_data = planes.snapshot_map_data()
+        written = TilePyramidExporter(map_data, hex_size).export(
+            directory, lambda fraction: messages.put(('progress', fraction)))
+        messages.put(('done', written))
+    except Exception as e:
+        messages.put(('error', str(e)))
+    finally:
+        planes.close()
+
+
+def make_benchmark_map(size: int) -> Dict:
+    """Build a random size x size map quickly (without running the generator)"""
+    terrains = list(ALL_TERRAINS.keys())
+    grid = [[{
+        'terrain': random.choice(terrains),
+        'poi': {'name': 'Ancient Ruins', 'type': 'poi'} if random.random() < 0.5 else None,
+        'settlement': None,
+        'explored': random.random() < 0.3,
+        'notes': '',
+    } for _ in range(size)] for _ in range(size)]
+    return {'grid': grid, 'width': size, 'height': size, 'fog_of_war_enabled': True}
+
+
+def benchmark_serialization(sizes: Tuple[int, ...] = (100, 300), rounds: int = 3):
+    """Time a MapSerializer save/load round trip of random maps for each size and backend
+
+    The first row of each size is the old indented json.dump format, as a baseline.
+    """
+    print(f"{'size':>9} {'backend':>16} {'bytes':>12} {'save ms':>9} {'load ms':>9}")
+    for size in sizes:
+        map_data = make_benchmark_map(size)
+        grid = map_data['grid']
+        
+        backends = ['json (indent=2)', 'json']
+        if orjson:
+            backends.append('orjson')
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.json')
+            for name in backends:
+                save_times, load_times = [], []
+                for _ in range(rounds):
+                    start = time.perf_counter()
+                    if name == 'json (indent=2)':
+                        with open(path, 'w') as f:
+                            json.dump(map_data, f, indent=2)
+                        save_times.append(time.perf_counter() - start)
+                        start = time.perf_counter()
+                        with open(path) as f:
+                            loaded = json.load(f)
+                        load_times.append(time.perf_counter() - start)
+                        continue
+                    MapSerializer.save(map_data, path, backend=name)
+                    save_times.append(time.perf_counter() - start)
+                    start = time.perf_counter()
+                    loaded = MapSerializer.load(path, backend=name)
+                    load_times.append(time.perf_counter() - start)
+                assert loaded['grid'][size - 1][size - 1] == grid[size - 1][size - 1]
+                print(f"{size:>4}x{size:<4} {name:>16} {os.path.getsize(path):>12,} "
+                      f"{min(save_times) * 1000:>9.1f} {min(load_times) * 1000:>9.1f}")
+
+
+def benchmark_renderers(size: int = 150, scroll_steps: int = 40):
+    """Compare redraw and scrolling speed of the polygon and tile atlas renderers"""
+    load_gui()
+    root = ctk.CTk()
+    app = HexMapApp(root)
+    app.open_layers(make_benchmark_map(size))
+    app.show_map()
+    root.update()
+    
+    print(f"{size}x{size} map")
+    print(f"{'renderer':>9} {'items':>8} {'cold ms':>9} {'warm ms':>9} {'scroll ms/step':>15}")
+    for renderer in ('polygon', 'atlas'):
+        if renderer == 'atlas' and Image is None:
+            print(f"{renderer:>9}  skipped (Pillow is not installed)")
+            continue
+        app.settings['renderer'] = renderer
+        app.atlas = TileAtlas()
+        
+        times = []
+        for _ in range(2):
+            start = time.perf_counter()
+            app.draw_map()
+            root.update()
+            times.append(time.perf_counter() - start)
+        
+        start = time.perf_counter()
+        for step in range(scroll_steps):
+            app.canvas.xview_moveto(step / scroll_steps)
+            app.canvas.yview_moveto(step / scroll_steps)
+            root.update()
+        scroll = (time.perf_counter() - start) / scroll_steps
+        
+        items = len(app.canvas.find_all())
+        print(f"{renderer:>9} {items:>8,} {times[0] * 1000:>9.0f} {times[1] * 1000:>9.0f} {scroll * 1000:>15.1f}")
+    root.destroy()
+
+
+def profile_startup(rounds: int = 5):
+    """Time the GUI imports, the first menu and switching between the cached screens
+
+    Run with python -X importtime to also get a per-module import breakdown.
+    """
+    start = time.perf_counter()
+    load_gui()
+    imported = time.perf_counter()
+    root = ctk.CTk()
+    app = HexMapApp(root)
+    root.update()
+    shown = time.perf_counter()
+    print(f"{'GUI imports':<16} {(imported - start) * 1000:>9.1f} ms")
+    print(f"{'window + menu':<16} {(shown - imported) * 1000:>9.1f} ms")
+    
+    screens = [('setup', app.show_setup), ('settings', app.show_settings), ('menu', app.show_menu)]
+    times = {name: [] for name, _ in screens}
+    for _ in range(rounds):
+        for name, show in screens:
+            start = time.perf_counter()
+            show()
+            root.update()
+            times[name].append(time.perf_counter() - start)
+    
+    print(f"{'switch to':<16} {'first ms':>9} {'cached ms':>10}")
+    for name, _ in screens:
+        first, *cached = times[name]
+        if name == 'menu':
+            first, cached = None, times[name]  # the menu was built at startup
+        first_text = f"{first * 1000:>9.1f}" if first is not None else f"{'-':>9}"
+        print(f"{name:<16} {first_text} {sum(cached) / len(cached) * 1000:>10.1f}")
+    root.destroy()
+
+
+class EditHistory:
+    """Undo/redo stacks of compact diffs
+
+    A step is a tuple of (hex index, field, old value, new value) records,
+    where the hex index is r * width + q, or -1 for a map-level field. For a
+    field in APPENDED_MAP_FIELDS, new is the item appended and undoing
+    removes the last item. A bulk operation is a single step. Consecutive steps touching exactly the
+    same fields within HISTORY_COALESCE_SECONDS are merged into one, and the
+    oldest steps are dropped once the estimated size exceeds max_bytes.
+    """
+    
+    def __init__(self, max_bytes: int = HISTORY_MAX_BYTES, coalesce_seconds: float = HISTORY_COALESCE_SECONDS):
+        self.max_bytes = max_bytes
+        self.coalesce_seconds = coalesce_seconds
+        self.undo_stack = []
+        self.redo_stack = []
+        self.size = 0
+        self._last_time = 0.0
+    
+    @staticmethod
+    def value_size(value) -> int:
+        """Rough size of a recorded value beyond the record itself; containers count as their JSON"""
+        if isinstance(value, str):
+            return len(value)
+        if isinstance(value, (dict, list, tuple)):
+            return len(MapSerializer.dumps(value))
+        return 0
+    
+    @classmethod
+    def step_size(cls, diffs: Tuple) -> int:
+        """Rough memory footprint of a step in bytes"""
+        size = 64
+        for _, field, old, new in diffs:
+            size += 48 + cls.value_size(old) + cls.value_size(new)
+        return size
+    
+    def record(self, label: str, diffs: List[Tuple[int, str, object, object]], coalesce: bool = True):
+        """Push a new step; clears the redo stack
+
+        coalesce=False keeps the step separate even if it repeats the last
+        one (appends must each be undone on their own).
+        """
+        diffs = tuple(d for d in diffs if d[2] != d[3])
+        if not diffs:
+            return
+        self.redo_stack.clear()
+        now = time.monotonic()
+        
+        if coalesce and self.undo_stack and now - self._last_time < self.coalesce_seconds:
+            last_label, last_diffs = self.undo_stack[-1]
+            if [d[:2] for d in last_diffs] == [d[:2] for d in diffs]:
+                # Same hexes and fields again: keep the original old values
+                self.undo_stack.pop()
+                self.size -= self.step_size(last_diffs)
+                diffs = tuple((index, field, old, new)
+                              for (index, field, old, _), (_, _, _, new) in zip(last_diffs, diffs)
+                              if old != new)
+                if not diffs:
+                    self._last_time = now
+                    return
+        
+        self.undo_stack.append((label, diffs))
+        self.size += self.step_size(diffs)
+        self._last_time = now
+        while self.size > self.max_bytes and len(self.undo_stack) > 1:
+            _, dropped = self.undo_stack.pop(0)
+            self.size -= self.step_size(dropped)
+    
+    def undo(self) -> Optional[Tuple[str, Tuple]]:
+        """Pop the last step; returns (label, diffs) to revert, or None"""
+        if not self.undo_stack:
+            return None
+        label, diffs = self.undo_stack.pop()
+        self.size -= self.step_size(diffs)
+        self.redo_stack.append((label, diffs))
+        self._last_time = 0.0
+        return label, diffs
+    
+    def redo(self) -> Optional[Tuple[str, Tuple]]:
+        """Pop the last undone step; returns (label, diffs) to re-apply, or None"""
+        if not self.redo_stack:
+            return None
+        label, diffs = self.redo_stack.pop()
+        self.undo_stack.append((label, diffs))
+        self.size += self.step_size(diffs)
+        self._last_time = 0.0
+        return label, diffs
+
+
+class HexSearchIndex:
+    """Inverted index over hex notes, POI names, settlement names and factions
+
+    Built in a background thread; edits made before the build finishes are
+    queued and applied at the end. Queries combine words (all must match, a
+    trailing * makes a prefix) with faction:<name> and terrain:<name> filters.
+    """
+    
+    WORD = re.compile(r'\w+')
+    
+    def __init__(self, map_data: Dict):
+        self.map_data = map_data
+        self.width = map_data['width']
+        self.postings = {}
+        self.hex_terms = {}
+        self.factions = {}
+        self.ready = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._sorted_terms = None
+    
+    def start(self):
+        """Build the index in a background thread"""
+        threading.Thread(target=self._build, daemon=True).start()
+    
+    def _build(self):
+        for r, row in enumerate(self.map_data['grid']):
+            for q, hex_data in enumerate(row):
+                if hex_data:
+                    self._index_hex(q, r)
+        with self._lock:
+            for q, r in self._pending:
+                self._index_hex(q, r)
+            self._pending = []
+            self.ready.set()
+    
+    @classmethod
+    def hex_text(cls, hex_data: Dict) -> Tuple[List[str], Optional[str]]:
+        """Searchable words of a hex and its settlement's faction"""
+        parts = [hex_data.get('notes', HEX_DEFAULTS['notes'])]
+        faction = None
+        if hex_data['settlement']:
+            parts.append(hex_data['settlement']['name'])
+            faction = hex_data['settlement']['faction']
+            if faction:
+                parts.append(faction)
+        if hex_data['poi']:
+            parts.append(hex_data['poi']['name'])
+        return cls.WORD.findall(' '.join(parts).lower()), faction
+    
+    def _index_hex(self, q: int, r: int):
+        """(Re)index one hex, removing whatever it contributed before"""
+        index = r * self.width + q
+        for term in self.hex_terms.pop(index, ()):
+            hexes = self.postings[term]
+            hexes.discard(index)
+            if not hexes:
+                del self.postings[term]
+                self._sorted_terms = None
+        for hexes in self.factions.values():
+            hexes.discard(index)
+        
+        hex_data = self.map_data['grid'][r][q]
+        if not hex_data:
+            return
+        terms, faction = self.hex_text(hex_data)
+        terms = set(terms)
+        if terms:
+            self.hex_terms[index] = terms
+        for term in terms:
+            if term not in self.postings:
+                self.postings[term] = set()
+                self._sorted_terms = None
+            self.postings[term].add(index)
+        if faction:
+            self.factions.setdefault(faction.lower(), set()).add(index)
+    
+    def update_hex(self, q: int, r: int):
+        """Re-index a hex after its notes, POI or settlement changed"""
+        with self._lock:
+            if not self.ready.is_set():
+                self._pending.append((q, r))
+                return
+            self._index_hex(q, r)
+    
+    def _prefix_matches(self, prefix: str) -> set:
+        """Hexes containing any word starting with prefix"""
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self.postings)
+        terms = self._sorted_terms
+        matches = set()
+        i = bisect.bisect_left(terms, prefix)
+        while i < len(terms) and terms[i].startswith(prefix):
+            matches |= self.postings[terms[i]]
+            i += 1
+        return matches
+    
+    def search(self, query: str) -> List[Tuple[int, int]]:
+        """Hexes matching a query, in map order"""
+        self.ready.wait()
+        words, faction, terrain = [], None, None
+        for part in query.lower().split():
+            if part.startswith('faction:'):
+                faction = part[len('faction:'):]
+            elif part.startswith('terrain:'):
+                terrain = part[len('terrain:'):]
+            else:
+                words.append(part)
+        
+        with self._lock:
+            candidates = None
+            for word in words:
+                if word.endswith('*'):
+                    matches = self._prefix_matches(word.rstrip('*'))
+                else:
+                    terms = self.WORD.findall(word)
+                    matches = set.intersection(*(self.postings.get(t, set()) for t in terms)) if terms else set()
+                candidates = set(matches) if candidates is None else candidates & matches
+            
+            if faction is not None:
+                by_faction = set()
+                for name, hexes in self.factions.items():
+                    if name.startswith(faction):
+                        by_faction |= hexes
+                candidates = by_faction if candidates is None else candidates & by_faction
+        
+        grid, width = self.map_data['grid'], self.width
+        if candidates is None:
+            if terrain is None:
+                return []
+            candidates = (r * width + q for r, row in enumerate(grid) for q, hex_data in enumerate(row) if hex_data)
+        
+        results = []
+        for index in sorted(candidates):
+            q, r = index % width, index // width
+            if terrain is not None:
+                hex_terrain = grid[r][q]['terrain']
+                if not (hex_terrain.lower().startswith(terrain)
+                        or ALL_TERRAINS[hex_terrain]['name'].lower().startswith(terrain)):
+                    continue
+            results.append((q, r))
+        return results
+
+
+class MapStatistics:
+    """Running map statistics, counted over the whole grid once and then adjusted per edited field
+
+    Only the changed hex field is re-counted on each edit, so the panel and
+    CSV export never rescan the grid after the initial pass.
+    """
+    
+    HISTORY_INTERVAL = 60.0  # seconds between explored-percentage samples
+    UNALIGNED = 'Unaligned'
+    
+    def __init__(self, map_data: Dict):
+        self.total = map_data['width'] * map_data['height']
+        self.terrain = Counter()
+        self.settlements = Counter()
+        self.poi_hexes = 0
+        self.pois = 0
+        # Whole-grid passes run in map()/filter()/Counter rather than a Python loop per hex;
+        # only the few settlements and POIs are visited one by one
+        hexes = list(filter(None, itertools.chain.from_iterable(map_data['grid'])))
+        self.terrain.update(map(operator.itemgetter('terrain'), hexes))
+        self.explored = sum(map(bool, map(dict.get, hexes, itertools.repeat('explored'))))
+        for settlement in filter(None, map(dict.get, hexes, itertools.repeat('settlement'))):
+            self._count_settlement(settlement, 1)
+        for poi in filter(None, map(dict.get, hexes, itertools.repeat('poi'))):
+            self._count_poi(poi, 1)
+        self.explored_history = [(time.time(), self.explored)]
+    
+    def _count_settlement(self, settlement, sign: int):
+        if settlement:
+            self.settlements[settlement.get('faction') or self.UNALIGNED] += sign
+    
+    def _count_poi(self, poi, sign: int):
+        if poi:
+            self.poi_hexes += sign
+            self.pois += sign * poi.get('count', 1)
+    
+    def update(self, field: str, old, new):
+        """Adjust the counts for one hex field changing from old to new"""
+        if field == 'terrain':
+            self.terrain[old] -= 1
+            self.terrain[new] += 1
+        elif field == 'explored':
+            self.explored += bool(new) - bool(old)
+            self._sample()
+        elif field == 'settlement':
+            self._count_settlement(old, -1)
+            self._count_settlement(new, 1)
+        elif field == 'poi':
+            self._count_poi(old, -1)
+            self._count_poi(new, 1)
+    
+    def _sample(self):
+        """Record the explored count, keeping at most one sample per interval"""
+        now = time.time()
+        if now - self.explored_history[-1][0] < self.HISTORY_INTERVAL and len(self.explored_history) > 1:
+            self.explored_history[-1] = (now, self.explored)
+        else:
+            self.explored_history.append((now, self.explored))
+    
+    @property
+    def grimdark(self) -> int:
+        return sum(count for t, count in self.terrain.items() if ALL_TERRAINS[t]['grimdark'])
+    
+    def share(self, count: int) -> float:
+        """Percentage of all hexes"""
+        return 100.0 * count / self.total if self.total else 0.0
+    
+    def rows(self) -> List[Tuple[str, str, float, float]]:
+        """(section, key, value, percent of map) rows for display and CSV export"""
+        rows = [
+            ('map', 'hexes', self.total, 100.0),
+            ('map', 'explored', self.explored, self.share(self.explored)),
+            ('map', 'grimdark', self.grimdark, self.share(self.grimdark)),
+            ('map', 'poi hexes', self.poi_hexes, self.share(self.poi_hexes)),
+            ('map', 'pois', self.pois, self.share(self.pois)),
+        ]
+        for key in ALL_TERRAINS:
+            if self.terrain[key]:
+                rows.append(('terrain', ALL_TERRAINS[key]['name'], self.terrain[key], self.share(self.terrain[key])))
+        # Settlement density per faction is given per 100 hexes
+        for faction, count in sorted(self.settlements.items()):
+            if count:
+                rows.append(('settlements', faction, count, self.share(count)))
+        for timestamp, explored in self.explored_history:
+            rows.append((
+                'explored over time',
+                datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S'),
+                explored,
+                self.share(explored)
+            ))
+        return rows
+    
+    def summary(self) -> str:
+        """Short multi-line text for the sidebar panel"""
+        top = ', '.join(
+            f"{ALL_TERRAINS[key]['name']} {self.share(count):.0f}%"
+            for key, count in self.terrain.most_common(3) if count
+        )
+        factions = ', '.join(f"{faction} {count}" for faction, count in sorted(self.settlements.items()) if count)
+        return (
+            f"Explored: {self.explored}/{self.total} ({self.share(self.explored):.1f}%)\n"
+            f"Grimdark: {self.share(self.grimdark):.1f}%   POIs: {self.pois} in {self.poi_hexes} hexes\n"
+            f"Top terrain: {top}\n"
+            f"Settlements: {factions or 'none'}"
+        )
+    
+    def export_csv(self, path: str):
+        """Write all statistics rows to a CSV file"""
+        import csv
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['section', 'key', 'value', 'percent'])
+            for section, key, value, percent in self.rows():
+                writer.writerow([section, key, value, f"{percent:.2f}"])
+
+
+class MapJournal:
+    """Append-only change journal stored next to a map file
+
+    Each change is a small JSON line: {"q": 3, "r": 7, "f": "explored", "v": true}
+    for hex fields, or {"f": "fog_of_war_enabled", "v": false} for map fields;
+    changes to a layer below the surface also name it, as in "l": "Underdark".
+    Records and snapshots are serialized on the GUI thread, so the writer
+    never reads the live map, and written by a background thread, so
+    recording a change never touches the disk on the caller's side.
+    The GUI thread counts records and the writer counts how many of them the
+    last successful snapshot covered, so a failed snapshot leaves them pending.
+    """
+
+    def __init__(self, map_path: str, truncate: bool = False):
+        self.map_path = map_path
+        self.path = map_path + JOURNAL_SUFFIX
+        self.recorded = 0
+        self.saved = 0
+        self._queue = queue.SimpleQueue()
+        self._file = open(self.path, 'w' if truncate else 'a', encoding='utf-8')
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    def record(self, field: str, value, q: Optional[int] = None, r: Optional[int] = None,
+               layer: Optional[str] = None, op: str = 'set'):
+        """Queue a change record for the background writer
+
+        op 'append' or 'pop' changes the end of a map-level list instead of
+        setting the field ("op" is left out of the record for 'set').
+        """
+        record = {'f': field, 'v': value} if q is None else {'q': q, 'r': r, 'f': field, 'v': value}
+        if op != 'set':
+            record['op'] = op
+        if layer:
+            record['l'] = layer
+        self.recorded += 1
+        self._queue.put(('record', json.dumps(record, separators=(',', ':')) + '\n'))
+
+    @property
+    def pending(self) -> int:
+        """Records not yet covered by a snapshot written to the map file"""
+        return self.recorded - self.saved
+
+    def compact(self, map_data):
+        """Schedule a full snapshot of map_data (or of a MapLayers' document) and truncate the journal
+
+        The snapshot is serialized here: the map keeps changing on this thread
+        while the writer works, so the writer only gets the finished bytes.
+        """
+        document = map_data.document() if isinstance(map_data, MapLayers) else map_data
+        self._queue.put(('compact', (MapSerializer.dumps(document), self.recorded)))
+
+    def reset(self):
+        """Drop everything journaled so far (the map file was just written in full)"""
+        self._queue.put(('reset', self.recorded))
+    
+    def close(self, map_data=None):
+        """Compact (if map_data or MapLayers is given), flush and stop the writer thread"""
+        if map_data is not None and self.pending:
+            self.compact(map_data)
+        self._queue.put(('close', None))
+        self._thread.join()
+
+    def _writer(self):
+        """Background thread: drain the queue, write records and snapshots"""
+        while True:
+            ops = [self._queue.get()]
+            # Drain whatever else is queued so bursts become a single write
+            while True:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = []
+            for op, payload in ops:
+                if op == 'record':
+                    lines.append(payload)
+                    continue
+
+                # Snapshot and close both need everything before them on disk
+                self._write_lines(lines)
+                lines = []
+                if op == 'compact':
+                    data, covered = payload
+                    if self._write_snapshot(data):
+                        self.saved = max(self.saved, covered)
+                elif op == 'reset':
+                    self._truncate()
+                    self.saved = max(self.saved, payload)
+                else:
+                    self._file.close()
+                    return
+
+            self._write_lines(lines)
+
+    def _write_lines(self, lines: List[str]):
+        """Append lines to the journal and push them to disk"""
+        if not lines:
+            return
+        self._file.write(''.join(lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _write_snapshot(self, data: bytes) -> bool:
+        """Atomically replace the map file with a serialized snapshot, then truncate the journal"""
+        tmp_path = self.map_path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self.map_path)
+        except OSError:
+            # Keep the journal intact and the records pending; the next compaction will retry
+            return False
+        self._truncate()
+        return True
+    
+    def _truncate(self):
+        """Empty the journal file"""
+        self._file.close()
+        self._file = open(self.path, 'w', encoding='utf-8')
+
+    @staticmethod
+    def replay(map_path: str, map_data: Dict) -> int:
+        """Apply journal records found next to map_path to map_data, return the number applied"""
+        path = map_path + JOURNAL_SUFFIX
+        if not os.path.exists(path):
+            return 0
+
+        applied = 0
+        layers = MapLayers(map_data)
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-write
                     continue
-                
-                # 50% chance for each hex to have POI(s)
-                if random.random() < 0.5:
-                    terrain = self.grid[r][q]['terrain']
-                    
-                    # Determine number of POIs (1-3, weighted towards 1)
-                    num_pois = random.choices([1, 2, 3], weights=[70, 25, 5])[0]
-                    
-                    pois = []
-                    for _ in range(num_pois):
-                        # 30% chance to use custom location if available
-                        if self.custom_locations and random.random() < 0.3:
-                            poi_name = random.choice(self.custom_locations)
-                        else:
-                            # Generate procedural POI name
-                            poi_name = self.generate_poi_name(terrain)
-                        
-                        pois.append(poi_name)
-                    
-                    # Store as single POI or list
-                    if len(pois) == 1:
-                        self.grid[r][q]['poi'] = {
-                            'name': pois[0],
-                            'type': 'poi'
-                        }
-                    else:
-                        self.grid[r][q]['poi'] = {
-                            'name': ', '.join(pois),
-                            'type': 'multiple',
-                            'count': len(pois)
-                        }
+                try:
+                    target = layers.layer_map(record['l']) if 'l' in record else map_data
+                except KeyError:
+                    continue
+                if 'q' in record:
+                    hex_data = target['grid'][record['r']][record['q']]
+                    if hex_data is None:
+                        continue
+                    hex_data[record['f']] = record['v']
+                elif record.get('op') == 'append':
+                    target.setdefault(record['f'], []).append(record['v'])
+                elif record.get('op') == 'pop':
+                    if target.get(record['f']):
+                        target[record['f']].pop()
+                else:
+                    target[record['f']] = record['v']
+                applied += 1
+        return applied
+
+
+class WorkspaceTab:
+    """A map open in the workspace; while inactive, the app state stashed when it was left"""
+    
+    __slots__ = ('title', 'path', 'state', 'packed', 'spill_path', 'hexes', 'last_used')
+    
+    def __init__(self, title: str):
+        self.title = title
+        self.path = None
+        self.state = None
+        self.packed = None
+        self.spill_path = None
+        self.hexes = 0
+        self.last_used = 0.0
+    
+    def memory(self) -> int:
+        """Estimated bytes the tab holds in memory"""
+        if self.spill_path:
+            return 0
+        if self.packed is not None:
+            return len(self.packed)
+        return self.hexes * WORKSPACE_HEX_BYTES
+
+
+class MapWorkspace:
+    """The maps open in tabs, keeping the inactive ones within a memory budget
+
+    The active map lives in HexMapApp's attributes; every other tab holds the
+    state stashed when it was left (layers, journal, history, selection and
+    view), so switching back to it is instant. While the inactive tabs are
+    estimated to use more than budget bytes, the least recently used ones are
+    compressed: the map document is kept as zlib JSON and the indexes built
+    from it are dropped. If that is not enough, compressed tabs are spilled to
+    a temporary file. restore() undoes both and rebuilds the indexes.
+    """
+    
+    # Per-layer state rebuilt from the map document when a compressed tab is restored
+    DERIVED_STATE = ('map_data', 'search_index', 'biome_regions')
+    
+    def __init__(self, budget: int = WORKSPACE_MEMORY_BUDGET_MB * 1024 * 1024):
+        self.budget = budget
+        self.tabs = []
+        self.active = None
+        self.spill_dir = None
+    
+    def add(self, title: str) -> WorkspaceTab:
+        tab = WorkspaceTab(title)
+        self.tabs.append(tab)
+        self.rename(tab, title)
+        return tab
+    
+    def rename(self, tab: WorkspaceTab, title: str, path: Optional[str] = None):
+        """Give a tab a title no other tab has (tab titles double as their switcher keys)"""
+        taken = {other.title for other in self.tabs if other is not tab}
+        name, number = title, 2
+        while name in taken:
+            name = f"{title} ({number})"
+            number += 1
+        tab.title = name
+        tab.path = path
+    
+    def titles(self) -> List[str]:
+        return [tab.title for tab in self.tabs]
+    
+    def find(self, title: Optional[str] = None, path: Optional[str] = None) -> Optional[WorkspaceTab]:
+        for tab in self.tabs:
+            if (title is not None and tab.title == title) or (path is not None and tab.path == path):
+                return tab
+        return None
+    
+    def memory(self) -> int:
+        """Estimated bytes held by the inactive tabs"""
+        return sum(tab.memory() for tab in self.tabs if tab.state is not None)
+    
+    def stash(self, tab: WorkspaceTab, state: Dict, hexes: int):
+        """Keep the state of a tab that is no longer active, then enforce the budget"""
+        tab.state = state
+        tab.hexes = hexes
+        tab.last_used = time.monotonic()
+        if tab is self.active:
+            self.active = None
+        self.enforce()
+    
+    def enforce(self):
+        """Compress, then spill, the least recently used inactive tabs until under budget"""
+        inactive = sorted((tab for tab in self.tabs if tab.state is not None), key=lambda tab: tab.last_used)
+        for tab in inactive:
+            if self.memory() <= self.budget:
+                return
+            if tab.packed is None and not tab.spill_path:
+                self.compress(tab)
+        for tab in inactive:
+            if self.memory() <= self.budget:
+                return
+            if tab.packed is not None:
+                self.spill(tab)
+    
+    def compress(self, tab: WorkspaceTab):
+        """Pack an inactive tab's map and let go of everything derived from it
+
+        The journal is compacted first so nothing but the packed document is
+        needed to bring the map back. Kept generation candidates are dropped.
+        """
+        state = tab.state
+        document = state['layers'].document()
+        if state['journal'] and state['journal'].pending:
+            state['journal'].compact(document)
+        tab.packed = zlib.compress(MapSerializer.dumps(document), 1)
+        state['layers'] = None
+        state['candidates'] = []
+        for layer_state in [state, *state['layer_states'].values()]:
+            for key in self.DERIVED_STATE:
+                layer_state[key] = None
+    
+    def spill(self, tab: WorkspaceTab):
+        """Move a compressed tab's map to a temporary file (kept in memory if that fails)"""
+        try:
+            if self.spill_dir is None:
+                self.spill_dir = tempfile.mkdtemp(prefix='hexmap-workspace-')
+            fd, path = tempfile.mkstemp(suffix='.json.z', dir=self.spill_dir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(tab.packed)
+        except OSError:
+            return
+        tab.spill_path = path
+        tab.packed = None
+    
+    def restore(self, tab: WorkspaceTab) -> Dict:
+        """Make a tab active again and return its stashed state, unpacking its map if needed"""
+        if tab.spill_path:
+            with open(tab.spill_path, 'rb') as f:
+                tab.packed = f.read()
+            os.remove(tab.spill_path)
+            tab.spill_path = None
+        state = tab.state
+        if tab.packed is not None:
+            layers = MapLayers(MapSerializer.loads(zlib.decompress(tab.packed)))
+            state['layers'] = layers
+            # Only the layers that had been viewed have a state to rebuild
+            for name, layer_state in [(state['layer_name'], state), *state['layer_states'].items()]:
+                map_data = layers.layer_map(name)
+                search_index = HexSearchIndex(map_data)
+                search_index.start()
+                layer_state.update(map_data=map_data, search_index=search_index,
+                                   biome_regions=BiomeRegions(map_data['grid']))
+            tab.packed = None
+        tab.state = None
+        self.active = tab
+        return state
+    
+    def close(self, tab: WorkspaceTab):
+        """Forget a tab, flushing the journal of an inactive one"""
+        if tab.state is not None and tab.state['journal']:
+            journal = tab.state['journal']
+            journal.close(tab.state['layers'])
+        if tab.spill_path:
+            with contextlib.suppress(OSError):
+                os.remove(tab.spill_path)
+        self.tabs.remove(tab)
+        if tab is self.active:
+            self.active = None
+    
+    def close_all(self):
+        """Close every inactive tab and remove the spill directory"""
+        for tab in list(self.tabs):
+            if tab is not self.active:
+                self.close(tab)
+        if self.spill_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
 
 
 class HexMapApp:
     """Main application class using CustomTkinter"""
     
-    def __init__(self, root):
+    # Everything tied to one map layer: switch_layer swaps these as a unit, so each
+    # layer keeps its own canvas items, minimap, undo history, indexes and selection
+    LAYER_STATE = ('map_data', 'history', 'search_index', 'search_results', 'search_query', 'search_position',
+                   'statistics', 'biome_regions', 'shared_grid', 'canvas', 'minimap', 'hex_items', 'drawn_range',
+                   'view_hex_size', 'overview_base', 'overview_zoomed', 'selected_hex', 'scroll_position')
+    # Layer state that survives rebuilding the map view (the rest is redrawn)
+    VIEW_STATE = ('view_hex_size', 'selected_hex', 'scroll_position')
+    # Everything else tied to one open map: stash_map parks these with the LAYER_STATE
+    # of the current layer in the map's workspace tab
+    MAP_STATE = ('layers', 'layer_name', 'layer_states', 'map_path', 'journal', 'candidates', 'candidate_index',
+                 'tiles_dir')
+    
+    def __init__(self, root, use_cache: bool = True, memory_budget_mb: int = WORKSPACE_MEMORY_BUDGET_MB):
+        load_gui()
         self.root = root
         self.root.title("Hex Map Generator - West Marches")
         self.root.geometry("1200x800")
@@ -517,36 +3919,271 @@ class HexMapApp:
         self.settings = {
             'hex_size': 25,
             'show_grid': True,
-            'show_coordinates': False
+            'show_coordinates': False,
+            'renderer': 'atlas',
+            'memory_budget_mb': memory_budget_mb
         }
         self.setup_data = {
             'start_direction': 'W',
             'factions': [],
             'custom_locations': [],
             'map_width': 25,
-            'map_height': 20
+            'map_height': 20,
+            'candidates': 1,
+            'seed': '',
+            'layers': []
         }
         self.selected_hex = None
+        self.map_path = None
+        self.journal = None
+        self.atlas = TileAtlas()
+        self.hex_items = {}
+        self.view_hex_size = self.settings['hex_size']
+        self.drawn_range = None
+        self.view_update_pending = False
+        self.drag_start = None
+        self.drag_target = None
+        self.drag_panning = False
+        self.pan_pending = False
+        self.info_update_pending = False
+        self.timeline_mask = None
+        self.timeline_states = None
+        self.timeline_position = None
+        self.timeline_pending = False
+        self.overview_base = None
+        self.overview_zoomed = {}
+        self.canvas = None
+        self.minimap = None
+        self.export_thread = None
+        self.export_state = None
+        self.tiles_dir = None
+        self.map_server = None
+        self.history = EditHistory()
+        self.search_index = None
+        self.search_results = []
+        self.search_query = ''
+        self.search_position = 0
+        self.statistics = None
+        self.statistics_pending = False
+        self.candidates = []
+        self.candidate_index = 0
+        self.biome_regions = None
+        self.generation_cache = GenerationCache() if use_cache else None
+        self.shared_grid = None
+        self.layers = None
+        self.layer_name = MapLayers.SURFACE
+        self.layer_states = {}
+        self.scroll_position = None
+        self.workspace = MapWorkspace(memory_budget_mb * 1024 * 1024)
+        
+        # Screens that don't depend on the map are built once, then hidden and shown
+        self.screens = {}
+        self.screen_layouts = {}
         
         # Create main container
         self.container = ctk.CTkFrame(root)
         self.container.pack(fill='both', expand=True)
         
+        self.root.protocol('WM_DELETE_WINDOW', self.on_close)
+        self.root.bind('<Control-z>', self.undo)
+        self.root.bind('<Control-y>', self.redo)
+        self.root.bind('<Control-Z>', self.redo)
+        self.root.after(JOURNAL_COMPACT_INTERVAL_MS, self.compact_journal)
+        
         self.show_menu()
     
+    def on_close(self):
+        """Flush the autosave journal before the window closes"""
+        self.close_journal()
+        self.stop_map_server()
+        self.release_shared_grid()
+        self.workspace.close_all()
+        self.root.destroy()
+    
+    def release_shared_grid(self):
+        """Free the shared memory copies of the map's layers, if any were made"""
+        if self.shared_grid:
+            self.shared_grid.close()
+            self.shared_grid = None
+        for name, state in self.layer_states.items():
+            if name != self.layer_name and state['shared_grid']:
+                state['shared_grid'].close()
+                state['shared_grid'] = None
+    
+    def attach_journal(self, map_path: str, truncate: bool = False):
+        """Start journaling changes next to map_path"""
+        self.close_journal()
+        self.map_path = map_path
+        self.journal = MapJournal(map_path, truncate)
+        self.workspace.rename(self.workspace.active, os.path.basename(map_path), map_path)
+    
+    def close_journal(self):
+        """Compact and stop the current journal, if any"""
+        if self.journal:
+            self.journal.close(self.layers)
+            self.journal = None
+    
+    def compact_journal(self):
+        """Periodically fold the journal into a fresh map snapshot"""
+        if self.journal and self.journal.pending:
+            self.journal.compact(self.layers)
+        self.root.after(JOURNAL_COMPACT_INTERVAL_MS, self.compact_journal)
+    
+    def set_hex_field(self, q: int, r: int, field: str, value):
+        """Change a field of one hex and record it in the autosave journal"""
+        if self.statistics:
+            self.statistics.update(field, self.map_data['grid'][r][q].get(field, HEX_DEFAULTS.get(field)), value)
+            self.schedule_statistics_update()
+        self.map_data['grid'][r][q][field] = value
+        if field in ('explored', 'terrain'):
+            self.invalidate_overview()
+            if self.minimap:
+                self.minimap.update_hex(q, r)
+        if self.map_server and self.map_server.map_data is self.map_data:
+            self.map_server.hex_changed(q, r)
+        if self.search_index and field in ('notes', 'poi', 'settlement'):
+            self.search_index.update_hex(q, r)
+        if self.biome_regions and field == 'terrain':
+            self.biome_regions.update(q, r)
+        if self.shared_grid and field in ('terrain', 'explored', 'settlement', 'poi', 'link', 'river', 'road'):
+            self.shared_grid.update_hex(q, r, self.map_data['grid'][r][q])
+        if self.journal:
+            self.journal.record(field, value, q, r, self.layer_key())
+    
+    def apply_hex_changes(self, changes: List[Tuple[int, int, str, object]], label: str = 'edit'):
+        """Apply several (q, r, field, value) changes as one undoable batch with one partial redraw"""
+        grid, width = self.map_data['grid'], self.map_data['width']
+        diffs = []
+        for q, r, field, value in changes:
+            old = grid[r][q].get(field, HEX_DEFAULTS.get(field))
+            if old != value:
+                diffs.append((r * width + q, field, old, value))
+        if not diffs:
+            return
+        self.history.record(label, diffs)
+        self.apply_diffs(diffs, undo=False)
+    
+    def apply_diffs(self, diffs, undo: bool):
+        """Set the new (or, when undoing, old) values of diffs and refresh what they touch"""
+        # Edits go to the live map, so stop replaying a past session first
+        self.leave_timeline()
+        width = self.map_data['width']
+        changed = set()
+        map_changed = False
+        # Readers of the shared grid see the whole batch or none of it
+        with self.shared_grid or contextlib.nullcontext():
+            for index, field, old, new in diffs:
+                value = old if undo else new
+                if index < 0:
+                    if field in APPENDED_MAP_FIELDS:
+                        self.set_map_field(field, new, 'pop' if undo else 'append')
+                    else:
+                        self.set_map_field(field, value)
+                    map_changed = True
+                else:
+                    q, r = index % width, index // width
+                    self.set_hex_field(q, r, field, value)
+                    changed.add((q, r))
+        
+        if self.current_screen != 'map':
+            return
+        if map_changed:
+            self.update_timeline_controls()
+            self.draw_map()
+        else:
+            self.refresh_hexes(changed)
+        if self.selected_hex and (map_changed or self.selected_hex in changed):
+            q, r = self.selected_hex
+            self.update_info_panel(q, r, self.map_data['grid'][r][q])
+    
+    def undo(self, event=None):
+        """Revert the last change"""
+        if self.text_has_focus():
+            return None
+        step = self.history.undo()
+        if step:
+            self.apply_diffs(step[1], undo=True)
+        return 'break'
+    
+    def redo(self, event=None):
+        """Re-apply the last undone change"""
+        if self.text_has_focus():
+            return None
+        step = self.history.redo()
+        if step:
+            self.apply_diffs(step[1], undo=False)
+        return 'break'
+    
+    def text_has_focus(self) -> bool:
+        """Whether keyboard input currently goes to a text field (keeps its own shortcuts)"""
+        focus = self.root.focus_get()
+        return isinstance(focus, (tk.Text, tk.Entry))
+    
+    def reveal_mask(self, mask: HexBitset):
+        """Reveal every hex of a mask that is still unexplored"""
+        newly_revealed = mask - HexBitset.from_field(self.map_data, 'explored')
+        self.apply_hex_changes([(q, r, 'explored', True) for q, r in newly_revealed], 'bulk reveal')
+    
+    def set_map_field(self, field: str, value, op: str = 'set'):
+        """Change a map-level field and record it in the autosave journal
+
+        op 'append' adds value to the end of a list field, 'pop' removes its last item.
+        """
+        if op == 'append':
+            self.map_data.setdefault(field, []).append(value)
+        elif op == 'pop':
+            self.map_data[field].pop()
+            value = None
+        else:
+            self.map_data[field] = value
+        if field == 'fog_of_war_enabled':
+            self.invalidate_overview()
+            if self.minimap:
+                self.minimap.rebuild()
+        if field == 'sessions':
+            self.timeline_states = None
+        if self.map_server and self.map_server.map_data is self.map_data:
+            self.map_server.map_changed()
+        if self.journal:
+            self.journal.record(field, value, layer=self.layer_key(), op=op)
+    
     def clear_screen(self):
-        """Clear the current screen"""
+        """Hide the cached screens and destroy the rest (the map view)"""
+        if self.current_screen == 'map' and self.canvas is not None:
+            self.scroll_position = (self.canvas.xview()[0], self.canvas.yview()[0])
+        self.minimap = None
+        cached = set(self.screens.values())
         for widget in self.container.winfo_children():
-            widget.destroy()
+            if widget in cached:
+                if widget.winfo_manager():
+                    getattr(widget, widget.winfo_manager() + '_forget')()
+            else:
+                widget.destroy()
+    
+    def show_cached_screen(self, name: str) -> bool:
+        """Switch to a screen, re-showing its cached frame if it was built before"""
+        self.clear_screen()
+        self.current_screen = name
+        frame = self.screens.get(name)
+        if frame is None:
+            return False
+        manager, options = self.screen_layouts[frame]
+        getattr(frame, manager)(**options)
+        return True
+    
+    def lay_out_screen(self, frame, manager: str, **options):
+        """Show a screen frame with pack or place, remembering how so it is shown the same way again"""
+        self.screen_layouts[frame] = (manager, options)
+        getattr(frame, manager)(**options)
     
     def show_menu(self):
         """Display the main menu"""
-        self.clear_screen()
-        self.current_screen = 'menu'
+        if self.show_cached_screen('menu'):
+            return
         
         # Menu frame
         menu_frame = ctk.CTkFrame(self.container)
-        menu_frame.place(relx=0.5, rely=0.5, anchor='center')
+        self.lay_out_screen(menu_frame, 'place', relx=0.5, rely=0.5, anchor='center')
         
         # Title
         title = ctk.CTkLabel(
@@ -584,6 +4221,16 @@ class HexMapApp:
         )
         btn_load.pack(pady=10)
         
+        btn_open = ctk.CTkButton(
+            menu_frame,
+            text="🗺 Open Maps",
+            font=("Arial", 14, "bold"),
+            height=50,
+            width=300,
+            command=self.show_map
+        )
+        btn_open.pack(pady=10)
+        
         btn_settings = ctk.CTkButton(
             menu_frame,
             text="⚙ Settings",
@@ -593,15 +4240,16 @@ class HexMapApp:
             command=self.show_settings
         )
         btn_settings.pack(padx=20, pady=(10, 20))
+        self.screens['menu'] = menu_frame
     
     def show_setup(self):
-        """Display the map setup screen"""
-        self.clear_screen()
-        self.current_screen = 'setup'
+        """Display the map setup screen (entries keep their values between visits)"""
+        if self.show_cached_screen('setup'):
+            return
         
         # Setup frame
         setup_frame = ctk.CTkFrame(self.container)
-        setup_frame.pack(fill='both', expand=True, padx=20, pady=20)
+        self.lay_out_screen(setup_frame, 'pack', fill='both', expand=True, padx=20, pady=20)
         
         # Back button
         btn_back = ctk.CTkButton(
@@ -674,6 +4322,41 @@ class HexMapApp:
         )
         height_entry.pack(fill='x', pady=5)
         
+        # Candidates: generate several maps and keep the best scoring ones
+        candidates_frame = ctk.CTkFrame(size_inner)
+        candidates_frame.pack(side='left', expand=True, fill='x', padx=10)
+        
+        ctk.CTkLabel(
+            candidates_frame,
+            text="Candidates (best of):",
+            font=("Arial", 11)
+        ).pack(anchor='w')
+        
+        self.candidates_var = tk.IntVar(value=self.setup_data['candidates'])
+        ctk.CTkEntry(
+            candidates_frame,
+            textvariable=self.candidates_var,
+            width=100
+        ).pack(fill='x', pady=5)
+        
+        # Seed: the same setup and seed always give the same map (and hit the cache)
+        seed_frame = ctk.CTkFrame(size_inner)
+        seed_frame.pack(side='left', expand=True, fill='x', padx=10)
+        
+        ctk.CTkLabel(
+            seed_frame,
+            text="Seed (optional):",
+            font=("Arial", 11)
+        ).pack(anchor='w')
+        
+        self.seed_var = tk.StringVar(value=self.setup_data['seed'])
+        ctk.CTkEntry(
+            seed_frame,
+            textvariable=self.seed_var,
+            placeholder_text="random",
+            width=100
+        ).pack(fill='x', pady=5)
+        
         # Starting Direction
         dir_frame = ctk.CTkFrame(scrollable_frame)
         dir_frame.pack(fill='x', pady=(0, 15), padx=10)
@@ -699,6 +4382,24 @@ class HexMapApp:
                 value=value
             ).pack(side='left', padx=10)
         
+        # Layers: an underdark below the surface, linked at caves and dungeons
+        layers_frame = ctk.CTkFrame(scrollable_frame)
+        layers_frame.pack(fill='x', pady=(0, 15), padx=10)
+        
+        layers_label = ctk.CTkLabel(
+            layers_frame,
+            text="Layers",
+            font=("Arial", 14, "bold")
+        )
+        layers_label.pack(pady=10)
+        
+        self.underdark_var = tk.BooleanVar(value='underdark' in self.setup_data['layers'])
+        ctk.CTkCheckBox(
+            layers_frame,
+            text="Underdark below the surface (linked at caves and dungeons)",
+            variable=self.underdark_var
+        ).pack(pady=(0, 10))
+        
         # Factions
         faction_frame = ctk.CTkFrame(scrollable_frame)
         faction_frame.pack(fill='x', pady=(0, 15), padx=10)
@@ -812,6 +4513,7 @@ class HexMapApp:
             hover_color="dark green",
             command=self.generate_map
         ).pack(pady=20)
+        self.screens['setup'] = setup_frame
     
     def add_faction(self):
         """Add a faction to the list"""
@@ -847,12 +4549,18 @@ class HexMapApp:
     
     def show_settings(self):
         """Display settings screen"""
-        self.clear_screen()
-        self.current_screen = 'settings'
+        if self.show_cached_screen('settings'):
+            # Discard unsaved changes from the last visit
+            self.hex_size_var.set(self.settings['hex_size'])
+            self.hex_value_label.configure(text=str(self.settings['hex_size']))
+            self.show_grid_var.set(self.settings['show_grid'])
+            self.show_coords_var.set(self.settings['show_coordinates'])
+            self.memory_budget_var.set(str(self.settings['memory_budget_mb']))
+            return
         
         # Settings frame
         settings_frame = ctk.CTkFrame(self.container)
-        settings_frame.pack(fill='both', expand=True, padx=20, pady=20)
+        self.lay_out_screen(settings_frame, 'pack', fill='both', expand=True, padx=20, pady=20)
         
         # Back button
         btn_back = ctk.CTkButton(
@@ -885,51 +4593,76 @@ class HexMapApp:
             font=("Arial", 12)
         ).pack(side='left', padx=10)
         
-        hex_size_var = tk.IntVar(value=self.settings['hex_size'])
+        self.hex_size_var = tk.IntVar(value=self.settings['hex_size'])
         hex_slider = ctk.CTkSlider(
             hex_size_frame,
             from_=15,
             to=50,
-            variable=hex_size_var,
+            variable=self.hex_size_var,
             width=200
         )
         hex_slider.pack(side='left', padx=10)
         
-        hex_value_label = ctk.CTkLabel(
+        self.hex_value_label = ctk.CTkLabel(
             hex_size_frame,
             text=str(self.settings['hex_size']),
             width=40
         )
-        hex_value_label.pack(side='left')
+        self.hex_value_label.pack(side='left')
         
         def update_hex_label(value):
-            hex_value_label.configure(text=str(int(float(value))))
+            self.hex_value_label.configure(text=str(int(float(value))))
         
         hex_slider.configure(command=update_hex_label)
         
         # Show grid
-        show_grid_var = tk.BooleanVar(value=self.settings['show_grid'])
+        self.show_grid_var = tk.BooleanVar(value=self.settings['show_grid'])
         ctk.CTkCheckBox(
             content,
             text="Show Grid Lines",
-            variable=show_grid_var,
+            variable=self.show_grid_var,
             font=("Arial", 12)
         ).pack(pady=10, padx=20)
         
         # Show coordinates
-        show_coords_var = tk.BooleanVar(value=self.settings['show_coordinates'])
+        self.show_coords_var = tk.BooleanVar(value=self.settings['show_coordinates'])
         ctk.CTkCheckBox(
             content,
             text="Show Coordinates",
-            variable=show_coords_var,
+            variable=self.show_coords_var,
             font=("Arial", 12)
         ).pack(pady=10, padx=20)
         
+        # Memory for the maps open in inactive tabs; past it they are compressed or spilled to disk
+        budget_frame = ctk.CTkFrame(content)
+        budget_frame.pack(fill='x', pady=10, padx=20)
+        
+        ctk.CTkLabel(
+            budget_frame,
+            text="Inactive Map Memory (MB):",
+            font=("Arial", 12)
+        ).pack(side='left', padx=10)
+        
+        self.memory_budget_var = tk.StringVar(value=str(self.settings['memory_budget_mb']))
+        ctk.CTkEntry(
+            budget_frame,
+            textvariable=self.memory_budget_var,
+            width=80
+        ).pack(side='left', padx=10)
+        
         # Save button
         def save_settings():
-            self.settings['hex_size'] = int(hex_size_var.get())
-            self.settings['show_grid'] = show_grid_var.get()
-            self.settings['show_coordinates'] = show_coords_var.get()
+            try:
+                memory_budget_mb = max(0, int(self.memory_budget_var.get()))
+            except ValueError:
+                messagebox.showerror("Error", "Please enter a whole number of megabytes")
+                return
+            self.settings['hex_size'] = int(self.hex_size_var.get())
+            self.settings['show_grid'] = self.show_grid_var.get()
+            self.settings['show_coordinates'] = self.show_coords_var.get()
+            self.settings['memory_budget_mb'] = memory_budget_mb
+            self.workspace.budget = memory_budget_mb * 1024 * 1024
+            self.workspace.enforce()
             messagebox.showinfo("Settings", "Settings saved!")
         
         ctk.CTkButton(
@@ -941,21 +4674,25 @@ class HexMapApp:
             hover_color="dark green",
             command=save_settings
         ).pack(pady=20)
+        self.screens['settings'] = settings_frame
     
     def generate_map(self):
         """Generate a new map"""
         # Update setup data from UI
         self.setup_data['start_direction'] = self.dir_var.get()
+        self.setup_data['layers'] = ['underdark'] if self.underdark_var.get() else []
         
         try:
             self.setup_data['map_width'] = int(self.width_var.get())
             self.setup_data['map_height'] = int(self.height_var.get())
+            self.setup_data['candidates'] = max(1, int(self.candidates_var.get()))
+            self.setup_data['seed'] = self.seed_var.get().strip()
+            seed = int(self.setup_data['seed']) if self.setup_data['seed'] else None
         except:
-            messagebox.showerror("Error", "Please enter valid numbers for width and height")
+            messagebox.showerror("Error", "Please enter valid numbers for width, height, candidates and seed")
             return
         
-        # Generate map
-        generator = MapGenerator(
+        params = (
             self.setup_data['map_width'],
             self.setup_data['map_height'],
             self.setup_data['start_direction'],
@@ -963,21 +4700,283 @@ class HexMapApp:
             self.setup_data['custom_locations']
         )
         
-        grid = generator.generate()
+        lower_sets = self.setup_data['layers']
         
-        self.map_data = {
-            'grid': grid,
+        # Generation runs in a worker thread so the window stays responsive
+        if self.export_running():
+            return
+        
+        if self.setup_data['candidates'] == 1:
+            if seed is None:
+                seed = random.randrange(2 ** 32)
+            terrain_sets = ['surface'] + lower_sets
+            
+            def generate(report):
+                # Each layer is generated in its own worker process
+                grids = generate_layers(*params, terrain_sets, [seed], cache=self.generation_cache, progress=report)
+                return ({terrain_set: grids[(seed, terrain_set)][0] for terrain_set in terrain_sets},
+                        grids[(seed, 'surface')][1])
+            
+            def open_map(result):
+                self.open_generated_map(result[0], seed, result[1])
+            
+            self.start_export("map", generate, lambda result: None, on_done=open_map)
+            return
+        
+        # Best of N: score the candidates in worker processes, keep the top few to flip through
+        count = self.setup_data['candidates']
+        
+        def task(report):
+            results = generate_best_of(*params, candidates=count, keep=CANDIDATES_KEPT, seed=seed, progress=report)
+            # The layers below the kept candidates are then generated together
+            grids = generate_layers(*params, lower_sets, [result[1] for result in results],
+                                    cache=self.generation_cache)
+            return [
+                result + ({terrain_set: grids[(result[1], terrain_set)][0] for terrain_set in lower_sets},)
+                for result in results
+            ]
+        
+        def describe(results):
+            if not results:
+                return f"All {count} candidates were rejected; try again or lower the requirements."
+            return (f"Best of {count} candidates: score {results[0][0]:.2f}"
+                    + (f"\nUse 🎲 Next Candidate to compare the top {len(results)}." if len(results) > 1 else ""))
+        
+        self.start_export(f"{count} candidates", task, describe, on_done=self.open_candidates)
+    
+    def open_candidates(self, results):
+        """Show the best of the generated candidates, keeping the others for comparison"""
+        if results:
+            score, seed, scores, grid, climate, lower = results[0]
+            self.open_generated_map({'surface': grid, **lower}, seed, climate, results)
+    
+    def next_candidate(self):
+        """Replace the map with the next best kept candidate"""
+        if len(self.candidates) < 2:
+            return
+        if self.history.undo_stack and not messagebox.askyesno(
+                "Next Candidate", "Switching candidates discards your edits to this map. Continue?"):
+            return
+        self.candidate_index = (self.candidate_index + 1) % len(self.candidates)
+        score, seed, scores, grid, climate, lower = self.candidates[self.candidate_index]
+        self.open_generated_map({'surface': grid, **lower}, seed, climate, replace=True)
+    
+    def open_generated_map(self, grids: Dict[str, List[List[Dict]]], seed: int, climate: Dict[str, str],
+                           candidates: Optional[List] = None, replace: bool = False):
+        """Open freshly generated layer grids, keyed by terrain set, in a new tab (or in place of the current map)
+
+        climate is the surface generator's packed climate, saved with the map.
+        """
+        map_data = {
+            'grid': grids['surface'],
             'width': self.setup_data['map_width'],
             'height': self.setup_data['map_height'],
             'start_direction': self.setup_data['start_direction'],
             'factions': self.setup_data['factions'],
             'custom_locations': self.setup_data['custom_locations'],
             'created_at': datetime.now().isoformat(),
-            'fog_of_war_enabled': True
+            'seed': seed,
+            'fog_of_war_enabled': True,
+            'climate': climate
         }
+        # Lower layers are stacked below the surface and linked at its caves and dungeons
+        for terrain_set, grid in grids.items():
+            if terrain_set != 'surface':
+                layer = MapLayers.add(map_data, grid, terrain_set)
+                MapLayers.link(grids['surface'], grid, MapLayers.SURFACE, layer['name'])
+        # A fresh map has no file yet; journaling starts on the first export
+        if replace:
+            self.close_journal()
+            self.map_path = None
+            self.open_layers(map_data)
+        else:
+            self.open_tab(map_data, candidates=candidates)
         
         self.show_map()
     
+    def open_tab(self, map_data: Dict, map_path: Optional[str] = None, candidates: Optional[List] = None):
+        """Open a map in a new workspace tab, parking the current map in its own tab"""
+        self.stash_map()
+        self.workspace.active = self.workspace.add("New Map")
+        self.map_path = None
+        self.candidates = candidates or []
+        self.candidate_index = 0
+        self.tiles_dir = None
+        self.open_layers(map_data)
+        if map_path:
+            self.attach_journal(map_path)
+    
+    def stash_map(self):
+        """Park the current map in its workspace tab with its journal, history, selection and view"""
+        tab = self.workspace.active
+        if tab is None:
+            return
+        self.stop_map_server()
+        self.release_shared_grid()
+        if self.current_screen == 'map' and self.canvas is not None:
+            self.scroll_position = (self.canvas.xview()[0], self.canvas.yview()[0])
+        state = {attr: getattr(self, attr) for attr in self.MAP_STATE + self.LAYER_STATE}
+        state['layer_states'] = {name: layer_state for name, layer_state in self.layer_states.items()
+                                 if name != self.layer_name}
+        # The canvases go with the map view; show_map draws the map again where it was left
+        for layer_state in [state, *state['layer_states'].values()]:
+            layer_state.update(self.layer_render_state(keep_view=True))
+        hexes = self.map_data['width'] * self.map_data['height'] * (1 + len(state['layer_states']))
+        self.journal = None
+        self.layers = None
+        self.map_data = None
+        self.workspace.stash(tab, state, hexes)
+    
+    def restore_map(self, tab: WorkspaceTab):
+        """Make the map of a workspace tab the current one again"""
+        for attr, value in self.workspace.restore(tab).items():
+            setattr(self, attr, value)
+    
+    def switch_tab(self, title: str):
+        """Show another open map as it was left"""
+        tab = self.workspace.find(title)
+        if tab is None:
+            return
+        if tab is not self.workspace.active:
+            self.stash_map()
+            self.restore_map(tab)
+        elif self.current_screen == 'map':
+            return
+        self.show_map()
+    
+    def close_tab(self):
+        """Close the current map and show the most recently used of the others"""
+        if self.workspace.active is None:
+            return
+        if not self.map_path and not messagebox.askyesno(
+                "Close Map", "This map has not been exported and will be lost. Close it?"):
+            return
+        self.stop_map_server()
+        self.release_shared_grid()
+        self.close_journal()
+        self.workspace.close(self.workspace.active)
+        self.layers = None
+        self.map_data = None
+        if self.workspace.tabs:
+            self.restore_map(max(self.workspace.tabs, key=lambda tab: tab.last_used))
+            self.show_map()
+        else:
+            self.show_menu()
+    
+    def open_layers(self, map_data: Dict):
+        """Make map_data the current map, starting on its surface layer"""
+        self.stop_map_server()
+        self.release_shared_grid()
+        self.layers = MapLayers(map_data)
+        self.layer_name = MapLayers.SURFACE
+        self.layer_states = {}
+        for attr, value in self.new_layer_state(map_data).items():
+            setattr(self, attr, value)
+    
+    def new_layer_state(self, map_data: Dict) -> Dict:
+        """LAYER_STATE values for a layer opened for the first time"""
+        search_index = HexSearchIndex(map_data)
+        search_index.start()
+        state = {
+            'map_data': map_data,
+            'history': EditHistory(),
+            'search_index': search_index,
+            'search_results': [],
+            'search_query': '',
+            'search_position': 0,
+            'statistics': MapStatistics(map_data),
+            'biome_regions': BiomeRegions(map_data['grid']),
+            'shared_grid': None
+        }
+        state.update(self.layer_render_state())
+        return state
+    
+    def layer_render_state(self, keep_view: bool = False) -> Dict:
+        """LAYER_STATE values of a layer whose canvas has not been built yet (but for VIEW_STATE if keep_view)"""
+        state = {
+            'canvas': None,
+            'minimap': None,
+            'hex_items': {},
+            'drawn_range': None,
+            'view_hex_size': self.settings['hex_size'],
+            'overview_base': None,
+            'overview_zoomed': {},
+            'selected_hex': None,
+            'scroll_position': None
+        }
+        if keep_view:
+            for key in self.VIEW_STATE:
+                del state[key]
+        return state
+    
+    def layer_key(self) -> Optional[str]:
+        """Layer name journal records of the current layer carry (None for the surface)"""
+        return None if self.layer_name == MapLayers.SURFACE else self.layer_name
+    
+    def switch_layer(self, name: str):
+        """Show another layer of the map
+
+        The layer we leave keeps its canvas (hidden, with all its items), so
+        coming back to it redraws nothing. A layer is unpacked, indexed and
+        drawn the first time it is shown.
+        """
+        if name == self.layer_name or name not in self.layers.names():
+            return
+        self.leave_timeline()
+        previous = {attr: getattr(self, attr) for attr in self.LAYER_STATE}
+        self.layer_states[self.layer_name] = previous
+        state = self.layer_states.get(name) or self.new_layer_state(self.layers.layer_map(name))
+        for attr, value in state.items():
+            setattr(self, attr, value)
+        self.layer_name = name
+        if self.current_screen != 'map':
+            return
+        
+        self.tool_points = []
+        previous['canvas'].pack_forget()
+        previous['minimap'].canvas.pack_forget()
+        if self.canvas is None:
+            # Open at the zoom and position of the layer we came from
+            self.view_hex_size = previous['view_hex_size']
+            self.create_layer_view()
+            self.canvas.configure(scrollregion=self.map_scrollregion())
+            self.canvas.xview_moveto(previous['canvas'].xview()[0])
+            self.canvas.yview_moveto(previous['canvas'].yview()[0])
+            self.draw_map()
+        else:
+            self.show_layer_view()
+        
+        self.layer_var.set(name)
+        self.fill_legend()
+        self.update_timeline_controls()
+        self.update_statistics_panel()
+        self.search_var.set(self.search_query)
+        self.search_status.configure(text="")
+        if self.selected_hex:
+            q, r = self.selected_hex
+            self.update_info_panel(q, r, self.map_data['grid'][r][q])
+        else:
+            self.notes_text.configure(state='normal')
+            self.notes_text.delete('0.0', 'end')
+            self.notes_text.insert('0.0', 'Click a hex to view details and edit notes...')
+            self.notes_text.configure(state='disabled')
+            self.save_notes_btn.configure(state='disabled')
+    
+    def follow_link(self):
+        """Go to the layer the selected hex links to, selecting the same hex there"""
+        if not self.selected_hex:
+            return
+        q, r = self.selected_hex
+        link = self.map_data['grid'][r][q].get('link')
+        if not link:
+            messagebox.showinfo("Follow Link", "The selected hex does not lead to another layer.")
+            return
+        self.switch_layer(link)
+        self.selected_hex = (q, r)
+        self.center_view_on(q, r)
+        self.update_info_panel(q, r, self.map_data['grid'][r][q])
+        self.draw_selection()
+    
     def show_map(self):
         """Display the map view"""
         if not self.map_data:
@@ -985,7 +4984,32 @@ class HexMapApp:
         
         self.clear_screen()
         self.current_screen = 'map'
-        self.selected_hex = None
+        # The canvases of the previous map view are gone; every layer is drawn afresh
+        # at the zoom, selection and scroll position it had
+        for state in self.layer_states.values():
+            state.update(self.layer_render_state(keep_view=True))
+        for attr, value in self.layer_render_state(keep_view=True).items():
+            setattr(self, attr, value)
+        
+        # Tabs of the open maps
+        if len(self.workspace.tabs) > 1:
+            tabs_bar = ctk.CTkFrame(self.container)
+            tabs_bar.pack(fill='x', padx=10, pady=(5, 0))
+            
+            self.tab_var = tk.StringVar(value=self.workspace.active.title)
+            ctk.CTkSegmentedButton(
+                tabs_bar,
+                values=self.workspace.titles(),
+                variable=self.tab_var,
+                command=self.switch_tab
+            ).pack(side='left', padx=5, pady=5)
+            
+            ctk.CTkButton(
+                tabs_bar,
+                text="✕ Close Map",
+                width=100,
+                command=self.close_tab
+            ).pack(side='left', padx=5)
         
         # Create main layout
         top_bar = ctk.CTkFrame(self.container, height=60)
@@ -1005,6 +5029,27 @@ class HexMapApp:
             command=self.export_map
         ).pack(side='left', padx=5)
         
+        ctk.CTkButton(
+            top_bar,
+            text="🖼 Export Image",
+            width=120,
+            command=self.export_image
+        ).pack(side='left', padx=5)
+        
+        ctk.CTkButton(
+            top_bar,
+            text="🗺 Export Tiles",
+            width=120,
+            command=self.export_tiles
+        ).pack(side='left', padx=5)
+        
+        ctk.CTkButton(
+            top_bar,
+            text="📡 Share",
+            width=90,
+            command=self.toggle_map_server
+        ).pack(side='left', padx=5)
+        
         ctk.CTkButton(
             top_bar,
             text="👁 Reveal Selected",
@@ -1023,6 +5068,20 @@ class HexMapApp:
             command=self.hide_selected_hex
         ).pack(side='left', padx=5)
         
+        ctk.CTkButton(
+            top_bar,
+            text="↶",
+            width=36,
+            command=self.undo
+        ).pack(side='left', padx=(5, 0))
+        
+        ctk.CTkButton(
+            top_bar,
+            text="↷",
+            width=36,
+            command=self.redo
+        ).pack(side='left', padx=(2, 5))
+        
         ctk.CTkButton(
             top_bar,
             text="🌫️ Toggle Fog of War",
@@ -1032,33 +5091,143 @@ class HexMapApp:
             command=self.toggle_fog_of_war
         ).pack(side='left', padx=5)
         
+        if len(self.candidates) > 1 and not self.map_path:
+            score = self.candidates[self.candidate_index][0]
+            ctk.CTkButton(
+                top_bar,
+                text=f"🎲 Next Candidate ({self.candidate_index + 1}/{len(self.candidates)}, {score:.2f})",
+                width=200,
+                command=self.next_candidate
+            ).pack(side='left', padx=5)
+        
+        # Layer switcher, and a jump through the selected hex's cave or dungeon link
+        if len(self.layers.names()) > 1:
+            self.layer_var = tk.StringVar(value=self.layer_name)
+            ctk.CTkSegmentedButton(
+                top_bar,
+                values=self.layers.names(),
+                variable=self.layer_var,
+                command=self.switch_layer
+            ).pack(side='left', padx=5)
+            
+            ctk.CTkButton(
+                top_bar,
+                text="⇅ Follow Link",
+                width=110,
+                command=self.follow_link
+            ).pack(side='left', padx=5)
+        
         # Main content area
         content_frame = ctk.CTkFrame(self.container)
         content_frame.pack(fill='both', expand=True, padx=10, pady=5)
         
-        # Canvas frame (left) - using tk.Canvas since CTk doesn't have canvas
-        canvas_container = ctk.CTkFrame(content_frame)
-        canvas_container.pack(side='left', fill='both', expand=True, padx=(0, 5))
+        # Canvas frame (left) - using tk.Canvas since CTk doesn't have canvas; each
+        # layer gets its own canvas (create_layer_view) sharing these scrollbars
+        self.canvas_container = ctk.CTkFrame(content_frame)
+        self.canvas_container.pack(side='left', fill='both', expand=True, padx=(0, 5))
         
-        self.canvas = tk.Canvas(
-            canvas_container,
-            bg='#1f2937',
-            highlightthickness=0
+        self.h_scroll = tk.Scrollbar(self.canvas_container, orient='horizontal')
+        self.v_scroll = tk.Scrollbar(self.canvas_container, orient='vertical')
+        self.h_scroll.pack(side='bottom', fill='x')
+        self.v_scroll.pack(side='right', fill='y')
+        
+        # Sidebar (right); the layer's minimap is packed on top of the tools
+        sidebar = ctk.CTkFrame(content_frame, width=350)
+        sidebar.pack(side='right', fill='y', padx=(5, 0))
+        sidebar.pack_propagate(False)
+        self.sidebar = sidebar
+        
+        # Fog tools: bulk reveals applied as a single change
+        self.tools_frame = ctk.CTkFrame(sidebar)
+        self.tools_frame.pack(fill='x', padx=10, pady=(0, 5))
+        
+        self.fog_tool_var = tk.StringVar(value='Select')
+        self.tool_points = []
+        ctk.CTkOptionMenu(
+            self.tools_frame,
+            values=FOG_TOOLS,
+            variable=self.fog_tool_var,
+            command=self.on_fog_tool_changed,
+            width=140
+        ).pack(side='left', padx=5, pady=5)
+        
+        ctk.CTkLabel(
+            self.tools_frame,
+            text="Radius:",
+            font=("Arial", 10)
+        ).pack(side='left')
+        
+        self.fog_radius_var = tk.StringVar(value='2')
+        ctk.CTkEntry(
+            self.tools_frame,
+            textvariable=self.fog_radius_var,
+            width=36
+        ).pack(side='left', padx=5)
+        
+        ctk.CTkButton(
+            self.tools_frame,
+            text="Apply",
+            width=60,
+            command=self.apply_fog_tool
+        ).pack(side='left', padx=5)
+        
+        # Search: words (word* for prefixes), faction:<name>, terrain:<name>
+        search_frame = ctk.CTkFrame(sidebar)
+        search_frame.pack(fill='x', padx=10, pady=(0, 5))
+        
+        self.search_var = tk.StringVar(value=self.search_query)
+        search_entry = ctk.CTkEntry(
+            search_frame,
+            textvariable=self.search_var,
+            placeholder_text="Search notes, POIs, settlements...",
+            width=210
         )
+        search_entry.pack(side='left', padx=5, pady=5)
+        search_entry.bind('<Return>', self.run_search)
         
-        h_scroll = tk.Scrollbar(canvas_container, orient='horizontal', command=self.canvas.xview)
-        v_scroll = tk.Scrollbar(canvas_container, orient='vertical', command=self.canvas.yview)
+        ctk.CTkButton(
+            search_frame,
+            text="🔍",
+            width=36,
+            command=self.run_search
+        ).pack(side='left')
         
-        self.canvas.configure(xscrollcommand=h_scroll.set, yscrollcommand=v_scroll.set)
+        self.search_status = ctk.CTkLabel(
+            search_frame,
+            text="",
+            font=("Arial", 10),
+            width=60
+        )
+        self.search_status.pack(side='left', padx=5)
+        
+        # Session timeline: scrub back through the explored state after each session
+        timeline_frame = ctk.CTkFrame(sidebar)
+        timeline_frame.pack(fill='x', padx=10, pady=(0, 5))
+        
+        self.timeline_slider = ctk.CTkSlider(
+            timeline_frame,
+            from_=0,
+            to=1,
+            width=120,
+            command=self.on_timeline_moved
+        )
+        self.timeline_slider.pack(side='left', padx=5, pady=5)
         
-        h_scroll.pack(side='bottom', fill='x')
-        v_scroll.pack(side='right', fill='y')
-        self.canvas.pack(side='left', fill='both', expand=True)
+        self.timeline_label = ctk.CTkLabel(
+            timeline_frame,
+            text="",
+            font=("Arial", 10),
+            width=80
+        )
+        self.timeline_label.pack(side='left')
         
-        # Sidebar (right)
-        sidebar = ctk.CTkFrame(content_frame, width=350)
-        sidebar.pack(side='right', fill='y', padx=(5, 0))
-        sidebar.pack_propagate(False)
+        ctk.CTkButton(
+            timeline_frame,
+            text="📸 End Session",
+            width=100,
+            command=self.end_session
+        ).pack(side='left', padx=5)
+        self.update_timeline_controls()
         
         # Legend
         legend_label = ctk.CTkLabel(
@@ -1066,52 +5235,42 @@ class HexMapApp:
             text="Legend",
             font=("Arial", 16, "bold")
         )
-        legend_label.pack(pady=(10, 5))
+        legend_label.pack(pady=(5, 5))
         
         # Scrollable legend
-        legend_scroll_frame = ctk.CTkScrollableFrame(sidebar, width=330, height=250)
-        legend_scroll_frame.pack(fill='x', pady=(0, 10), padx=10)
+        self.legend_frame = ctk.CTkScrollableFrame(sidebar, width=330, height=150)
+        self.legend_frame.pack(fill='x', pady=(0, 10), padx=10)
+        self.fill_legend()
         
-        for terrain_key, terrain in ALL_TERRAINS.items():
-            item_frame = ctk.CTkFrame(legend_scroll_frame)
-            item_frame.pack(fill='x', pady=2)
-            
-            color_box = ctk.CTkLabel(
-                item_frame,
-                text="  ",
-                fg_color=terrain['color'],
-                width=30
-            )
-            color_box.pack(side='left', padx=5)
-            
-            ctk.CTkLabel(
-                item_frame,
-                text=terrain['name'],
-                font=("Arial", 10),
-                anchor='w'
-            ).pack(side='left', fill='x', expand=True)
+        # Statistics panel, kept current by MapStatistics.update
+        stats_frame = ctk.CTkFrame(sidebar)
+        stats_frame.pack(fill='x', padx=10)
         
-        # Symbols
-        ctk.CTkLabel(
-            legend_scroll_frame,
-            text="⌂ Settlement",
-            font=("Arial", 10),
-            anchor='w'
-        ).pack(fill='x', pady=2, padx=5)
+        stats_header = ctk.CTkFrame(stats_frame, fg_color='transparent')
+        stats_header.pack(fill='x')
         
         ctk.CTkLabel(
-            legend_scroll_frame,
-            text="★ Point of Interest",
-            font=("Arial", 10),
-            anchor='w'
-        ).pack(fill='x', pady=2, padx=5)
+            stats_header,
+            text="Statistics",
+            font=("Arial", 16, "bold")
+        ).pack(side='left', padx=5)
         
-        ctk.CTkLabel(
-            legend_scroll_frame,
-            text="★★ Multiple POIs",
+        ctk.CTkButton(
+            stats_header,
+            text="📊 CSV",
+            width=60,
+            command=self.export_statistics
+        ).pack(side='right', padx=5, pady=5)
+        
+        self.stats_label = ctk.CTkLabel(
+            stats_frame,
+            text=self.statistics.summary(),
             font=("Arial", 10),
-            anchor='w'
-        ).pack(fill='x', pady=2, padx=5)
+            justify='left',
+            anchor='w',
+            wraplength=320
+        )
+        self.stats_label.pack(fill='x', padx=5, pady=(0, 5))
         
         # Notes section
         notes_label = ctk.CTkLabel(
@@ -1152,13 +5311,102 @@ class HexMapApp:
             command=self.save_notes,
             state='disabled'
         )
-        self.save_notes_btn.pack(pady=(0, 10), padx=10)
+        self.save_notes_btn.pack(pady=(0, 10), padx=10)
+        
+        # Draw the map, where it was left if it was shown before (always live, not replaying a session)
+        self.timeline_mask = None
+        self.timeline_states = None
+        self.create_layer_view()
+        if self.scroll_position:
+            self.canvas.configure(scrollregion=self.map_scrollregion())
+            self.canvas.xview_moveto(self.scroll_position[0])
+            self.canvas.yview_moveto(self.scroll_position[1])
+        self.draw_map()
+        if self.selected_hex:
+            q, r = self.selected_hex
+            self.update_info_panel(q, r, self.map_data['grid'][r][q])
+    
+    def create_layer_view(self):
+        """Build and show the canvas and minimap of the current layer"""
+        self.canvas = tk.Canvas(
+            self.canvas_container,
+            bg=CANVAS_BG_COLOR,
+            highlightthickness=0
+        )
+        self.canvas.configure(
+            xscrollcommand=lambda first, last: self.on_canvas_scroll(self.h_scroll, first, last),
+            yscrollcommand=lambda first, last: self.on_canvas_scroll(self.v_scroll, first, last)
+        )
         
-        # Draw the map
-        self.draw_map()
+        # Minimap: click or drag to move the map view
+        self.minimap = Minimap(self.sidebar, self.map_data, self.center_view_on)
+        self.show_layer_view()
+        
+        # Bind click and drag, arrow key, zoom and resize events
+        self.canvas.bind('<Button-1>', self.on_canvas_press)
+        self.canvas.bind('<B1-Motion>', self.on_canvas_drag)
+        self.canvas.bind('<ButtonRelease-1>', self.on_canvas_release)
+        for key in ARROW_KEY_SIDES:
+            self.canvas.bind(f'<{key}>', self.on_arrow_key)
+        self.canvas.bind('<MouseWheel>', self.on_mouse_wheel)
+        self.canvas.bind('<Button-4>', self.on_mouse_wheel)
+        self.canvas.bind('<Button-5>', self.on_mouse_wheel)
+        self.canvas.bind('<Configure>', self.schedule_view_update)
+    
+    def show_layer_view(self):
+        """Pack the current layer's canvas and minimap and hook up the shared scrollbars"""
+        self.canvas.pack(side='left', fill='both', expand=True)
+        self.minimap.canvas.pack(pady=(10, 5), padx=10, before=self.tools_frame)
+        self.h_scroll.configure(command=self.canvas.xview)
+        self.v_scroll.configure(command=self.canvas.yview)
+        self.h_scroll.set(*self.canvas.xview())
+        self.v_scroll.set(*self.canvas.yview())
+    
+    def fill_legend(self):
+        """List the terrains of the current layer and the map symbols in the legend"""
+        for widget in self.legend_frame.winfo_children():
+            widget.destroy()
+        
+        terrains = TERRAIN_SETS[self.map_data.get('terrain_set', 'surface')]['terrains']
+        for terrain_key, terrain in terrains.items():
+            item_frame = ctk.CTkFrame(self.legend_frame)
+            item_frame.pack(fill='x', pady=2)
+            
+            color_box = ctk.CTkLabel(
+                item_frame,
+                text="  ",
+                fg_color=terrain['color'],
+                width=30
+            )
+            color_box.pack(side='left', padx=5)
+            
+            ctk.CTkLabel(
+                item_frame,
+                text=terrain['name'],
+                font=("Arial", 10),
+                anchor='w'
+            ).pack(side='left', fill='x', expand=True)
+        
+        # Symbols
+        symbols = ["⌂ Settlement", "★ Point of Interest", "★★ Multiple POIs"]
+        if len(self.layers.names()) > 1:
+            symbols.append("⇅ Link to another layer")
+        for text in symbols:
+            ctk.CTkLabel(
+                self.legend_frame,
+                text=text,
+                font=("Arial", 10),
+                anchor='w'
+            ).pack(fill='x', pady=2, padx=5)
         
-        # Bind click event
-        self.canvas.bind('<Button-1>', self.on_canvas_click)
+        for text, color in (("━ River", RIVER_COLOR), ("━ Road", ROAD_COLOR)):
+            ctk.CTkLabel(
+                self.legend_frame,
+                text=text,
+                text_color=color,
+                font=("Arial", 10),
+                anchor='w'
+            ).pack(fill='x', pady=2, padx=5)
     
     def save_notes(self):
         """Save notes from the notes text area to the selected hex"""
@@ -1177,42 +5425,112 @@ class HexMapApp:
         else:
             notes_content = ""
         
-        self.map_data['grid'][r][q]['notes'] = notes_content
+        self.apply_hex_changes([(q, r, 'notes', notes_content)], 'notes')
         messagebox.showinfo("Saved", "Notes saved successfully!")
     
     def reveal_selected_hex(self):
         """Reveal the currently selected hex"""
         if self.selected_hex:
             q, r = self.selected_hex
-            self.map_data['grid'][r][q]['explored'] = True
-            self.draw_map()
-            self.update_info_panel(q, r, self.map_data['grid'][r][q])
+            self.apply_hex_changes([(q, r, 'explored', True)], 'reveal')
     
     def hide_selected_hex(self):
         """Hide the currently selected hex"""
         if self.selected_hex:
             q, r = self.selected_hex
-            self.map_data['grid'][r][q]['explored'] = False
-            self.draw_map()
-            self.update_info_panel(q, r, self.map_data['grid'][r][q])
+            self.apply_hex_changes([(q, r, 'explored', False)], 'hide')
+    
+    def on_fog_tool_changed(self, tool: str):
+        """Start a fresh path or polygon when the tool changes"""
+        self.tool_points = []
+        self.draw_tool_preview()
+    
+    def fog_tool_radius(self) -> int:
+        """Radius entered for the radius and line of sight tools"""
+        try:
+            return max(0, int(self.fog_radius_var.get()))
+        except (tk.TclError, ValueError):
+            return 0
+    
+    def use_fog_tool(self, q: float, r: float):
+        """Handle a map click while a bulk reveal tool is active"""
+        tool = self.fog_tool_var.get()
+        if tool in ('Reveal Path', 'Reveal Polygon', 'Regenerate Rectangle'):
+            # Collect points; Apply reveals (or regenerates) them in one go
+            if tool == 'Regenerate Rectangle' and len(self.tool_points) == 2:
+                self.tool_points = []
+            self.tool_points.append((q, r))
+            self.draw_tool_preview()
+            return
+        
+        clicked = self.pixel_to_hex(*self.hex_to_canvas(q, r))
+        if not clicked:
+            return
+        hex_q, hex_r = clicked
+        if tool == 'Reveal Radius':
+            self.reveal_mask(FogTools.radius(self.map_data, hex_q, hex_r, self.fog_tool_radius()))
+        elif tool == 'Reveal Region':
+            hexes = self.biome_regions.hexes(self.biome_regions.region(hex_q, hex_r))
+            self.reveal_mask(HexBitset.from_hexes(self.map_data['width'], self.map_data['height'], hexes))
+        elif tool == 'Line of Sight':
+            self.reveal_mask(FogTools.line_of_sight(self.map_data, hex_q, hex_r, self.fog_tool_radius()))
+        elif tool == 'Regenerate Radius':
+            self.regenerate_hexes(FogTools.radius(self.map_data, hex_q, hex_r, self.fog_tool_radius()))
+    
+    def regenerate_hexes(self, hexes):
+        """Generate new terrain for some hexes as one undoable edit; each call tries a new variation"""
+        changes = MapGenerator.for_map(self.map_data).regenerate_region(hexes)
+        self.apply_hex_changes(changes, 'regenerate')
+    
+    def apply_fog_tool(self):
+        """Reveal the drawn path or polygon, or apply a click tool at the selected hex"""
+        tool = self.fog_tool_var.get()
+        points = self.tool_points
+        if tool == 'Reveal Path' and points:
+            waypoints = [self.pixel_to_hex(*self.hex_to_canvas(q, r)) for q, r in points]
+            self.reveal_mask(FogTools.path(self.map_data, [p for p in waypoints if p]))
+        elif tool == 'Reveal Polygon' and len(points) >= 3:
+            # Hex coordinates to hex_size=1 pixel units, matching HexGrid.axial_to_pixel
+            vertices = [(q * math.sqrt(3), 2 * r + int(q) % 2) for q, r in points]
+            self.reveal_mask(FogTools.polygon(self.map_data, vertices))
+        elif tool == 'Regenerate Rectangle' and len(points) == 2:
+            corners = [self.pixel_to_hex(*self.hex_to_canvas(q, r)) for q, r in points]
+            if all(corners):
+                self.regenerate_hexes(MapGenerator.rectangle(*corners[0], *corners[1]))
+        elif self.selected_hex and tool not in ('Select', 'Reveal Path', 'Reveal Polygon', 'Regenerate Rectangle'):
+            self.use_fog_tool(*self.selected_hex)
+        self.tool_points = []
+        self.draw_tool_preview()
+    
+    def draw_tool_preview(self):
+        """Show the path or polygon being drawn with a bulk reveal tool"""
+        self.canvas.delete('tool_preview')
+        if not self.tool_points:
+            return
+        coords = []
+        for q, r in self.tool_points:
+            coords.extend(self.hex_to_canvas(q, r))
+        if self.fog_tool_var.get() == 'Regenerate Rectangle' and len(self.tool_points) == 2:
+            x0, y0, x1, y1 = coords
+            coords = [x0, y0, x1, y0, x1, y1, x0, y1, x0, y0]
+        elif self.fog_tool_var.get() == 'Reveal Polygon' and len(self.tool_points) >= 3:
+            coords.extend(coords[:2])
+        if len(coords) >= 4:
+            self.canvas.create_line(*coords, fill=SELECTION_COLOR, width=2, dash=(4, 2), tags='tool_preview')
+        for i in range(0, len(coords), 2):
+            x, y = coords[i], coords[i + 1]
+            self.canvas.create_oval(x - 3, y - 3, x + 3, y + 3, fill=SELECTION_COLOR, outline='', tags='tool_preview')
     
     def toggle_fog_of_war(self):
         """Toggle fog of war on/off without affecting explored state"""
         if not self.map_data:
             return
 
-        # Toggle the fog of war state
+        # Toggle the fog of war state (redraws the map and info panel)
         current_state = self.map_data.get('fog_of_war_enabled', True)
-        self.map_data['fog_of_war_enabled'] = not current_state
-
-        # Redraw the map to reflect the change
-        self.draw_map()
-
-        # Update the info panel if a hex is selected
-        if self.selected_hex:
-            q, r = self.selected_hex
-            hex_data = self.map_data['grid'][r][q]
-            self.update_info_panel(q, r, hex_data)
+        diffs = [(-1, 'fog_of_war_enabled', current_state, not current_state)]
+        self.history.record('fog', diffs)
+        self.apply_diffs(diffs, undo=False)
 
         # Show message
         if self.map_data['fog_of_war_enabled']:
@@ -1220,101 +5538,617 @@ class HexMapApp:
         else:
             messagebox.showinfo("Fog of War", "Fog of War disabled - all hexes are now visible")
     
+    def end_session(self):
+        """Record the explored state of the current layer as the end of a play session (undoable)"""
+        if not self.map_data:
+            return
+        self.leave_timeline()
+        sessions = self.map_data.get('sessions', [])
+        session = SessionTimeline.snapshot(self.map_data, f"Session {len(sessions) + 1}")
+        diffs = [(-1, 'sessions', None, session)]
+        self.history.record('session', diffs, coalesce=False)
+        self.apply_diffs(diffs, undo=False)
+        messagebox.showinfo("Session Recorded", f"{session['name']}: {session['hexes']} hexes explored")
+    
+    def update_timeline_controls(self):
+        """Fit the timeline slider to the sessions of the current layer, at the live end"""
+        sessions = self.map_data.get('sessions', [])
+        self.timeline_position = len(sessions)
+        if sessions:
+            # One step per session, plus the live map at the right end
+            self.timeline_slider.configure(to=len(sessions), number_of_steps=len(sessions), state='normal')
+            self.timeline_slider.set(len(sessions))
+            self.timeline_label.configure(text="Now")
+        else:
+            self.timeline_slider.configure(to=1, number_of_steps=1, state='disabled')
+            self.timeline_slider.set(1)
+            self.timeline_label.configure(text="No sessions")
+    
+    def on_timeline_moved(self, value):
+        """Slider callback: show the chosen session once the pending moves settle"""
+        position = int(round(float(value)))
+        if position == self.timeline_position:
+            return
+        self.timeline_position = position
+        if not self.timeline_pending:
+            self.timeline_pending = True
+            self.root.after_idle(self.apply_timeline)
+    
+    def apply_timeline(self):
+        """Show the explored state at the slider's position"""
+        self.timeline_pending = False
+        if self.current_screen != 'map' or not self.map_data:
+            return
+        sessions = self.map_data.get('sessions', [])
+        if self.timeline_position >= len(sessions):
+            self.show_session(None)
+            self.timeline_label.configure(text="Now")
+        else:
+            session = sessions[self.timeline_position]
+            self.show_session(self.timeline_position)
+            self.timeline_label.configure(text=session['name'])
+    
+    def show_session(self, index: Optional[int]):
+        """Show the explored state after a session (None for the live map)
+
+        Only hexes whose explored state differs from what is shown now are
+        refreshed; their canvas items are updated in place.
+        """
+        if index is None:
+            target = None
+        else:
+            if self.timeline_states is None:
+                self.timeline_states = SessionTimeline.states(self.map_data)
+            target = self.timeline_states[index]
+        if target is None and self.timeline_mask is None:
+            return
+        live = None
+        if target is None or self.timeline_mask is None:
+            live = HexBitset.from_field(self.map_data, 'explored')
+        shown = live if self.timeline_mask is None else self.timeline_mask
+        changed = shown ^ (live if target is None else target)
+        self.timeline_mask = target
+        if self.minimap:
+            self.minimap.set_explored(target, changed)
+        if not changed.bits:
+            return
+        self.invalidate_overview()
+        self.refresh_hexes(hex_coords for hex_coords in changed if hex_coords in self.hex_items)
+    
+    def leave_timeline(self):
+        """Go back to the live map if a past session is shown"""
+        if self.timeline_mask is None:
+            return
+        if self.current_screen != 'map':
+            # No map view to update; show_map draws the live map anyway
+            self.timeline_mask = None
+            return
+        self.show_session(None)
+        self.update_timeline_controls()
+    
+    @staticmethod
+    def hex_symbol(hex_data: Dict) -> str:
+        """Symbol shown on a visible hex: settlement, POI(s) or terrain"""
+        if hex_data['settlement']:
+            return '⌂'
+        if hex_data['poi']:
+            # Show different symbol for multiple POIs
+            return '★★' if hex_data['poi'].get('type') == 'multiple' else '★'
+        if hex_data.get('link'):
+            return '⇅'
+        return ALL_TERRAINS[hex_data['terrain']]['symbol']
+    
+    def lod_tier(self) -> str:
+        """Level of detail for the current zoom: 'overview', 'terrain' or 'detail'"""
+        if self.view_hex_size <= LOD_OVERVIEW_MAX_SIZE:
+            return 'overview'
+        if self.view_hex_size < LOD_DETAIL_MIN_SIZE:
+            return 'terrain'
+        return 'detail'
+    
+    def overview_scale(self) -> Tuple[int, int]:
+        """Pixels per hex column and per half hex row of the overview bitmap"""
+        hex_size = self.view_hex_size
+        return max(1, round(hex_size * math.sqrt(3))), max(1, round(hex_size))
+    
+    def hex_to_canvas(self, q: float, r: float) -> Tuple[float, float]:
+        """Canvas position of a (possibly fractional) hex coordinate at the current zoom"""
+        if self.lod_tier() == 'overview':
+            zoom_x, zoom_y = self.overview_scale()
+            return MAP_PADDING + zoom_x * (q + 0.5), MAP_PADDING + zoom_y * (2 * r + int(q) % 2 + 1)
+        x, y = HexGrid.axial_to_pixel(int(q), r, self.view_hex_size)
+        x += (q - int(q)) * self.view_hex_size * math.sqrt(3)
+        return x + MAP_PADDING, y + MAP_PADDING
+    
+    def canvas_to_hex(self, x: float, y: float) -> Tuple[float, float]:
+        """Fractional hex coordinate under a canvas position at the current zoom"""
+        if self.lod_tier() == 'overview':
+            zoom_x, zoom_y = self.overview_scale()
+            q = (x - MAP_PADDING) / zoom_x - 0.5
+            return q, ((y - MAP_PADDING) / zoom_y - 1 - int(q) % 2) / 2
+        hex_size = self.view_hex_size
+        q = (x - MAP_PADDING) / (hex_size * math.sqrt(3))
+        return q, (y - MAP_PADDING - (int(q) % 2) * hex_size) / (2 * hex_size)
+    
+    def pixel_to_hex(self, x: float, y: float) -> Optional[Tuple[int, int]]:
+        """Find the hex containing a canvas position, or None"""
+        width, height = self.map_data['width'], self.map_data['height']
+        hex_size = self.view_hex_size
+        
+        if self.lod_tier() == 'overview':
+            zoom_x, zoom_y = self.overview_scale()
+            q = int((x - MAP_PADDING) // zoom_x)
+            r = int(((y - MAP_PADDING) / zoom_y - q % 2) // 2)
+            if 0 <= q < width and 0 <= r < height:
+                return q, r
+            return None
+        
+        # Check the few hexes around the estimate and keep the nearest center
+        q_guess, r_guess = self.canvas_to_hex(x, y)
+        best, best_distance = None, hex_size
+        for q in range(int(q_guess) - 1, int(q_guess) + 2):
+            for r in range(int(r_guess) - 1, int(r_guess) + 2):
+                if 0 <= q < width and 0 <= r < height and self.map_data['grid'][r][q]:
+                    center_x, center_y = self.hex_to_canvas(q, r)
+                    distance = math.hypot(x - center_x, y - center_y)
+                    if distance < best_distance:
+                        best, best_distance = (q, r), distance
+        return best
+    
+    def visible_hex_range(self) -> Tuple[int, int, int, int]:
+        """Hex range (q0, q1, r0, r1), end-exclusive, covering the visible canvas area"""
+        x0, y0 = self.canvas.canvasx(0), self.canvas.canvasy(0)
+        x1 = self.canvas.canvasx(self.canvas.winfo_width())
+        y1 = self.canvas.canvasy(self.canvas.winfo_height())
+        q0, r0 = self.canvas_to_hex(x0, y0)
+        q1, r1 = self.canvas_to_hex(x1, y1)
+        return (
+            max(0, int(q0) - 1), min(self.map_data['width'], int(q1) + 2),
+            max(0, int(r0) - 1), min(self.map_data['height'], int(r1) + 2)
+        )
+    
+    @staticmethod
+    def hex_color(hex_data: Optional[Dict], fog_enabled: bool, explored: Optional[bool] = None) -> str:
+        """Fill color of a hex given the fog of war state (and explored, to override the hex's own)"""
+        if not hex_data:
+            return CANVAS_BG_COLOR
+        if (hex_data['explored'] if explored is None else explored) or not fog_enabled:
+            return ALL_TERRAINS[hex_data['terrain']]['color']
+        return UNEXPLORED_COLOR
+    
     def draw_map(self):
         """Draw the hex map on canvas"""
         if not self.map_data:
             return
         
         self.canvas.delete('all')
-        hex_size = self.settings['hex_size']
+        self.hex_items = {}
+        self.drawn_range = None
+        self.canvas.configure(scrollregion=self.map_scrollregion())
+        
+        if self.lod_tier() == 'overview':
+            # Zoomed out: one bitmap for the whole map, no per-hex items
+            self.canvas.create_image(
+                MAP_PADDING, MAP_PADDING,
+                image=self.overview_photo(*self.overview_scale()),
+                anchor='nw',
+                tags='overview'
+            )
+        else:
+            self.draw_visible_hexes()
         
-        # Calculate canvas size with extra padding
-        max_x = (self.map_data['width'] + 0.5) * hex_size * math.sqrt(3) + 200
-        max_y = self.map_data['height'] * hex_size * 1.5 + 200
+        self.draw_search_highlights()
+        self.draw_selection()
+        self.draw_tool_preview()
+    
+    def map_scrollregion(self) -> Tuple[float, float, float, float]:
+        """Canvas scroll region for the whole map at the current zoom"""
+        width, height = self.map_data['width'], self.map_data['height']
+        if self.lod_tier() == 'overview':
+            zoom_x, zoom_y = self.overview_scale()
+            max_x = width * zoom_x + 2 * MAP_PADDING
+            max_y = (2 * height + 1) * zoom_y + 2 * MAP_PADDING
+        else:
+            # Calculate canvas size with extra padding
+            hex_size = self.view_hex_size
+            max_x = (width + 0.5) * hex_size * math.sqrt(3) + 2 * MAP_PADDING
+            max_y = (2 * height + 1) * hex_size + 2 * MAP_PADDING
+        return 0, 0, max_x, max_y
+    
+    def draw_visible_hexes(self):
+        """Draw per-hex items for the visible part of the map only
+
+        Hexes already drawn keep their items: after a scroll only the strip
+        that came into range is drawn and the hexes that left it are deleted.
+        """
+        q0, q1, r0, r1 = self.visible_hex_range()
+        # Draw half a screen beyond each edge so small scrolls need no redraw
+        margin_q, margin_r = (q1 - q0) // 2, (r1 - r0) // 2
+        q0, q1 = max(0, q0 - margin_q), min(self.map_data['width'], q1 + margin_q)
+        r0, r1 = max(0, r0 - margin_r), min(self.map_data['height'], r1 + margin_r)
+        
+        drawn = self.drawn_range
+        if drawn is None:
+            self.canvas.delete('hex')
+            self.hex_items = {}
+            drawn = (0, 0, 0, 0)
+        else:
+            gone = [key for key in self.hex_items if not (q0 <= key[0] < q1 and r0 <= key[1] < r1)]
+            items = []
+            for key in gone:
+                items.extend(self.hex_items.pop(key))
+            if items:
+                self.canvas.delete(*items)
+        
+        drawn_q0, drawn_q1, drawn_r0, drawn_r1 = drawn
+        self.drawn_range = (q0, q1, r0, r1)
+        for r in range(r0, r1):
+            row_drawn = drawn_r0 <= r < drawn_r1
+            for q in range(q0, q1):
+                if not (row_drawn and drawn_q0 <= q < drawn_q1):
+                    self.draw_hex(q, r)
+        # New hexes were stacked on top; keep rivers and roads above every hex polygon
+        self.canvas.tag_raise('network')
+        self.draw_borders()
+        self.canvas.tag_raise('search')
+        self.canvas.tag_raise('selection')
+    
+    def draw_borders(self):
+        """Draw biome, fog and grid edges of the drawn range as a few batched polylines"""
+        self.canvas.delete('border')
+        if not self.drawn_range:
+            return
+        hex_size = self.view_hex_size
+        fog_enabled = self.map_data.get('fog_of_war_enabled', True)
+        lines = {
+            kind: HexBorders.chain(segments)
+            for kind, segments in HexBorders.edges(
+                self.map_data['grid'], self.drawn_range, fog_enabled, self.timeline_mask
+            ).items()
+        }
+        if self.settings['show_grid']:
+            lines['grid'] = HexBorders.grid_lines(self.drawn_range)
+        # Grid first so biome and fog borders stay on top of it
+        for kind in ('grid', 'biome', 'fog'):
+            color, width = BORDER_LINES[kind]
+            for line in lines.get(kind, ()):
+                self.canvas.create_line(
+                    HexBorders.coords(line, hex_size, MAP_PADDING),
+                    fill=color,
+                    width=max(1, hex_size * width),
+                    joinstyle='round',
+                    tags='border'
+                )
+    
+    def draw_hex(self, q: int, r: int):
+        """Create the canvas items of one hex at the current zoom, or update them in place"""
+        hex_data = self.map_data['grid'][r][q]
+        if not hex_data:
+            return
         
-        self.canvas.configure(scrollregion=(0, 0, max_x, max_y))
+        hex_size = self.view_hex_size
+        show_detail = self.lod_tier() == 'detail'
+        # The tile atlas needs Pillow; fall back to polygons without it
+        use_atlas = self.settings['renderer'] == 'atlas' and Image is not None
         
-        # Store hex positions for click detection
-        self.hex_positions = []
+        pixel_x, pixel_y = self.hex_to_canvas(q, r)
         
-        # Draw hexes
-        for r in range(self.map_data['height']):
-            for q in range(self.map_data['width']):
-                hex_data = self.map_data['grid'][r][q]
-                if not hex_data:
-                    continue
-                
-                x, y = HexGrid.axial_to_pixel(q, r, hex_size)
-                pixel_x = x + 100
-                pixel_y = y + 100
-
-                terrain = ALL_TERRAINS[hex_data['terrain']]
-                # Show terrain color if either explored OR fog of war is disabled
-                fog_enabled = self.map_data.get('fog_of_war_enabled', True)
-                is_visible = hex_data['explored'] or not fog_enabled
-                color = terrain['color'] if is_visible else '#374151'
-                
-                # Draw hexagon
+        terrain = ALL_TERRAINS[hex_data['terrain']]
+        # Show terrain color if either explored OR fog of war is disabled
+        fog_enabled = self.map_data.get('fog_of_war_enabled', True)
+        if self.timeline_mask is not None:
+            # Replaying a past session on the timeline
+            is_visible = (q, r) in self.timeline_mask or not fog_enabled
+        else:
+            is_visible = hex_data['explored'] or not fog_enabled
+        
+        # Existing items keep their stacking order: reconfigure the base item
+        # and recreate only the text labels
+        old_items = self.hex_items.get((q, r))
+        if old_items:
+            base = old_items[0]
+            self.canvas.delete(*old_items[1:])
+        else:
+            base = None
+        
+        items = []
+        if use_atlas:
+            # One pre-rendered image per hex: fill and symbol together
+            key = TileAtlas.tile_key(hex_data, is_visible, hex_size, show_detail)
+            if base:
+                self.canvas.itemconfigure(base, image=self.atlas.photo(key))
+            else:
+                base = self.canvas.create_image(
+                    pixel_x, pixel_y,
+                    image=self.atlas.photo(key),
+                    tags='hex'
+                )
+            items.append(base)
+            if is_visible:
+                items.extend(self.draw_network(q, r, hex_data))
+        else:
+            color = terrain['color'] if is_visible else UNEXPLORED_COLOR
+            
+            # Draw hexagon
+            if base:
+                self.canvas.itemconfigure(base, fill=color, outline=color)
+            else:
                 corners = HexGrid.get_hex_corners(pixel_x, pixel_y, hex_size)
-                
-                # Highlight selected hex
-                if self.selected_hex and self.selected_hex == (q, r):
-                    outline_color = '#fbbf24'
-                    outline_width = 3
-                else:
-                    outline_color = color
-                    outline_width = 0
-                
-                self.canvas.create_polygon(
+                base = self.canvas.create_polygon(
                     corners,
                     fill=color,
-                    outline=outline_color,
-                    width=outline_width
+                    outline=color,
+                    width=0,
+                    tags='hex'
                 )
-                
-                # Draw symbols - show if either explored OR fog of war is disabled
-                if is_visible:
-                    if hex_data['settlement']:
-                        self.canvas.create_text(
-                            pixel_x, pixel_y,
-                            text='⌂',
-                            font=('Arial', int(hex_size * 0.6)),
-                            fill='white'
-                        )
-                    elif hex_data['poi']:
-                        # Show different symbol for multiple POIs
-                        if hex_data['poi'].get('type') == 'multiple':
-                            symbol = '★★'  # Double star for multiple
-                        else:
-                            symbol = '★'  # Single star
-                        self.canvas.create_text(
-                            pixel_x, pixel_y,
-                            text=symbol,
-                            font=('Arial', int(hex_size * 0.5)),
-                            fill='white'
-                        )
-                    else:
-                        self.canvas.create_text(
-                            pixel_x, pixel_y,
-                            text=terrain['symbol'],
-                            font=('Arial', int(hex_size * 0.5)),
-                            fill='white'
-                        )
-
-                    if self.settings['show_coordinates']:
-                        self.canvas.create_text(
-                            pixel_x, pixel_y + hex_size * 0.6,
-                            text=f"{q},{r}",
-                            font=('Arial', int(hex_size * 0.3)),
-                            fill='#9ca3af'
-                        )
-                
-                # Store position for click detection
-                self.hex_positions.append({
-                    'q': q, 'r': r,
-                    'x': pixel_x, 'y': pixel_y,
-                    'size': hex_size
-                })
+            items.append(base)
+            if is_visible:
+                items.extend(self.draw_network(q, r, hex_data))
+            
+            # Draw symbols - show if either explored OR fog of war is disabled
+            if is_visible and show_detail:
+                symbol = self.hex_symbol(hex_data)
+                items.append(self.canvas.create_text(
+                    pixel_x, pixel_y,
+                    text=symbol,
+                    font=('Arial', int(hex_size * (0.6 if symbol == '⌂' else 0.5))),
+                    fill='white',
+                    tags='hex'
+                ))
+        
+        if is_visible and show_detail and self.settings['show_coordinates']:
+            items.append(self.canvas.create_text(
+                pixel_x, pixel_y + hex_size * 0.6,
+                text=f"{q},{r}",
+                font=('Arial', int(hex_size * 0.3)),
+                fill='#9ca3af',
+                tags='hex'
+            ))
+        
+        self.hex_items[(q, r)] = items
+    
+    def draw_network(self, q: int, r: int, hex_data: Dict) -> List[int]:
+        """Create the river and road lines of one hex (one polyline each)"""
+        items = []
+        for field, color, width in NETWORK_LINES:
+            mask = hex_data.get(field)
+            if mask:
+                items.append(self.canvas.create_line(
+                    HexNetwork.polyline(q, r, mask, self.hex_to_canvas),
+                    fill=color,
+                    width=max(1, self.view_hex_size * width),
+                    capstyle='round',
+                    joinstyle='round',
+                    tags=('hex', 'network')
+                ))
+        return items
+    
+    def refresh_hexes(self, hexes):
+        """Update only the canvas items of the given hexes after they changed"""
+        if self.lod_tier() == 'overview':
+            # The overview bitmap was invalidated by the change; swap in a fresh one
+            self.canvas.itemconfigure('overview', image=self.overview_photo(*self.overview_scale()))
+            return
+        for q, r in hexes:
+            if (q, r) in self.hex_items:
+                self.draw_hex(q, r)
+        # Borders around the changed hexes may have moved; the batch is cheap to rebuild
+        self.draw_borders()
+        self.canvas.tag_raise('search')
+        self.canvas.tag_raise('selection')
+    
+    def draw_selection(self):
+        """Outline the selected hex (a single item moved around, not a redraw)"""
+        self.canvas.delete('selection')
+        if not self.selected_hex:
+            return
+        
+        q, r = self.selected_hex
+        x, y = self.hex_to_canvas(q, r)
+        if self.lod_tier() == 'overview':
+            zoom_x, zoom_y = self.overview_scale()
+            self.canvas.create_rectangle(
+                x - zoom_x / 2, y - zoom_y, x + zoom_x / 2, y + zoom_y,
+                outline=SELECTION_COLOR,
+                width=2,
+                tags='selection'
+            )
+        else:
+            self.canvas.create_polygon(
+                HexGrid.get_hex_corners(x, y, self.view_hex_size),
+                fill='',
+                outline=SELECTION_COLOR,
+                width=3,
+                tags='selection'
+            )
+    
+    def overview_photo(self, zoom_x: int, zoom_y: int):
+        """Downsampled terrain bitmap of the whole map, scaled for the overview tier
+
+        The base image has one pixel per hex column and two per hex row, so odd
+        columns can be shifted by half a hex like on the full map.
+        """
+        if self.overview_base is None:
+            width, height = self.map_data['width'], self.map_data['height']
+            fog_enabled = self.map_data.get('fog_of_war_enabled', True)
+            mask = self.timeline_mask
+            rows = [[CANVAS_BG_COLOR] * width for _ in range(2 * height + 1)]
+            for r, row in enumerate(self.map_data['grid']):
+                for q, hex_data in enumerate(row):
+                    color = self.hex_color(hex_data, fog_enabled, None if mask is None else (q, r) in mask)
+                    top = 2 * r + q % 2
+                    rows[top][q] = rows[top + 1][q] = color
+            
+            self.overview_base = tk.PhotoImage(width=width, height=2 * height + 1)
+            self.overview_base.put(' '.join('{' + ' '.join(row) + '}' for row in rows))
+            self.overview_zoomed = {}
+        
+        zoomed = self.overview_zoomed.get((zoom_x, zoom_y))
+        if zoomed is None:
+            zoomed = self.overview_base.zoom(zoom_x, zoom_y)
+            self.overview_zoomed[(zoom_x, zoom_y)] = zoomed
+        return zoomed
+    
+    def invalidate_overview(self):
+        """Drop the cached overview bitmap after hexes change"""
+        self.overview_base = None
+        self.overview_zoomed = {}
+    
+    def on_canvas_scroll(self, scrollbar, first, last):
+        """Scrollbar callback: update the scrollbar and draw newly exposed hexes"""
+        scrollbar.set(first, last)
+        self.schedule_view_update()
+    
+    def update_minimap_viewport(self):
+        """Show the visible part of the map on the minimap"""
+        if not self.minimap:
+            return
+        q0, r0 = self.canvas_to_hex(self.canvas.canvasx(0), self.canvas.canvasy(0))
+        q1, r1 = self.canvas_to_hex(
+            self.canvas.canvasx(self.canvas.winfo_width()),
+            self.canvas.canvasy(self.canvas.winfo_height())
+        )
+        self.minimap.set_viewport(q0, r0, q1, r1)
+    
+    def center_view_on(self, q: float, r: float):
+        """Scroll the map view so the given hex position is centered"""
+        x, y = self.hex_to_canvas(q, r)
+        _, _, max_x, max_y = self.map_scrollregion()
+        self.canvas.xview_moveto(max(0.0, (x - self.canvas.winfo_width() / 2) / max_x))
+        self.canvas.yview_moveto(max(0.0, (y - self.canvas.winfo_height() / 2) / max_y))
+    
+    def schedule_view_update(self, event=None):
+        """Coalesce scroll and resize events into one update when Tk is idle"""
+        if not self.view_update_pending:
+            self.view_update_pending = True
+            self.canvas.after_idle(self.update_view)
+    
+    def update_view(self):
+        """Redraw the per-hex items if the visible range left the drawn range"""
+        self.view_update_pending = False
+        if not self.map_data:
+            return
+        self.update_minimap_viewport()
+        if self.lod_tier() == 'overview' or self.drawn_range is None:
+            return
+        q0, q1, r0, r1 = self.visible_hex_range()
+        drawn_q0, drawn_q1, drawn_r0, drawn_r1 = self.drawn_range
+        if q0 < drawn_q0 or q1 > drawn_q1 or r0 < drawn_r0 or r1 > drawn_r1:
+            self.draw_visible_hexes()
+    
+    def on_mouse_wheel(self, event):
+        """Zoom the map view in or out around the mouse pointer"""
+        if event.num == 4 or event.delta > 0:
+            step = 1
+        elif event.num == 5 or event.delta < 0:
+            step = -1
+        else:
+            return
+        
+        index = min(range(len(ZOOM_LEVELS)), key=lambda i: abs(ZOOM_LEVELS[i] - self.view_hex_size))
+        index = max(0, min(len(ZOOM_LEVELS) - 1, index + step))
+        if ZOOM_LEVELS[index] == self.view_hex_size:
+            return
+        
+        # Remember which map position is under the pointer
+        q, r = self.canvas_to_hex(self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        
+        self.view_hex_size = ZOOM_LEVELS[index]
+        
+        # Scroll so the same map position stays under the pointer, then draw
+        _, _, max_x, max_y = self.map_scrollregion()
+        self.canvas.configure(scrollregion=(0, 0, max_x, max_y))
+        x, y = self.hex_to_canvas(q, r)
+        self.canvas.xview_moveto(max(0.0, (x - event.x) / max_x))
+        self.canvas.yview_moveto(max(0.0, (y - event.y) / max_y))
+        self.draw_map()
+    
+    def on_canvas_press(self, event):
+        """Start a possible drag pan; a release without dragging is a click"""
+        self.canvas.focus_set()
+        self.canvas.scan_mark(event.x, event.y)
+        self.drag_start = (event.x, event.y)
+        self.drag_panning = False
+    
+    def on_canvas_drag(self, event):
+        """Pan the map with the pointer, moving the view at most once per frame"""
+        if self.drag_start is None:
+            return
+        if not self.drag_panning:
+            start_x, start_y = self.drag_start
+            if abs(event.x - start_x) < DRAG_THRESHOLD and abs(event.y - start_y) < DRAG_THRESHOLD:
+                return
+            self.drag_panning = True
+            self.canvas.configure(cursor='fleur')
+        # Motion events arrive faster than frames: keep the latest and apply it once
+        self.drag_target = (event.x, event.y)
+        if not self.pan_pending:
+            self.pan_pending = True
+            self.canvas.after(PAN_FRAME_MS, self.apply_pan)
+    
+    def apply_pan(self):
+        """Move the view to the latest drag position"""
+        self.pan_pending = False
+        if self.drag_target and self.canvas:
+            self.canvas.scan_dragto(*self.drag_target, gain=1)
+    
+    def on_canvas_release(self, event):
+        """Finish a drag pan, or handle the press as a click"""
+        if self.drag_panning:
+            self.canvas.scan_dragto(event.x, event.y, gain=1)
+            self.canvas.configure(cursor='')
+        elif self.drag_start is not None:
+            self.on_canvas_click(event)
+        self.drag_start = None
+        self.drag_target = None
+        self.drag_panning = False
+    
+    def on_arrow_key(self, event):
+        """Step the selection to the neighboring hex and keep it in view"""
+        if self.selected_hex:
+            q, r = HexGrid.get_neighbors(*self.selected_hex)[ARROW_KEY_SIDES[event.keysym]]
+        else:
+            # Nothing selected yet: start from the middle of the view
+            q, r = (int(value) for value in self.canvas_to_hex(
+                self.canvas.canvasx(self.canvas.winfo_width() / 2),
+                self.canvas.canvasy(self.canvas.winfo_height() / 2)
+            ))
+        if not (0 <= q < self.map_data['width'] and 0 <= r < self.map_data['height']):
+            return 'break'
+        if not self.map_data['grid'][r][q]:
+            return 'break'
+        
+        self.selected_hex = (q, r)
+        self.scroll_into_view(q, r)
+        self.draw_selection()
+        # Held keys repeat quickly; fill the info panel once the repeats settle
+        if not self.info_update_pending:
+            self.info_update_pending = True
+            self.root.after_idle(self.update_selected_info)
+        return 'break'
+    
+    def update_selected_info(self):
+        """Show the selected hex in the info panel"""
+        self.info_update_pending = False
+        if self.current_screen == 'map' and self.selected_hex:
+            q, r = self.selected_hex
+            self.update_info_panel(q, r, self.map_data['grid'][r][q])
+    
+    def scroll_into_view(self, q: int, r: int):
+        """Scroll just far enough that the hex and a margin around it are visible"""
+        x, y = self.hex_to_canvas(q, r)
+        margin = self.view_hex_size * 2
+        _, _, max_x, max_y = self.map_scrollregion()
+        left, top = self.canvas.canvasx(0), self.canvas.canvasy(0)
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if x - margin < left:
+            self.canvas.xview_moveto(max(0.0, (x - margin) / max_x))
+        elif x + margin > left + width:
+            self.canvas.xview_moveto((x + margin - width) / max_x)
+        if y - margin < top:
+            self.canvas.yview_moveto(max(0.0, (y - margin) / max_y))
+        elif y + margin > top + height:
+            self.canvas.yview_moveto((y + margin - height) / max_y)
     
     def on_canvas_click(self, event):
         """Handle canvas click events"""
@@ -1322,26 +6156,104 @@ class HexMapApp:
         canvas_x = self.canvas.canvasx(event.x)
         canvas_y = self.canvas.canvasy(event.y)
         
+        # Bulk reveal tools take the click instead of selecting
+        if self.fog_tool_var.get() != 'Select':
+            self.use_fog_tool(*self.canvas_to_hex(canvas_x, canvas_y))
+            return
+        
         # Find clicked hex
-        for hex_pos in self.hex_positions:
-            distance = math.sqrt(
-                (canvas_x - hex_pos['x']) ** 2 +
-                (canvas_y - hex_pos['y']) ** 2
-            )
+        clicked = self.pixel_to_hex(canvas_x, canvas_y)
+        if clicked:
+            q, r = clicked
+            hex_data = self.map_data['grid'][r][q]
             
-            if distance < hex_pos['size']:
-                q, r = hex_pos['q'], hex_pos['r']
-                hex_data = self.map_data['grid'][r][q]
-                
-                # Select this hex
-                self.selected_hex = (q, r)
-                
-                # Update info panel
-                self.update_info_panel(q, r, hex_data)
-                
-                # Redraw to show selection
-                self.draw_map()
-                break
+            # Select this hex
+            self.selected_hex = (q, r)
+            
+            # Update info panel
+            self.update_info_panel(q, r, hex_data)
+            
+            # Move the selection outline; the hexes themselves did not change
+            self.draw_selection()
+    
+    def schedule_statistics_update(self):
+        """Refresh the statistics panel once after a batch of edits"""
+        if not self.statistics_pending and self.current_screen == 'map':
+            self.statistics_pending = True
+            self.root.after_idle(self.update_statistics_panel)
+    
+    def update_statistics_panel(self):
+        self.statistics_pending = False
+        if self.current_screen == 'map' and self.statistics:
+            self.stats_label.configure(text=self.statistics.summary())
+    
+    def export_statistics(self):
+        """Save the map statistics as CSV"""
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
+            initialfile=f"hexmap_stats_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        )
+        if not filename:
+            return
+        try:
+            self.statistics.export_csv(filename)
+            messagebox.showinfo("Success", f"Statistics exported to {filename}")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to export statistics: {str(e)}")
+    
+    def run_search(self, event=None):
+        """Search notes and names; repeating a search steps through the matches"""
+        query = self.search_var.get().strip()
+        if not query or not self.search_index:
+            self.search_results = []
+            self.search_query = ''
+            self.search_status.configure(text="")
+            self.draw_search_highlights()
+            return
+        
+        if query == self.search_query and self.search_results:
+            # Same query again: move on to the next match
+            self.search_position = (self.search_position + 1) % len(self.search_results)
+        else:
+            self.search_query = query
+            self.search_results = self.search_index.search(query)
+            self.search_position = 0
+            self.draw_search_highlights()
+        
+        if not self.search_results:
+            self.search_status.configure(text="No matches")
+            return
+        
+        self.search_status.configure(text=f"{self.search_position + 1} of {len(self.search_results)}")
+        q, r = self.search_results[self.search_position]
+        self.selected_hex = (q, r)
+        self.center_view_on(q, r)
+        self.update_info_panel(q, r, self.map_data['grid'][r][q])
+        self.draw_selection()
+    
+    def draw_search_highlights(self):
+        """Outline every hex matching the current search"""
+        self.canvas.delete('search')
+        overview = self.lod_tier() == 'overview'
+        for q, r in self.search_results:
+            x, y = self.hex_to_canvas(q, r)
+            if overview:
+                zoom_x, zoom_y = self.overview_scale()
+                self.canvas.create_rectangle(
+                    x - zoom_x / 2, y - zoom_y, x + zoom_x / 2, y + zoom_y,
+                    outline=SEARCH_HIGHLIGHT_COLOR,
+                    tags='search'
+                )
+            else:
+                self.canvas.create_polygon(
+                    HexGrid.get_hex_corners(x, y, self.view_hex_size * 0.85),
+                    fill='',
+                    outline=SEARCH_HIGHLIGHT_COLOR,
+                    width=2,
+                    tags='search'
+                )
+        self.canvas.tag_raise('selection')
     
     def update_info_panel(self, q, r, hex_data):
         """Update the notes panel with hex details and notes"""
@@ -1372,7 +6284,9 @@ class HexMapApp:
             # Add hex info at the top
             info_text = f"Hex ({q}, {r})\n"
             info_text += f"{'='*30}\n\n"
-            info_text += f"Terrain: {terrain['name']}\n\n"
+            info_text += f"Terrain: {terrain['name']}\n"
+            region_size = self.biome_regions.size[self.biome_regions.region(q, r)]
+            info_text += f"Region: {region_size} contiguous {terrain['name']} hex{'es' if region_size != 1 else ''}\n\n"
 
             if hex_data['settlement']:
                 info_text += f"Settlement: {hex_data['settlement']['name']}\n"
@@ -1386,6 +6300,13 @@ class HexMapApp:
                     info_text += f"POIs ({hex_data['poi']['count']}): {hex_data['poi']['name']}\n\n"
                 else:
                     info_text += f"POI: {hex_data['poi']['name']}\n\n"
+            
+            if hex_data.get('link'):
+                info_text += f"Link: leads to the {hex_data['link']} (⇅ Follow Link)\n\n"
+            
+            crossings = [name for field, name in (('river', 'River'), ('road', 'Road')) if hex_data.get(field)]
+            if crossings:
+                info_text += f"{' and '.join(crossings)} through this hex\n\n"
 
             status_text = "EXPLORED" if hex_data['explored'] else "UNEXPLORED"
             info_text += f"Status: {status_text}\n"
@@ -1399,8 +6320,9 @@ class HexMapApp:
             self.notes_text.insert('0.0', info_text)
 
             # Add existing notes after the separator
-            if 'notes' in hex_data and hex_data['notes']:
-                self.notes_text.insert('end', hex_data['notes'])
+            notes = hex_data.get('notes', HEX_DEFAULTS['notes'])
+            if notes:
+                self.notes_text.insert('end', notes)
 
             # Enable save button
             self.save_notes_btn.configure(state='normal')
@@ -1418,12 +6340,160 @@ class HexMapApp:
         
         if filename:
             try:
-                with open(filename, 'w') as f:
-                    json.dump(self.map_data, f, indent=2)
+                MapSerializer.save(self.layers.document(), filename)
+                # The full export supersedes everything journaled so far
+                if self.journal and filename == self.map_path:
+                    self.journal.reset()
+                else:
+                    self.attach_journal(filename, truncate=True)
                 messagebox.showinfo("Export", "Map exported successfully!")
             except Exception as e:
                 messagebox.showerror("Export Error", f"Failed to export map:\n{str(e)}")
     
+    def export_image(self):
+        """Export the map as a PNG or SVG handout in a background thread"""
+        if not self.map_data or self.export_running():
+            return
+        
+        filename = filedialog.asksaveasfilename(
+            defaultextension='.png',
+            filetypes=[('PNG image', '*.png'), ('SVG image', '*.svg'), ('All files', '*.*')],
+            initialfile=f"hex-map-{datetime.now().strftime('%Y-%m-%d')}.png"
+        )
+        if not filename:
+            return
+        
+        player_view = messagebox.askyesno(
+            "Export Image",
+            "Export the player version?\n\nYes hides unexplored hexes, No shows the full GM map."
+        )
+        exporter = MapImageExporter(self.map_data, self.settings['hex_size'], player_view)
+        self.start_export("image", lambda report: exporter.export(filename, report),
+                          lambda result: "Image exported successfully!")
+    
+    def export_tiles(self):
+        """Export or update the player tile pyramid in a worker process"""
+        if not self.map_data or self.export_running():
+            return
+        
+        directory = filedialog.askdirectory(title="Choose a folder for the map tiles")
+        if not directory:
+            return
+        
+        self.tiles_dir = directory
+        if self.map_server:
+            self.map_server.tiles_dir = directory
+        if self.shared_grid is None:
+            self.shared_grid = SharedGridPlanes.create(self.map_data)
+        descriptor = self.shared_grid.descriptor()
+        hex_size = self.settings['hex_size']
+        
+        def task(report):
+            # The worker renders a consistent snapshot of the shared grid while reveals go on
+            import multiprocessing
+            context = multiprocessing.get_context('spawn')
+            messages = context.Queue()
+            process = context.Process(target=export_tiles_worker, args=(descriptor, directory, hex_size, messages),
+                                      daemon=True)
+            process.start()
+            while True:
+                try:
+                    kind, value = messages.get(timeout=0.5)
+                except queue.Empty:
+                    if not process.is_alive():
+                        raise RuntimeError("The tile export process stopped unexpectedly")
+                    continue
+                if kind == 'progress':
+                    report(value)
+                    continue
+                process.join()
+                if kind == 'error':
+                    raise RuntimeError(value)
+                return value
+        
+        self.start_export("tiles", task,
+                          lambda written: f"Tiles exported successfully!\n{written} tiles changed since the last export.")
+    
+    def toggle_map_server(self):
+        """Start or stop sharing the player view of this map on the LAN"""
+        if self.map_server:
+            self.stop_map_server()
+            messagebox.showinfo("Share Map", "Map sharing stopped.")
+            return
+        
+        try:
+            self.map_server = MapServer(self.map_data, tiles_dir=self.tiles_dir)
+        except OSError as e:
+            messagebox.showerror("Share Map", f"Failed to start the map server:\n{str(e)}")
+            return
+        self.map_server.start()
+        
+        import socket
+        try:
+            address = socket.gethostbyname(socket.gethostname())
+        except OSError:
+            address = 'localhost'
+        messagebox.showinfo(
+            "Share Map",
+            f"Sharing the player view at http://{address}:{self.map_server.port}/api/map\n\n"
+            "Unexplored hexes stay hidden. Export tiles to also serve the map viewer."
+        )
+    
+    def stop_map_server(self):
+        """Stop the LAN map server, if running"""
+        if self.map_server:
+            self.map_server.stop()
+            self.map_server = None
+    
+    def export_running(self) -> bool:
+        """Whether a background export is in progress (tells the user if so)"""
+        if self.export_thread and self.export_thread.is_alive():
+            messagebox.showinfo("Export", "An export or generation is already running.")
+            return True
+        return False
+    
+    def start_export(self, what: str, task, describe_result, on_done=None):
+        """Run task(report_progress) in a worker thread and report back on the GUI thread
+
+        on_done(result), if given, is called on the GUI thread before the result
+        is described; such tasks are reported as generating rather than exporting.
+        describe_result may return None to skip the message.
+        """
+        self.export_state = {'what': what, 'progress': 0.0, 'result': None, 'error': None,
+                             'describe': describe_result, 'on_done': on_done}
+        
+        def report(fraction):
+            self.export_state['progress'] = fraction
+        
+        def worker():
+            try:
+                self.export_state['result'] = task(report)
+            except Exception as e:
+                self.export_state['error'] = e
+        
+        self.export_thread = threading.Thread(target=worker, daemon=True)
+        self.export_thread.start()
+        self.root.after(200, self.poll_export)
+    
+    def poll_export(self):
+        """Show background export progress and report the result when done"""
+        state = self.export_state
+        verb = 'generate' if state['on_done'] else 'export'
+        if self.export_thread.is_alive():
+            self.root.title(f"Hex Map Generator - West Marches ({verb[:-1]}ing {state['what']} {state['progress']:.0%})")
+            self.root.after(200, self.poll_export)
+            return
+        
+        self.root.title("Hex Map Generator - West Marches")
+        if state['error']:
+            messagebox.showerror(f"{verb.title()} Error", f"Failed to {verb} {state['what']}:\n{str(state['error'])}")
+            return
+        if state['on_done']:
+            state['on_done'](state['result'])
+        message = state['describe'](state['result'])
+        if message:
+            messagebox.showinfo(verb.title(), message)
+    
     def load_map(self):
         """Load map from JSON file"""
         filename = filedialog.askopenfilename(
@@ -1431,31 +6501,154 @@ class HexMapApp:
         )
         
         if filename:
+            # A map that is already open is switched to rather than read again
+            if self.workspace.find(path=filename):
+                self.switch_tab(self.workspace.find(path=filename).title)
+                return
             try:
-                with open(filename, 'r') as f:
-                    self.map_data = json.load(f)
+                map_data = MapSerializer.load(filename)
                 
-                # Add notes field to hexes that don't have it (backwards compatibility)
-                for r in range(self.map_data['height']):
-                    for q in range(self.map_data['width']):
-                        if self.map_data['grid'][r][q] and 'notes' not in self.map_data['grid'][r][q]:
-                            self.map_data['grid'][r][q]['notes'] = ''
-
-                # Add fog_of_war_enabled field if it doesn't exist (backwards compatibility)
-                if 'fog_of_war_enabled' not in self.map_data:
-                    self.map_data['fog_of_war_enabled'] = True
-                
-                self.show_map()
+                # Replay changes autosaved after the last snapshot
+                MapJournal.replay(filename, map_data)
             except Exception as e:
                 messagebox.showerror("Load Error", f"Failed to load map:\n{str(e)}")
+                return
+            self.open_tab(map_data, filename)
+            self.show_map()
 
 
 def main():
     """Main entry point"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Hex Map Generator - West Marches")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="run the map save/load benchmarks and exit")
+    parser.add_argument('--benchmark-render', action='store_true',
+                        help="compare the polygon and tile atlas renderers on a 150x150 map and exit")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="time GUI startup and screen switches and exit (add python -X importtime for imports)")
+    parser.add_argument('--export-image', nargs=2, metavar=('MAP', 'IMAGE'),
+                        help="render a saved map to a .png or .svg file without opening the GUI")
+    parser.add_argument('--export-tiles', nargs=2, metavar=('MAP', 'DIRECTORY'),
+                        help="write or update a z/x/y tile pyramid of the revealed map for browsers")
+    parser.add_argument('--serve', metavar='MAP',
+                        help="share the player view of a saved map on the LAN (read-only) until interrupted")
+    parser.add_argument('--port', type=int, default=MAP_SERVER_PORT,
+                        help=f"with --serve, port to listen on (default: {MAP_SERVER_PORT})")
+    parser.add_argument('--tiles', metavar='DIRECTORY',
+                        help="with --serve, also serve tiles from an --export-tiles folder")
+    parser.add_argument('--player', action='store_true',
+                        help="with --export-image, hide unexplored hexes")
+    parser.add_argument('--hex-size', type=int, default=25,
+                        help="with --export-image/--export-tiles, hex size in pixels (default: 25)")
+    parser.add_argument('--layer', default=MapLayers.SURFACE,
+                        help="with --export-image/--export-tiles/--serve, map layer to use (default: Surface)")
+    parser.add_argument('--generate', metavar='MAP',
+                        help="generate a map into a JSON file without opening the GUI")
+    parser.add_argument('--size', default='25x20', metavar='WxH',
+                        help="with --generate, map size in hexes (default: 25x20)")
+    parser.add_argument('--start', choices=['N', 'S', 'E', 'W'], default='W',
+                        help="with --generate, starting edge (default: W)")
+    parser.add_argument('--faction', action='append', default=[],
+                        help="with --generate, add a faction (repeatable)")
+    parser.add_argument('--location', action='append', default=[],
+                        help="with --generate, add a custom location (repeatable)")
+    parser.add_argument('--seed', type=int,
+                        help="with --generate, seed to generate from (default: random)")
+    parser.add_argument('--best-of', type=int, default=1, metavar='N',
+                        help="with --generate, keep the best scoring of N candidates")
+    parser.add_argument('--underdark', action='store_true',
+                        help="with --generate, add an underdark layer linked at caves and dungeons")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="always generate maps instead of reusing cached ones")
+    parser.add_argument('--memory-budget', type=int, default=WORKSPACE_MEMORY_BUDGET_MB, metavar='MB',
+                        help=f"memory for maps open in inactive tabs before they are compressed or "
+                             f"spilled to disk (default: {WORKSPACE_MEMORY_BUDGET_MB})")
+    args = parser.parse_args()
+    
+    if args.export_image:
+        map_path, image_path = args.export_image
+        map_data = MapSerializer.load(map_path)
+        MapJournal.replay(map_path, map_data)
+        map_data = MapLayers(map_data).layer_map(args.layer)
+        MapImageExporter(map_data, args.hex_size, args.player).export(image_path)
+        return
+    if args.export_tiles:
+        map_path, directory = args.export_tiles
+        map_data = MapSerializer.load(map_path)
+        MapJournal.replay(map_path, map_data)
+        map_data = MapLayers(map_data).layer_map(args.layer)
+        written = TilePyramidExporter(map_data, args.hex_size).export(directory)
+        print(f"{written} tiles written")
+        return
+    if args.serve:
+        map_data = MapSerializer.load(args.serve)
+        MapJournal.replay(args.serve, map_data)
+        map_data = MapLayers(map_data).layer_map(args.layer)
+        server = MapServer(map_data, args.port, args.tiles)
+        print(f"Serving {args.serve} on port {server.port} (Ctrl+C to stop)")
+        try:
+            server.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.httpd.server_close()
+        return
+    
+    if args.generate:
+        width, height = (int(n) for n in args.size.lower().split('x'))
+        params = (width, height, args.start, args.faction, args.location)
+        lower_sets = ['underdark'] if args.underdark else []
+        cache = None if args.no_cache else GenerationCache()
+        if args.best_of > 1:
+            score, seed, scores, grid, climate = generate_best_of(*params, candidates=args.best_of, seed=args.seed)[0]
+            print(f"Best of {args.best_of} candidates: score {score:.2f}")
+            grids = generate_layers(*params, lower_sets, [seed], cache=cache)
+        else:
+            started = time.perf_counter()
+            seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+            grids = generate_layers(*params, ['surface'] + lower_sets, [seed], cache=cache)
+            grid, climate = grids[(seed, 'surface')]
+            print(f"Generated in {time.perf_counter() - started:.2f}s")
+        map_data = {
+            'grid': grid,
+            'width': width,
+            'height': height,
+            'start_direction': args.start,
+            'factions': args.faction,
+            'custom_locations': args.location,
+            'created_at': datetime.now().isoformat(),
+            'seed': seed,
+            'fog_of_war_enabled': True,
+            'climate': climate
+        }
+        for terrain_set in lower_sets:
+            layer = MapLayers.add(map_data, grids[(seed, terrain_set)][0], terrain_set)
+            links = MapLayers.link(grid, layer['grid'], MapLayers.SURFACE, layer['name'])
+            print(f"{layer['name']} layer linked to the surface at {links} caves and dungeons")
+        MapSerializer.save(MapLayers(map_data).document(), args.generate)
+        print(f"Saved {args.generate} (seed {seed})")
+        return
+    
+    if args.benchmark:
+        benchmark_serialization()
+        return
+    if args.benchmark_render:
+        benchmark_renderers()
+        return
+    if args.profile_startup:
+        profile_startup()
+        return
+    
+    load_gui()
     root = ctk.CTk()
-    app = HexMapApp(root)
+    app = HexMapApp(root, use_cache=not args.no_cache, memory_budget_mb=args.memory_budget)
     root.mainloop()
 
 
 if __name__ == '__main__':
+    if getattr(sys, 'frozen', False):
+        # Needed for the candidate worker processes in the PyInstaller build
+        import multiprocessing
+        multiprocessing.freeze_support()
     main()